@@ -5,13 +5,16 @@ Copyright Enrique Martín <emartinm@ucm.es> 2020
 Customize how to show add/edit forms for objects in the Admin
 """
 
-from django.contrib import admin
+from django.contrib import admin, messages
 
 from . import forms
+from .exceptions import ZipFileParsingException
+from .export import export_response
 from .models import Collection, SelectProblem, DMLProblem, FunctionProblem, ProcProblem, TriggerProblem, Problem, \
     Submission, AchievementDefinition, NumSolvedCollectionAchievementDefinition, PodiumAchievementDefinition, \
     NumSolvedAchievementDefinition, ObtainedAchievement, DiscriminantProblem, NumSolvedTypeAchievementDefinition, \
-    NumSubmissionsProblemsAchievementDefinition, Hint, UsedHint
+    NumSubmissionsProblemsAchievementDefinition, Hint, UsedHint, ImportJob
+from .types import ImportState
 
 
 class SelectProblemAdmin(admin.ModelAdmin):
@@ -21,6 +24,7 @@ class SelectProblemAdmin(admin.ModelAdmin):
         ('Basic Information', {'fields': ['language', 'title_md', 'text_md', 'min_stmt', 'max_stmt', 'collection',
                                           'author', 'position', 'check_order']}),
         ('SQL', {'fields': ['create_sql', 'insert_sql', 'solution']}),
+        ('Limits (empty to use the global limits)', {'fields': ['stmt_timeout_ms', 'max_rows', 'max_tables']}),
     ]
     list_display = ('title_md', 'creation_date', 'collection')
     list_filter = ['collection', 'creation_date']
@@ -33,6 +37,7 @@ class DMLProblemAdmin(admin.ModelAdmin):
         ('Basic Information', {'fields': ['language', 'title_md', 'text_md', 'min_stmt', 'max_stmt', 'collection',
                                           'author', 'position', 'check_order']}),
         ('SQL', {'fields': ['create_sql', 'insert_sql', 'solution']}),
+        ('Limits (empty to use the global limits)', {'fields': ['stmt_timeout_ms', 'max_rows', 'max_tables']}),
     ]
     list_display = ('title_md', 'creation_date', 'collection')
     list_filter = ['collection', 'creation_date']
@@ -45,6 +50,7 @@ class FunctionProblemAdmin(admin.ModelAdmin):
         ('Basic Information', {'fields': ['language', 'title_md', 'text_md', 'min_stmt', 'max_stmt', 'collection',
                                           'author', 'position', 'check_order']}),
         ('SQL', {'fields': ['create_sql', 'insert_sql', 'solution', 'calls']}),
+        ('Limits (empty to use the global limits)', {'fields': ['stmt_timeout_ms', 'max_rows', 'max_tables']}),
     ]
     list_display = ('title_md', 'creation_date', 'collection')
     list_filter = ['collection', 'creation_date']
@@ -58,6 +64,7 @@ class ProcProblemAdmin(admin.ModelAdmin):
         ('Basic Information', {'fields': ['language', 'title_md', 'text_md', 'min_stmt', 'max_stmt', 'collection',
                                           'author', 'position', 'check_order']}),
         ('SQL', {'fields': ['create_sql', 'insert_sql', 'solution', 'proc_call']}),
+        ('Limits (empty to use the global limits)', {'fields': ['stmt_timeout_ms', 'max_rows', 'max_tables']}),
     ]
     list_display = ('title_md', 'creation_date', 'collection')
     list_filter = ['collection', 'creation_date']
@@ -71,6 +78,7 @@ class TriggerProblemAdmin(admin.ModelAdmin):
         ('Basic Information', {'fields': ['language', 'title_md', 'text_md', 'min_stmt', 'max_stmt', 'collection',
                                           'author', 'position', 'check_order']}),
         ('SQL', {'fields': ['create_sql', 'insert_sql', 'solution', 'tests']}),
+        ('Limits (empty to use the global limits)', {'fields': ['stmt_timeout_ms', 'max_rows', 'max_tables']}),
     ]
     list_display = ('title_md', 'creation_date', 'collection')
     list_filter = ['collection', 'creation_date']
@@ -84,6 +92,7 @@ class DiscriminantProblemAdmin(admin.ModelAdmin):
         ('Basic Information', {'fields': ['language', 'title_md', 'text_md', 'min_stmt', 'max_stmt', 'collection',
                                           'author', 'position', 'check_order']}),
         ('SQL', {'fields': ['create_sql', 'insert_sql', 'correct_query', 'incorrect_query']}),
+        ('Limits (empty to use the global limits)', {'fields': ['stmt_timeout_ms', 'max_rows', 'max_tables']}),
     ]
     list_display = ('title_md', 'creation_date', 'collection')
     list_filter = ['collection', 'creation_date']
@@ -93,18 +102,91 @@ class CollectionAdmin(admin.ModelAdmin):
     """Model for Collection"""
     # define get_fieldsets(self, request, obj=None) to have a dynamic behavior
     fieldsets = [
-        ('Load problems from ZIP (only if the collection exists). The new problems will be added',
+        ('Load problems from ZIP. The new problems will be validated and added in background (see Import jobs)',
          {'fields': ('zipfile', )}),
         ('Collection data', {'fields': ('name_md', 'position', 'description_md', 'author')})
     ]
     list_display = ('name_md', 'author', 'creation_date')
     list_filter = ['creation_date']
+    form = forms.CollectionAdminForm
+    actions = ['export']
+
+    @admin.action(description='Export selected collections to ZIP')
+    def export(self, _, queryset):
+        """Downloads the selected collections in the ZIP format used to load them"""
+        return export_response(list(queryset.order_by('position', 'pk')))
+
+    def save_model(self, request, obj, form, change):
+        """Saves the collection and starts the import of the problems of the ZIP file, if any"""
+        super().save_model(request, obj, form, change)
+        if obj.pending_problems:
+            job = ImportJob.objects.create(collection=obj, author=request.user, total=len(obj.pending_problems),
+                                           zip_data=obj.pending_zip)
+            job.start(obj.pending_problems)
+            obj.pending_problems = None
+            obj.pending_zip = None
+            self.message_user(request, f'Importing {job.total} problems in background, see the progress in Import '
+                                       f'jobs')
+
+
+class ImportJobAdmin(admin.ModelAdmin):
+    """Model for ImportJob, to see the progress and errors of the imports and restart the failed ones"""
+    list_display = ('collection', 'state', 'processed', 'unchanged', 'total', 'author', 'creation_date', 'finish_date')
+    list_filter = ['state', 'creation_date']
+    readonly_fields = ('collection', 'author', 'state', 'total', 'processed', 'unchanged', 'errors', 'creation_date',
+                       'finish_date', 'heartbeat')
+    actions = ['restart']
+
+    def has_add_permission(self, request):
+        return False
+
+    def changelist_view(self, request, extra_context=None):
+        """Marks as FAILED the jobs interrupted by a restart of the server before listing them"""
+        ImportJob.fail_stale()
+        return super().changelist_view(request, extra_context)
+
+    @admin.action(description='Restart selected failed import jobs')
+    def restart(self, request, queryset):
+        """Runs again the failed jobs that still have their ZIP file"""
+        for job in queryset.filter(state=ImportState.FAILED, zip_data__isnull=False).select_related('collection'):
+            try:
+                job.restart()
+                self.message_user(request, f'Restarted the import of {job.total} problems in {job.collection}')
+            except ZipFileParsingException as excp:
+                self.message_user(request, f'Unable to restart the import in {job.collection}: {excp}',
+                                  messages.ERROR)
+
+
+class ExecutionTimeFilter(admin.SimpleListFilter):
+    """Filters submissions by the time spent executing the code of the student"""
+    title = 'execution time'
+    parameter_name = 'execution_time'
+    # (lookup, description, lower bound in seconds, upper bound in seconds)
+    RANGES = [
+        ('fast', '< 0.1 s', None, 0.1),
+        ('medium', '0.1 s - 1 s', 0.1, 1),
+        ('slow', '1 s - 5 s', 1, 5),
+        ('very_slow', '> 5 s', 5, None),
+    ]
+
+    def lookups(self, request, model_admin):
+        return [(lookup, description) for lookup, description, _, _ in self.RANGES]
+
+    def queryset(self, request, queryset):
+        for lookup, _, lower, upper in self.RANGES:
+            if self.value() == lookup:
+                if lower is not None:
+                    queryset = queryset.filter(execution_time__gte=lower)
+                if upper is not None:
+                    queryset = queryset.filter(execution_time__lt=upper)
+        return queryset
 
 
 class SubmissionAdmin(admin.ModelAdmin):
     """Model for Submission"""
-    list_display = ('pk', 'user', 'problem', 'veredict_code', 'creation_date')
-    list_filter = ['creation_date', 'veredict_code', 'user']
+    list_display = ('pk', 'user', 'problem', 'veredict_code', 'creation_date', 'execution_time', 'judge_time',
+                    'queue_time', 'num_rows')
+    list_filter = ['creation_date', 'veredict_code', ExecutionTimeFilter, 'problem', 'user']
 
 
 class ProblemAdmin(admin.ModelAdmin):
@@ -154,6 +236,7 @@ class HintAdmin(admin.ModelAdmin):
     """Model for Hints"""
     list_display = ('text_md', 'problem', 'num_submit')
     list_filter = ['problem']
+    exclude = ['text_html']  # Generated when saved
 
 
 class UsedHintAdmin(admin.ModelAdmin):
@@ -180,3 +263,4 @@ admin.site.register(NumSolvedTypeAchievementDefinition, NumSolvedTypeAchievement
 admin.site.register(NumSubmissionsProblemsAchievementDefinition, NumSubmissionsProblemsAchievementDefinitionAdmin)
 admin.site.register(Hint, HintAdmin)
 admin.site.register(UsedHint, UsedHintAdmin)
+admin.site.register(ImportJob, ImportJobAdmin)
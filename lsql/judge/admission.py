@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright Enrique Martín <emartinm@ucm.es> 2021
+
+Admission control in front of the executor: a bounded number of submissions judged at the same time and a circuit
+breaker that opens after consecutive errors of the database, so that an overloaded or failing judge rejects
+submissions immediately ("judge busy, retry in N seconds") instead of making them wait and fail.
+Configured with the environment variables JUDGE_MAX_IN_FLIGHT, JUDGE_ADMISSION_WAIT_MS, JUDGE_BREAKER_FAILURES and
+JUDGE_BREAKER_OPEN_S. Without them there is no limit and the circuit breaker is disabled
+"""
+
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+import cx_Oracle
+import psycopg2
+from logzero import logger
+
+from .exceptions import ExecutorException
+from .types import OracleStatusCode
+
+# Status codes of the stages of connection and provisioning, whose errors are caused by the database and not by the
+# problem or the code judged
+DATABASE_ERRORS = (OracleStatusCode.GET_ADMIN_CONNECTION, OracleStatusCode.CREATE_USER,
+                   OracleStatusCode.GET_USER_CONNECTION, OracleStatusCode.CLOSE_USER_CONNECTION,
+                   OracleStatusCode.DROP_USER, OracleStatusCode.RELEASE_ADMIN_CONNECTION)
+
+# Exceptions of the drivers that are not converted into an ExecutorException, e.g. when creating the pools
+DRIVER_ERRORS = (cx_Oracle.DatabaseError, psycopg2.OperationalError)
+
+
+class JudgeBusy(Exception):
+    """The submission has not been admitted and should be sent again after 'retry_after' seconds"""
+
+    def __init__(self, retry_after, reason):
+        super().__init__(reason)
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class AdmissionControl:  # pylint: disable=too-many-instance-attributes
+    """Limits the submissions judged at the same time and implements a circuit breaker. The breaker is closed while
+    the judge works; it opens after 'failure_threshold' consecutive database errors, rejecting every submission for
+    'open_seconds'; then it is half-open and admits one submission: if it succeeds the breaker closes, otherwise it
+    opens again. Safe to use from several threads"""
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, max_in_flight=None, wait_seconds=0.0, failure_threshold=None, open_seconds=30):
+        """
+        :param max_in_flight: (int) submissions judged at the same time, None for no limit
+        :param wait_seconds: (float) time that a submission waits for a free slot before being rejected
+        :param failure_threshold: (int) consecutive database errors that open the breaker, None to disable it
+        :param open_seconds: (float) seconds that the breaker remains open
+        """
+        self.max_in_flight = max_in_flight
+        self.wait_seconds = wait_seconds
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.slots = threading.BoundedSemaphore(max_in_flight) if max_in_flight else None
+        self.lock = threading.Lock()
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.in_flight = 0
+        self.avg_seconds = 1.0  # Exponentially weighted average of the duration of the judge
+        self.rejected = {'busy': 0, 'open': 0}
+
+    def retry_after(self):
+        """:return: (int) seconds to wait before submitting again"""
+        if self.state == self.OPEN:
+            return max(1, math.ceil(self.opened_at + self.open_seconds - time.time()))
+        return max(1, math.ceil(self.avg_seconds))
+
+    def reject(self, kind, reason):
+        """Counts a rejected submission and raises JudgeBusy"""
+        with self.lock:
+            self.rejected[kind] += 1
+            retry = self.retry_after()
+        logger.info('Submission rejected: %s, retry in %s seconds', reason, retry)
+        raise JudgeBusy(retry, reason)
+
+    def enter_breaker(self):
+        """
+        Checks the circuit breaker before judging
+        :return: (bool) whether this submission is the trial of a half-open breaker
+        """
+        with self.lock:
+            if self.state == self.CLOSED:
+                return False
+            if self.state == self.OPEN and time.time() >= self.opened_at + self.open_seconds:
+                self.state = self.HALF_OPEN
+                return True
+        self.reject('open', 'circuit breaker open')
+        return False  # pragma: no cover (reject always raises)
+
+    def leave_breaker(self, database_error, trial):
+        """Updates the circuit breaker after judging a submission"""
+        with self.lock:
+            if not database_error:
+                self.failures = 0
+                if trial:
+                    self.state = self.CLOSED
+                    logger.info('Circuit breaker closed')
+                return
+            self.failures += 1
+            if trial or (self.failure_threshold and self.failures >= self.failure_threshold
+                         and self.state == self.CLOSED):
+                self.state, self.opened_at = self.OPEN, time.time()
+                logger.error('Circuit breaker open for %s seconds after %s consecutive database errors',
+                             self.open_seconds, self.failures)
+
+    @contextmanager
+    def admit(self):
+        """
+        Judges the code inside the 'with' block if there is a free slot and the breaker is not open. Otherwise,
+        raises JudgeBusy without executing the block
+        """
+        if self.slots is not None and not self.slots.acquire(timeout=self.wait_seconds):
+            self.reject('busy', f'{self.max_in_flight} submissions being judged')
+        try:
+            trial = self.enter_breaker()
+            with self.lock:
+                self.in_flight += 1
+            init, database_error = time.time(), False
+            try:
+                yield
+            except ExecutorException as excp:
+                database_error = excp.error_code in DATABASE_ERRORS
+                raise
+            except DRIVER_ERRORS:
+                database_error = True
+                raise
+            finally:
+                with self.lock:
+                    self.in_flight -= 1
+                    self.avg_seconds = 0.8 * self.avg_seconds + 0.2 * (time.time() - init)
+                self.leave_breaker(database_error, trial)
+        finally:
+            if self.slots is not None:
+                self.slots.release()
+
+    def status(self):
+        """:return: dictionary with the state of the breaker, the submissions in flight and the rejections"""
+        with self.lock:
+            return {'breaker': self.state, 'in_flight': self.in_flight, 'max_in_flight': self.max_in_flight,
+                    'consecutive_failures': self.failures, 'rejected_busy': self.rejected['busy'],
+                    'rejected_open': self.rejected['open']}
+
+    def prometheus(self):
+        """:return: (str) rejections and submissions in flight in the Prometheus text exposition format"""
+        status = self.status()
+        return '\n'.join([
+            '# HELP lsql_judge_rejected_total Submissions rejected by the admission control',
+            '# TYPE lsql_judge_rejected_total counter',
+            f'lsql_judge_rejected_total{{reason="busy"}} {status["rejected_busy"]}',
+            f'lsql_judge_rejected_total{{reason="open"}} {status["rejected_open"]}',
+            '# HELP lsql_judge_in_flight Submissions being judged',
+            '# TYPE lsql_judge_in_flight gauge',
+            f'lsql_judge_in_flight {status["in_flight"]}',
+            '# HELP lsql_judge_breaker_open Whether the circuit breaker is open',
+            '# TYPE lsql_judge_breaker_open gauge',
+            f'lsql_judge_breaker_open {int(status["breaker"] != self.CLOSED)}',
+        ]) + '\n'
+
+
+@lru_cache(maxsize=None)
+def get_admission():
+    """
+    :return: AdmissionControl of this process, configured from the environment
+    """
+    def env(name, convert):
+        return convert(os.environ[name]) if os.environ.get(name) else None
+    return AdmissionControl(max_in_flight=env('JUDGE_MAX_IN_FLIGHT', int),
+                            wait_seconds=(env('JUDGE_ADMISSION_WAIT_MS', int) or 0) / 1000,
+                            failure_threshold=env('JUDGE_BREAKER_FAILURES', int),
+                            open_seconds=env('JUDGE_BREAKER_OPEN_S', float) or 30)
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright Enrique Martín <emartinm@ucm.es> 2021
+
+Validation of the problems of a collection ZIP in parallel. Validating a problem executes its solution in the
+executor for every test database, so problems are validated concurrently using as many threads as connections in the
+pool of the executor (or JUDGE_IMPORT_WORKERS, if defined). Stored problems are validated in the same way to recompute
+their expected results
+"""
+
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+
+from .executor import get_executor
+
+# Maximum number of threads when the executor does not have a pool of connections
+DEFAULT_WORKERS = 4
+# Seconds without progress after which an import job is considered interrupted (e.g., by a restart of the server)
+DEFAULT_IMPORT_STALE_S = 600
+
+
+def executor_workers():
+    """:return: (int) number of connections in the pool of the executor, or DEFAULT_WORKERS if it has no pool"""
+    pool = getattr(get_executor(), 'connection_pool', None)
+    return max(1, pool.max) if pool is not None else DEFAULT_WORKERS
+
+
+def import_workers():
+    """:return: (int) number of problems validated at the same time"""
+    if os.environ.get('JUDGE_IMPORT_WORKERS'):
+        return max(1, int(os.environ['JUDGE_IMPORT_WORKERS']))
+    return executor_workers()
+
+
+def import_stale_seconds():
+    """:return: (int) seconds without progress after which a pending or running ImportJob is considered interrupted"""
+    return int(os.environ.get('JUDGE_IMPORT_STALE_S', DEFAULT_IMPORT_STALE_S))
+
+
+def validate_problem(problem):
+    """
+    Validates a problem, executing its solution
+    :return: None if the problem is valid, otherwise (str) the error
+    """
+    try:
+        problem.clean()
+        return None
+    except ValidationError as excp:
+        return '; '.join(excp.messages)
+    except Exception as excp:  # pylint: disable=broad-except
+        return f'{type(excp).__name__}: {excp}'
+    finally:
+        connection.close()  # Every thread of the pool has its own connection to the DB, if it was used
+
+
+def validate_problems(problems, workers=None, progress=None):
+    """
+    Validates the problems concurrently
+    :param problems: list of Problem
+    :param workers: (int) number of problems validated at the same time, by default import_workers()
+    :param progress: function invoked with (problem, error) in the calling thread when the validation of a problem
+                     finishes, being 'error' None if the problem is valid
+    :return: list of (problem, error) with the invalid problems, in the order of 'problems'
+    """
+    workers = min(workers or import_workers(), max(len(problems), 1))
+    errors = {}
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='import') as pool:
+        futures = {pool.submit(validate_problem, problem): index for index, problem in enumerate(problems)}
+        for future in as_completed(futures):
+            index = futures[future]
+            error = future.result()
+            if error is not None:
+                errors[index] = error
+            if progress is not None:
+                progress(problems[index], error)
+    return [(problems[index], errors[index]) for index in sorted(errors)]
+
+
+# Fields computed when validating a problem that are compared and updated by recompute_problems
+RESULT_FIELDS = ['expected_result', 'initial_db']
+
+
+def stored_value(value):
+    """:return: value as it is read from a JSONField, to compare it with the stored one"""
+    return json.loads(json.dumps(value, cls=DjangoJSONEncoder))
+
+
+def recompute_problems(problems, workers=None, dry=False, progress=None):
+    """
+    Executes again the stored problems to recompute their expected results and initial databases, saving only the
+    problems whose results have changed. The content_hash of the problems is also saved if it is different (e.g.,
+    problems stored before the hash existed), but it is not reported as a change. The rest of fields are never saved,
+    even if the problem has a ZIP file
+    :param problems: list of Problem subclass objects
+    :param workers: (int) problems executed at the same time, by default import_workers()
+    :param dry: if True, does not save the changed problems
+    :param progress: function invoked with (problem, error) as in validate_problems
+    :return: tuple (list of (problem, list of changed fields), list of (problem, error)), in the order of 'problems'
+    """
+    old = {problem.pk: [stored_value(getattr(problem, field)) for field in RESULT_FIELDS] for problem in problems}
+    old_hash = {problem.pk: problem.content_hash for problem in problems}
+    for problem in problems:
+        problem.zipfile = None  # clean() must not replace the fields with the content of the file
+    errors = validate_problems(problems, workers, progress)
+    invalid = {problem.pk for problem, _ in errors}
+    changed, updates = [], []
+    for problem in problems:
+        if problem.pk not in invalid:
+            fields = [field for field, old_value in zip(RESULT_FIELDS, old[problem.pk])
+                      if stored_value(getattr(problem, field)) != old_value]
+            if fields:
+                changed.append((problem, fields))
+            if problem.content_hash != old_hash[problem.pk]:
+                fields = fields + ['content_hash']
+            if fields:
+                updates.append((problem, fields))
+    if not dry:
+        with transaction.atomic():
+            for problem, fields in updates:
+                problem.save(update_fields=fields)
+    return changed, errors
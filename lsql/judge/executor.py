@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright Enrique Martín <emartinm@ucm.es> 2021
+
+Interface of the executors that run the code of the problems and the submissions. The executor used by the judge is
+selected with the setting JUDGE_EXECUTOR (environment variable of the same name), the dotted path of its class:
+  - 'judge.oracle_driver.OracleExecutor': Oracle database (default)
+  - 'judge.oracle_cluster.OracleClusterExecutor': several Oracle instances (ORACLE_INSTANCES), balancing the load
+    between them
+  - 'judge.postgresql_driver.PostgreSQLExecutor': PostgreSQL database, only for SELECT, DML and discriminant problems
+  - 'judge.sqlite_driver.SQLiteExecutor': in-process SQLite databases, only for SELECT, DML and discriminant
+    problems. Useful to test and profile the rest of the application without Oracle
+"""
+
+import abc
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .metrics import STAGE_METRICS, record_current
+
+DEFAULT_EXECUTOR = 'judge.oracle_driver.OracleExecutor'
+
+
+class Executor(abc.ABC):
+    """Abstract base class of the executors. Every method creates a fresh database, loads the problem and runs the
+    code, raising an ExecutorException (with an OracleStatusCode) in case of error"""
+
+    _instance = None
+
+    def __init__(self):
+        self.stage_hooks = []  # functions invoked after every stage, see add_stage_hook
+
+    @classmethod
+    def create(cls):
+        """
+        Creates the executor shared by get(). The duration of its stages is recorded in judge.metrics, globally and
+        for the submission judged by the current thread. Subclasses override it to start their background threads
+        :return: new executor of this class
+        """
+        executor = cls()
+        executor.add_stage_hook(STAGE_METRICS.record)
+        executor.add_stage_hook(record_current)
+        return executor
+
+    @classmethod
+    def get(cls):
+        """
+        :return: the executor of this class shared by the whole process, created with create() in the first call
+        """
+        if cls._instance is None:
+            cls._instance = cls.create()
+        return cls._instance
+
+    @classmethod
+    def override(cls, executor):
+        """
+        Replaces the executor returned by get(), for example with a stub executor in load tests
+        :param executor: new executor, or None to create a new one in the next call to get()
+        :return: the previous executor, to restore it later
+        """
+        previous, cls._instance = cls._instance, executor
+        return previous
+
+    def add_stage_hook(self, hook):
+        """
+        Registers a function invoked after every stage of every submission judged
+        :param hook: function hook(state, problem_type, seconds) receiving the OracleStatusCode of the stage, the
+                     ProblemType of the problem and the duration of the stage
+        :return: None
+        """
+        self.stage_hooks.append(hook)
+
+    @abc.abstractmethod
+    def execute_select_test(self, creation, insertion, select, output_db=False, limits=None):
+        """
+        :return: {"result": result, "db": db}, the result of the SELECT statement and all the tables if output_db
+        """
+
+    @abc.abstractmethod
+    def execute_dml_test(self, creation, insertion, dml, pre_db=True, min_stmt=0, max_stmt=float("inf"),
+                         limits=None):
+        # pylint: disable=too-many-arguments
+        """
+        :return: {'pre': DB, 'post': DB}, all the tables before and after executing the DML statements
+        """
+
+    @abc.abstractmethod
+    def execute_function_test(self, creation, insertion, func_creation, tests, limits=None):
+        # pylint: disable=too-many-arguments
+        """
+        :return: {'db': DB, 'results': {call: result}}, the tables and the result of every function call
+        """
+
+    @abc.abstractmethod
+    def execute_proc_test(self, creation, insertion, proc_creation, proc_call, pre_db=True, limits=None):
+        # pylint: disable=too-many-arguments
+        """
+        :return: {'pre': DB, 'post': DB}, all the tables before and after invoking the procedure
+        """
+
+    @abc.abstractmethod
+    def execute_trigger_test(self, creation, insertion, trigger_definition, tests, pre_db=True, limits=None):
+        # pylint: disable=too-many-arguments
+        """
+        :return: {'pre': DB, 'post': DB}, all the tables before and after executing the tests that fire the trigger
+        """
+
+    @abc.abstractmethod
+    def execute_discriminant_test(self, creation, insertion_base, insertion_user, select_correct, select_incorrect,
+                                  limits=None):
+        # pylint: disable=too-many-arguments
+        """
+        :return: {'result_correct': result, 'result_incorrect': result}, the results of both SELECT statements
+                 after inserting the data of the user
+        """
+
+
+def executor_class():
+    """
+    :return: class of the executor selected in the setting JUDGE_EXECUTOR
+    """
+    return import_string(getattr(settings, 'JUDGE_EXECUTOR', DEFAULT_EXECUTOR))
+
+
+def get_executor():
+    """
+    :return: executor used by the judge (see executor_class)
+    """
+    return executor_class().get()
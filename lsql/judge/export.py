@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright Enrique Martín <emartinm@ucm.es> 2021
+
+Export of collections to the ZIP format read by judge.parse: a collection ZIP contains one ZIP for every problem, and
+exporting several collections generates a ZIP with one collection ZIP each. The ZIPs are generated while they are
+sent, problem by problem, so that the whole archive is never in memory
+"""
+
+import json
+from zipfile import ZipFile, ZIP_DEFLATED
+
+from django.http import StreamingHttpResponse
+from django.utils.text import slugify
+
+from .models import Problem
+from .types import ProblemType
+
+# Separation between hints in hints.md (see judge.parse.extract_hints_from_file)
+HINT_SEPARATION = '@@@new hint@@@'
+
+# Files specific to every problem type: (file, attribute of the problem)
+TYPE_FILES = {
+    ProblemType.SELECT: [('solution.sql', 'solution')],
+    ProblemType.DML: [('solution.sql', 'solution')],
+    ProblemType.FUNCTION: [('solution.sql', 'solution'), ('tests.sql', 'calls')],
+    ProblemType.PROC: [('solution.sql', 'solution'), ('tests.sql', 'proc_call')],
+    ProblemType.TRIGGER: [('solution.sql', 'solution'), ('tests.sql', 'tests')],
+    ProblemType.DISC: [('incorrect_query.sql', 'incorrect_query'), ('correct_query.sql', 'correct_query')],
+}
+
+
+class ZipStream:
+    """Write-only file that keeps the bytes written until they are taken with pop(). As it is not seekable, ZipFile
+    writes the sizes of every file after its content"""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        """Stores the bytes written"""
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        """Nothing to do, bytes are kept until pop()"""
+
+    def pop(self):
+        """:return: (bytes) written since the last invocation"""
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def problem_json(problem):
+    """:return: dict with the content of problem.json for the problem"""
+    data = {'type': int(problem.problem_type()), 'title': problem.title_md, 'language': problem.language,
+            'min_stmt': problem.min_stmt, 'max_stmt': problem.max_stmt, 'position': problem.position}
+    if problem.problem_type() in (ProblemType.SELECT, ProblemType.DISC):
+        data['check_order'] = problem.check_order
+    for field in ['stmt_timeout_ms', 'max_rows', 'max_tables']:
+        if getattr(problem, field) is not None:
+            data[field] = getattr(problem, field)
+    return data
+
+
+def hints_md(hints):
+    """:return: (str) content of hints.md for the hints of a problem"""
+    return f'\n{HINT_SEPARATION}\n'.join(f'{hint.num_submit}\n{hint.text_md}' for hint in hints)
+
+
+def problem_files(problem):
+    """
+    :param problem: Problem subclass object, with its hints prefetched
+    :return: list of (name, str) with the files of the problem ZIP
+    """
+    files = [('problem.json', json.dumps(problem_json(problem), ensure_ascii=False, indent=2)),
+             ('text.md', problem.text_md), ('create.sql', problem.create_sql), ('insert.sql', problem.insert_sql)]
+    files.extend((name, getattr(problem, attribute)) for name, attribute in TYPE_FILES[problem.problem_type()])
+    hints = sorted(problem.hint_set.all(), key=lambda hint: (hint.num_submit, hint.pk))
+    if hints:
+        files.append(('hints.md', hints_md(hints)))
+    return files
+
+
+def problem_filename(problem):
+    """:return: (str) name of the ZIP of a problem inside the collection ZIP"""
+    return f'{problem.position:02d}_{problem.pk}_{slugify(problem.title_md)[:40]}.zip'
+
+
+def collection_filename(collection):
+    """:return: (str) name of the ZIP of a collection"""
+    return f'{collection.pk}_{slugify(collection.name_md)[:40] or "collection"}.zip'
+
+
+def write_collection(zfile, collection):
+    """
+    Writes the ZIP of every problem of the collection in 'zfile', yielding after each problem
+    :param zfile: ZipFile opened for writing
+    :param collection: Collection
+    """
+    problems = (Problem.objects.filter(collection=collection).select_subclasses().prefetch_related('hint_set')
+                .order_by('position', 'pk'))
+    for problem in problems:
+        with zfile.open(problem_filename(problem), 'w') as problem_file:
+            with ZipFile(problem_file, 'w', ZIP_DEFLATED) as problem_zip:
+                for name, content in problem_files(problem):
+                    problem_zip.writestr(name, content)
+        yield
+
+
+def stream_collection(collection):
+    """Generates the bytes of the collection ZIP, a chunk for every problem"""
+    stream = ZipStream()
+    with ZipFile(stream, 'w') as zfile:  # Problem ZIPs are already compressed
+        for _ in write_collection(zfile, collection):
+            yield stream.pop()
+    yield stream.pop()
+
+
+def stream_collections(collections):
+    """Generates the bytes of a ZIP with the ZIP of every collection, a chunk for every problem"""
+    stream = ZipStream()
+    with ZipFile(stream, 'w') as zfile:
+        for collection in collections:
+            # The size of the collection ZIP is unknown until it is written
+            with zfile.open(collection_filename(collection), 'w', force_zip64=True) as collection_file:
+                with ZipFile(collection_file, 'w') as collection_zip:
+                    for _ in write_collection(collection_zip, collection):
+                        yield stream.pop()
+            yield stream.pop()
+    yield stream.pop()
+
+
+def export_response(collections):
+    """
+    :param collections: list of Collection
+    :return: StreamingHttpResponse with the collection ZIP if there is only one collection, otherwise with a ZIP of
+             collection ZIPs
+    """
+    if len(collections) == 1:
+        response = StreamingHttpResponse(stream_collection(collections[0]), content_type='application/zip')
+        filename = collection_filename(collections[0])
+    else:
+        response = StreamingHttpResponse(stream_collections(collections), content_type='application/zip')
+        filename = 'collections.zip'
+    response['Content-Disposition'] = f'attachment; filename={filename}'
+    return response
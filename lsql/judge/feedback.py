@@ -10,7 +10,7 @@ from django.template.loader import render_to_string
 from django.utils.translation import gettext_lazy as _
 from multiset import Multiset
 
-from .types import VeredictCode
+from .types import VeredictCode, OracleStatusCode, ProblemType
 
 __ORACLE_TYPE_PATTERN_VERSION_7 = r"<class 'cx_Oracle\.(.*)'>"
 __ORACLE_TYPE_PATTERN_VERSION_8 = r"<cx_Oracle\.DbType (.*)>"
@@ -249,6 +249,37 @@ def compile_error_to_html_table(tab):
     return feedback
 
 
+def exception_verdict(problem, excp):
+    """
+    Verdict of a submission whose judgement raised an exception (RE, TLE, VE, WA if the code did not compile or IE)
+    :param problem: Problem subclass object where the code was submitted
+    :param excp: ExecutorException raised by problem.judge
+    :return: dict with 'veredict', 'title', 'message' and 'feedback' (and 'position' and 'position_msg' for RE)
+    """
+    if excp.error_code == OracleStatusCode.EXECUTE_USER_CODE:
+        return {
+            'veredict': VeredictCode.RE,
+            'title': VeredictCode.RE.label,
+            'message': VeredictCode.RE.message(),
+            'feedback': (f'{excp.statement} --> {excp.message}'
+                         if problem.problem_type() == ProblemType.FUNCTION else excp.message),
+            'position': excp.position,
+            'position_msg': _('Posición: línea {row}, columna {col}').format(row=excp.position[0]+1,
+                                                                             col=excp.position[1]+1)
+        }
+    if excp.error_code == OracleStatusCode.TLE_USER_CODE:
+        return {'veredict': VeredictCode.TLE, 'title': VeredictCode.TLE.label,
+                'message': VeredictCode.TLE.message(), 'feedback': ''}
+    if excp.error_code == OracleStatusCode.NUMBER_STATEMENTS:
+        return {'veredict': VeredictCode.VE, 'title': VeredictCode.VE.label,
+                'message': VeredictCode.VE.message(problem), 'feedback': excp.message}
+    if excp.error_code == OracleStatusCode.COMPILATION_ERROR:
+        return {'veredict': VeredictCode.WA, 'title': VeredictCode.WA.label,
+                'message': VeredictCode.WA.message(), 'feedback': compile_error_to_html_table(excp.message)}
+    return {'veredict': VeredictCode.IE, 'title': VeredictCode.IE.label,
+            'message': VeredictCode.IE.message(), 'feedback': ''}
+
+
 def filter_expected_db(expected_db, initial_db):
     """Compare expected_db and initial_db and return all the modified, removed or added tables"""
     expected_tables = sorted(list(expected_db.keys()))
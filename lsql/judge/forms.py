@@ -31,6 +31,15 @@ class TriggerProblemAdminForm(forms.ModelForm):
                             required=False)
 
 
+class CollectionAdminForm(forms.ModelForm):
+    """Customized form for Collection in admin that only parses the problems of the ZIP file, leaving their validation
+    (that executes them) to an ImportJob in background"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.instance.background_import = True
+
+
 class LoginForm(forms.Form):
     """Form used to validate user login"""
     username = forms.CharField(label='Nombre de usuario', max_length=100)
@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright Enrique Martín <emartinm@ucm.es> 2021
+
+Load generator that simulates a lab session: synthetic students sending submissions to the judge concurrently.
+It can use the executor of the judge (see judge.executor) or a StubExecutor that does not need Oracle
+"""
+
+import random
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import Client
+from django.urls import reverse
+
+from .metrics import percentiles
+from .models import Problem, Submission
+from .types import ProblemType, VeredictCode
+
+USER_PREFIX = 'loadtest_'
+DEFAULT_MIX = {ProblemType.SELECT: 40, ProblemType.DML: 20, ProblemType.FUNCTION: 10, ProblemType.PROC: 10,
+               ProblemType.TRIGGER: 10, ProblemType.DISC: 10}
+
+
+class StubPool:  # pylint: disable=too-few-public-methods
+    """Imitates the admin pool of OracleExecutor: at most 'max' judges run at the same time"""
+
+    def __init__(self, size):
+        self.max = size
+        self.busy = 0
+        self.lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(size)
+
+    @contextmanager
+    def connection(self):
+        """Holds one connection of the pool inside the 'with' block"""
+        with self.slots:
+            with self.lock:
+                self.busy += 1
+            try:
+                yield
+            finally:
+                with self.lock:
+                    self.busy -= 1
+
+
+class StubExecutor:
+    """Executor that does not connect to Oracle. It holds a connection of its pool for 'delay' seconds and returns
+    the expected results of the problem if the code is its solution or was accepted before, so the judge gives AC,
+    and empty results otherwise (WA)"""
+
+    __EMPTY_TABLE = {'header': [], 'rows': []}
+
+    def __init__(self, problems, delay=0.05, pool_size=10):
+        """
+        :param problems: problems (subclasses of Problem) that can be judged
+        :param delay: (float) seconds spent in every execution
+        :param pool_size: (int) number of executions at the same time
+        """
+        self.delay = delay
+        self.connection_pool = StubPool(pool_size)
+        self.accepted = {}  # {code: [problems]}
+        accepted_codes = (Submission.objects.filter(problem__in=problems, veredict_code=VeredictCode.AC)
+                          .values_list('problem', 'code'))
+        by_pk = {problem.pk: problem for problem in problems}
+        codes = [(problem, getattr(problem, 'solution', '')) for problem in problems]
+        codes += [(by_pk[problem_pk], code) for problem_pk, code in accepted_codes]
+        for problem, code in codes:
+            if code and problem not in self.accepted.get(code.strip(), []):
+                self.accepted.setdefault(code.strip(), []).append(problem)
+
+    def solved(self, creation, code):
+        """
+        Waits as if the code were executed
+        :return: the problem with 'creation' solved by 'code', None if 'code' is not accepted
+        """
+        with self.connection_pool.connection():
+            time.sleep(self.delay)
+        for problem in self.accepted.get(code.strip(), []):
+            if problem.create_sql == creation:
+                return problem
+        return None
+
+    def execute_select_test(self, creation, insertion, select, output_db=False, limits=None):
+        # pylint: disable=unused-argument
+        """Same interface as OracleExecutor.execute_select_test"""
+        problem = self.solved(creation, select)
+        if problem is None:
+            return {'result': self.__EMPTY_TABLE, 'db': None}
+        inserts = problem.insert_sql_list()
+        index = inserts.index(insertion) if insertion in inserts else 0
+        return {'result': problem.expected_result[index], 'db': None}
+
+    def execute_dml_test(self, creation, insertion, dml, pre_db=True, min_stmt=0, max_stmt=float("inf"),
+                         limits=None):
+        # pylint: disable=unused-argument,too-many-arguments
+        """Same interface as OracleExecutor.execute_dml_test"""
+        problem = self.solved(creation, dml)
+        return {'pre': None, 'post': problem.expected_result[0] if problem else {}}
+
+    def execute_function_test(self, creation, insertion, func_creation, tests, limits=None):
+        # pylint: disable=unused-argument,too-many-arguments
+        """Same interface as OracleExecutor.execute_function_test"""
+        problem = self.solved(creation, func_creation)
+        if problem is None:
+            calls = [call.strip() for call in tests.split('\n') if call.strip()]
+            return {'db': None, 'results': {call: 'stub' for call in calls}}
+        return {'db': None, 'results': problem.expected_result[0]}
+
+    def execute_proc_test(self, creation, insertion, proc_creation, proc_call, pre_db=True, limits=None):
+        # pylint: disable=unused-argument,too-many-arguments
+        """Same interface as OracleExecutor.execute_proc_test"""
+        problem = self.solved(creation, proc_creation)
+        return {'pre': None, 'post': problem.expected_result[0] if problem else {}}
+
+    def execute_trigger_test(self, creation, insertion, trigger_definition, tests, pre_db=True, limits=None):
+        # pylint: disable=unused-argument,too-many-arguments
+        """Same interface as OracleExecutor.execute_trigger_test"""
+        problem = self.solved(creation, trigger_definition)
+        return {'pre': None, 'post': problem.expected_result[0] if problem else {}}
+
+    def execute_discriminant_test(self, creation, insertion_base, insertion_user, select_correct, select_incorrect,
+                                  limits=None):
+        # pylint: disable=unused-argument,too-many-arguments
+        """Same interface as OracleExecutor.execute_discriminant_test. The incorrect query returns an extra row
+        when the code is accepted"""
+        problem = self.solved(creation, insertion_user)
+        header = [['N', 'NUMBER']]
+        return {'result_correct': {'header': header, 'rows': []},
+                'result_incorrect': {'header': header, 'rows': [[1]] if problem else []}}
+
+
+class LoadTest:  # pylint: disable=too-many-instance-attributes
+    """Synthetic students sending submissions concurrently through the 'judge:submit' view"""
+
+    def __init__(self, problems, executor, students=10, submissions=10, think_time=0.0, mix=None, seed=None):
+        # pylint: disable=too-many-arguments
+        """
+        :param problems: problems (subclasses of Problem) to submit to
+        :param executor: executor used by the judge, to sample the number of busy connections of its pool (if any)
+        :param students: (int) number of students sending submissions at the same time
+        :param submissions: (int) number of submissions of every student
+        :param think_time: (float) maximum number of seconds between two submissions of a student
+        :param mix: dict {ProblemType: weight} with the proportion of submissions of every type
+        :param seed: seed for the random choices, to repeat a test
+        """
+        self.executor = executor
+        self.students = students
+        self.submissions = submissions
+        self.think_time = think_time
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.results = []  # [(seconds, verdict)]
+        self.pool_samples = []  # Number of busy connections of the pool
+        self.codes = {problem.pk: self.code_pool(problem) for problem in problems}
+        mix = DEFAULT_MIX if mix is None else mix
+        self.problems = {ptype: [problem for problem in problems if problem.problem_type() == ptype]
+                         for ptype in ProblemType}
+        self.weights = {ptype: weight for ptype, weight in mix.items() if self.problems[ptype]}
+        if not self.weights:
+            raise ValueError('There are no problems of the types in the mix')
+
+    @staticmethod
+    def code_pool(problem, last=50):
+        """
+        :return: list with the solution of the problem and the codes of its 'last' submissions, to replay them
+        """
+        codes = list(Submission.objects.filter(problem=problem).order_by('-pk').values_list('code', flat=True)[:last])
+        if getattr(problem, 'solution', ''):
+            codes.append(problem.solution)
+        return codes or ['SELECT * FROM dual']
+
+    def request_args(self):
+        """Extra arguments for Client.post, as the Django Client can be used outside tests"""
+        host = settings.ALLOWED_HOSTS[0] if settings.ALLOWED_HOSTS else 'testserver'
+        return {'HTTP_HOST': host, 'secure': getattr(settings, 'SECURE_SSL_REDIRECT', False)}
+
+    def choose(self, rng):
+        """:return: pair (problem, code) to submit"""
+        ptype = rng.choices(list(self.weights), weights=list(self.weights.values()))[0]
+        problem = rng.choice(self.problems[ptype])
+        return problem, rng.choice(self.codes[problem.pk])
+
+    def student(self, user, seed):
+        """Sends the submissions of one student"""
+        rng = random.Random(seed)
+        client = Client()
+        client.force_login(user)
+        try:
+            for _ in range(self.submissions):
+                problem, code = self.choose(rng)
+                init = time.time()
+                response = client.post(reverse('judge:submit', args=[problem.pk]), {'code': code},
+                                       **self.request_args())
+                elapsed = time.time() - init
+                # 503: rejected by the admission control (judge.admission), 429: rate limited (judge.throttle).
+                # The verdict of both is 'BUSY'
+                json_response = response.status_code in (200, 429, 503)
+                verdict = response.json()['veredict'] if json_response else str(response.status_code)
+                with self.lock:
+                    self.results.append((elapsed, verdict))
+                if self.think_time:
+                    time.sleep(rng.uniform(0, self.think_time))
+        finally:
+            connection.close()  # Every thread has its own connection to the DB
+
+    def monitor(self, finished, interval=0.1):
+        """Samples the number of busy connections of the pool until 'finished' is set"""
+        if getattr(self.executor, 'connection_pool', None) is None:
+            return  # Executors without pool, like SQLiteExecutor
+        while not finished.wait(interval):
+            self.pool_samples.append(self.executor.connection_pool.busy)
+
+    def create_users(self):
+        """:return: list of new synthetic students, removing those left by previous tests"""
+        get_user_model().objects.filter(username__startswith=USER_PREFIX).delete()
+        return [get_user_model().objects.create_user(username=f'{USER_PREFIX}{i}') for i in range(self.students)]
+
+    @staticmethod
+    def remove_users():
+        """Removes the synthetic students and their submissions"""
+        get_user_model().objects.filter(username__startswith=USER_PREFIX).delete()
+
+    def run(self):
+        """
+        Executes the test
+        :return: dictionary with the report (see report())
+        """
+        users = self.create_users()
+        finished = threading.Event()
+        monitor = threading.Thread(target=self.monitor, args=(finished,), daemon=True)
+        threads = [threading.Thread(target=self.student, args=(user, self.rng.random())) for user in users]
+        init = time.time()
+        monitor.start()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.time() - init
+        finished.set()
+        monitor.join()
+        return self.report(elapsed)
+
+    def report(self, elapsed):
+        """
+        :param elapsed: (float) duration of the test in seconds
+        :return: dictionary with the number of submissions, throughput (submissions per second), percentiles of
+                 latency in seconds, verdicts, rates of TLE, IE and rejections (BUSY), and use of the pool
+        """
+        latencies = sorted(seconds for seconds, _ in self.results)
+        verdicts = Counter(verdict for _, verdict in self.results)
+        total = len(self.results)
+        pool = getattr(self.executor, 'connection_pool', None)
+        pool_size = pool.max if pool is not None else 0
+        report = {
+            'submissions': total,
+            'elapsed': elapsed,
+            'throughput': total / elapsed if elapsed else 0,
+            'verdicts': dict(verdicts),
+            'tle_rate': verdicts[VeredictCode.TLE] / total if total else 0,
+            'ie_rate': verdicts[VeredictCode.IE] / total if total else 0,
+            'busy_rate': verdicts['BUSY'] / total if total else 0,
+            'pool_size': pool_size,
+            'pool_max_busy': max(self.pool_samples, default=0),
+            'pool_avg_busy': sum(self.pool_samples) / len(self.pool_samples) if self.pool_samples else 0,
+            'pool_saturation': (sum(1 for busy in self.pool_samples if busy >= pool_size) / len(self.pool_samples)
+                                if self.pool_samples else 0),
+        }
+        if latencies:
+            report['p50'], report['p95'], report['p99'] = percentiles(latencies, (0.5, 0.95, 0.99))
+            report['max'] = latencies[-1]
+        return report
+
+
+def load_problems(collections=None):
+    """
+    :param collections: list of collection ids, None for all the collections
+    :return: list of problems (subclasses of Problem) of those collections
+    """
+    problems = Problem.objects.all() if not collections else Problem.objects.filter(collection__in=collections)
+    return list(problems.select_subclasses())
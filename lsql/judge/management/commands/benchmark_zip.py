@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright Enrique Martín <emartinm@ucm.es> 2021
+
+Command that measures the time to parse a collection ZIP, replicating the problems of an existing collection ZIP
+until reaching the desired number of problems. Problems are only parsed, neither judged nor stored:
+    $ python manage.py benchmark_zip judge/tests/zip_files/problems.zip --problems 200 --repeat 5
+"""
+
+import io
+import time
+from zipfile import ZipFile, BadZipFile
+
+from django.core.management.base import BaseCommand, CommandError
+
+from judge.models import Collection, load_many_problems
+
+
+def replicate_collection(path, num_problems):
+    """
+    :param path: (str) collection ZIP containing one ZIP for every problem
+    :param num_problems: (int) number of problems of the new collection ZIP
+    :return: BytesIO with a collection ZIP of 'num_problems' problems taken cyclically from 'path'
+    """
+    with ZipFile(path) as zfile:
+        problems = [(info.filename, zfile.read(info)) for info in zfile.infolist()]
+    if not problems:
+        raise CommandError(f'{path} does not contain any problem')
+    output = io.BytesIO()
+    with ZipFile(output, 'w') as zfile:
+        for i in range(num_problems):
+            name, content = problems[i % len(problems)]
+            zfile.writestr(f'{i:04d}_{name}', content)
+    output.seek(0)
+    return output
+
+
+class Command(BaseCommand):
+    """Benchmark of the parsing of collection ZIPs"""
+    help = 'Measures the time to parse a collection ZIP with many problems'
+
+    def add_arguments(self, parser):
+        parser.add_argument('zip', help='Collection ZIP whose problems are replicated')
+        parser.add_argument('--problems', type=int, default=200, help='Problems in the collection (default 200)')
+        parser.add_argument('--repeat', type=int, default=5, help='Times the collection is parsed (default 5)')
+
+    def handle(self, *args, **options):
+        try:
+            data = replicate_collection(options['zip'], options['problems'])
+        except (OSError, BadZipFile) as excp:
+            raise CommandError(f'Unable to read {options["zip"]}: {excp}') from excp
+        collection = Collection(name_md='Benchmark', description_md='Benchmark')
+        times = []
+        for _ in range(options['repeat']):
+            data.seek(0)
+            init = time.perf_counter()
+            problems = load_many_problems(data, collection)
+            times.append(time.perf_counter() - init)
+        best, avg = min(times), sum(times) / len(times)
+        self.stdout.write(f'Parsed {len(problems)} problems {len(times)} times: best {best:.3f} s, '
+                          f'average {avg:.3f} s ({len(problems) / best:.0f} problems/s)')
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright Enrique Martín <emartinm@ucm.es> 2021
+
+Command that simulates a lab session, with synthetic students sending submissions concurrently:
+    $ python manage.py loadtest --students 40 --submissions 20 --collection 3 --mix select=4,dml=2,disc=1
+    $ python manage.py loadtest --stub --stub-delay 0.2 --stub-pool 10
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from judge.executor import executor_class
+from judge.loadtest import LoadTest, StubExecutor, load_problems
+from judge.types import ProblemType
+
+
+def parse_mix(text):
+    """
+    :param text: (str) weights of the problem types, e.g. 'select=4,dml=2,function=1'
+    :return: dict {ProblemType: weight}
+    """
+    mix = {}
+    for item in text.split(','):
+        name, _, weight = item.partition('=')
+        try:
+            mix[ProblemType[name.strip().upper()]] = int(weight)
+        except (KeyError, ValueError) as excp:
+            raise CommandError(f'Invalid mix "{item}", use TYPE=WEIGHT with TYPE in '
+                               f'{", ".join(ptype.name.lower() for ptype in ProblemType)}') from excp
+    return mix
+
+
+class Command(BaseCommand):
+    """Load test of the judge replaying submissions of existing problems"""
+    help = 'Simulates a lab session and reports throughput, latency percentiles, TLE/IE rates and pool saturation'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--students', type=int, default=10, help='Students submitting at the same time')
+        parser.add_argument('--submissions', type=int, default=10, help='Submissions of every student')
+        parser.add_argument('--think', type=float, default=0.0,
+                            help='Maximum seconds between two submissions of a student (default 0)')
+        parser.add_argument('--collection', type=int, action='append',
+                            help='Id of a collection whose problems are used (all the collections by default)')
+        parser.add_argument('--mix', help='Weights of the problem types, e.g. select=4,dml=2,function=1,proc=1,'
+                                          'trigger=1,disc=1')
+        parser.add_argument('--stub', action='store_true', help='Use a stub executor instead of Oracle')
+        parser.add_argument('--stub-delay', type=float, default=0.05, help='Seconds of every stub execution')
+        parser.add_argument('--stub-pool', type=int, default=10, help='Executions at the same time in the stub')
+        parser.add_argument('--seed', type=int, help='Seed for the random choices, to repeat a test')
+        parser.add_argument('--keep-users', action='store_true',
+                            help='Do not remove the synthetic students and their submissions')
+
+    def handle(self, *args, **options):
+        problems = load_problems(options['collection'])
+        if not problems:
+            raise CommandError('There are no problems to submit to')
+        if options['stub']:
+            executor = StubExecutor(problems, delay=options['stub_delay'], pool_size=options['stub_pool'])
+            previous = executor_class().override(executor)
+        else:
+            executor = executor_class().get()
+        mix = parse_mix(options['mix']) if options['mix'] else None
+        try:
+            test = LoadTest(problems, executor, students=options['students'], submissions=options['submissions'],
+                            think_time=options['think'], mix=mix, seed=options['seed'])
+            report = test.run()
+        except ValueError as excp:
+            raise CommandError(str(excp)) from excp
+        finally:
+            if options['stub']:
+                executor_class().override(previous)
+            if not options['keep_users']:
+                LoadTest.remove_users()
+        self.print_report(report)
+
+    def print_report(self, report):
+        """Writes the report of the test"""
+        self.stdout.write(f'Submissions: {report["submissions"]} in {report["elapsed"]:.2f} s '
+                          f'({report["throughput"]:.2f} submissions/s)')
+        if 'max' in report:
+            self.stdout.write(f'Latency (s): p50 {report["p50"]:.3f}, p95 {report["p95"]:.3f}, '
+                              f'p99 {report["p99"]:.3f}, max {report["max"]:.3f}')
+        verdicts = ', '.join(f'{verdict}: {count}' for verdict, count in sorted(report['verdicts'].items()))
+        self.stdout.write(f'Verdicts: {verdicts}')
+        self.stdout.write(f'TLE rate: {report["tle_rate"]:.2%}, IE rate: {report["ie_rate"]:.2%}, '
+                          f'rejected (busy) rate: {report["busy_rate"]:.2%}')
+        if report['pool_size']:
+            self.stdout.write(f'Pool: size {report["pool_size"]}, max busy {report["pool_max_busy"]}, '
+                              f'average busy {report["pool_avg_busy"]:.2f}, '
+                              f'saturated {report["pool_saturation"]:.2%} of the time')
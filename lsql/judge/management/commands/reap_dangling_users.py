@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright Enrique Martín <emartinm@ucm.es> 2021
+
+Command to remove the dangling users in Oracle, once or periodically as a daemon:
+    $ python manage.py reap_dangling_users --loop --interval 60
+"""
+
+from django.core.management.base import BaseCommand
+
+from judge.oracle_driver import OracleExecutor
+from judge.reaper import DanglingUserReaper
+
+
+class Command(BaseCommand):
+    """Removes Oracle users created for judging that have not been dropped"""
+    help = 'Removes dangling Oracle users, retrying failed drops with backoff'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--age', type=int, default=60,
+                            help='Only users created more than AGE seconds ago are removed (default 60)')
+        parser.add_argument('--workers', type=int, default=2, help='Users dropped in parallel (default 2)')
+        parser.add_argument('--loop', action='store_true', help='Keep running, removing users periodically')
+        parser.add_argument('--interval', type=int, default=60, help='Seconds between rounds with --loop')
+
+    def handle(self, *args, **options):
+        executor = OracleExecutor.get()
+        reaper = DanglingUserReaper(executor, interval=options['interval'], age_seconds=options['age'],
+                                    workers=options['workers'])
+        self.stdout.write(f'Dangling users: {executor.get_number_dangling_users(age_seconds=options["age"])}')
+        if options['loop']:
+            reaper.run()  # In the foreground, never returns
+        else:
+            dropped, failed = reaper.reap()
+            self.stdout.write(f'Dropped {len(dropped)} users, {len(failed)} failed, '
+                              f'{reaper.backlog} dangling users remaining')
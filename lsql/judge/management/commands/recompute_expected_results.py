@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright Enrique Martín <emartinm@ucm.es> 2021
+
+Command to execute again the problems and store their expected results and initial databases, e.g., after upgrading
+Oracle. Only the problems whose results change are saved:
+    $ python manage.py recompute_expected_results --collection 3 4 --type SELECT DML --dry-run
+"""
+
+from django.core.management.base import BaseCommand
+
+from judge.bulk_import import recompute_problems
+from judge.models import Problem
+from judge.types import ProblemType
+
+
+class Command(BaseCommand):
+    """Recomputes the expected results of the problems in parallel, saving only the changed ones"""
+    help = 'Executes again the problems that match the filters, saving the expected results that have changed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--collection', type=int, nargs='+', help='Only problems in these collections (pk)')
+        parser.add_argument('--problem', type=int, nargs='+', help='Only these problems (pk)')
+        parser.add_argument('--type', nargs='+', choices=ProblemType.__members__, help='Only problems of these types')
+        parser.add_argument('--workers', type=int,
+                            help='Problems executed at the same time (default: connections in the pool of the '
+                                 'executor or JUDGE_IMPORT_WORKERS)')
+        parser.add_argument('--dry-run', action='store_true', help='Show the changes without saving them')
+
+    def handle(self, *args, **options):
+        problems = Problem.objects.select_subclasses().order_by('pk')
+        if options['collection']:
+            problems = problems.filter(collection__in=options['collection'])
+        if options['problem']:
+            problems = problems.filter(pk__in=options['problem'])
+        if options['type']:
+            types = {ProblemType[name] for name in options['type']}
+            problems = [problem for problem in problems if problem.problem_type() in types]
+        problems = list(problems)
+        self.stdout.write(f'Executing {len(problems)} problems')
+        changed, errors = recompute_problems(problems, options['workers'], options['dry_run'])
+        for problem, fields in changed:
+            self.stdout.write(f'* Changed problem {problem.pk} "{problem.title_md}": {", ".join(fields)}')
+        for problem, error in errors:
+            self.stderr.write(f'* Error in problem {problem.pk} "{problem.title_md}": {error}')
+        self.stdout.write(f'{len(changed)} changed ({"not saved" if options["dry_run"] else "saved"}), '
+                          f'{len(problems) - len(changed) - len(errors)} unchanged, {len(errors)} errors')
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright Enrique Martín <emartinm@ucm.es> 2021
+
+Command to judge again the submissions, writing a JSON lines (or CSV) report that allows resuming the rejudge:
+    $ python manage.py rejudge --verdict IE --start 2021-09-01 --report rejudge.jsonl --resume --update
+"""
+
+import datetime
+
+from django.core.management.base import BaseCommand
+
+from judge.models import Submission
+from judge.rejudge import rejudge_to_report
+from judge.types import VeredictCode
+
+
+class Command(BaseCommand):
+    """Judges again the submissions calling directly the judge, concurrently and only once per different code"""
+    help = 'Judges again the submissions that match the filters, writing the new verdicts in a report'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verdict', choices=VeredictCode.values, help='Only submissions with this verdict')
+        parser.add_argument('--problem', type=int, nargs='+', help='Only submissions to these problems (pk)')
+        parser.add_argument('--start', type=datetime.date.fromisoformat,
+                            help='Only submissions sent on this day (YYYY-MM-DD) or later')
+        parser.add_argument('--end', type=datetime.date.fromisoformat,
+                            help='Only submissions sent on this day (YYYY-MM-DD) or before')
+        parser.add_argument('--report', default='rejudge.jsonl',
+                            help='Report with a row per submission, CSV if it ends with .csv (default rejudge.jsonl)')
+        parser.add_argument('--resume', action='store_true',
+                            help='Skip the submissions already in the report, adding the new ones to it')
+        parser.add_argument('--update', action='store_true', help='Store the new verdicts of the submissions')
+        parser.add_argument('--workers', type=int,
+                            help='Codes judged at the same time (default: connections in the pool of the executor)')
+
+    def handle(self, *args, **options):
+        submissions = Submission.objects.order_by('pk')
+        if options['verdict']:
+            submissions = submissions.filter(veredict_code=options['verdict'])
+        if options['problem']:
+            submissions = submissions.filter(problem__in=options['problem'])
+        if options['start']:
+            submissions = submissions.filter(creation_date__date__gte=options['start'])
+        if options['end']:
+            submissions = submissions.filter(creation_date__date__lte=options['end'])
+        changes = rejudge_to_report(submissions, options['report'], options['workers'], options['update'],
+                                    options['resume'])
+        for change, count in sorted(changes.items()):
+            self.stdout.write(f'{change}: {count}')
+        self.stdout.write(f'Rejudged {sum(changes.values())} submissions, see {options["report"]} for details')
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright Enrique Martín <emartinm@ucm.es> 2021
+
+Command to create the Oracle Resource Manager plan that limits the resources of the sandbox users:
+    $ python manage.py setup_resource_plan --cpu-limit 50 --parallel 1 --cancel-after 60
+The admin user (ORACLE_USER) needs the ADMINISTER_RESOURCE_MANAGER privilege. Sandbox users are assigned to the
+consumer group only if ORACLE_CONSUMER_GROUP is defined
+"""
+
+import os
+
+from django.core.management.base import BaseCommand
+
+from judge.oracle_driver import OracleExecutor
+from judge.resource_plan import setup_resource_plan, drop_resource_plan, DEFAULT_PLAN, DEFAULT_CONSUMER_GROUP
+
+
+class Command(BaseCommand):
+    """Creates and activates the resource plan for the sandbox users, or removes it"""
+    help = 'Creates and activates an Oracle resource plan that limits the resources of the sandbox users'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--plan', default=DEFAULT_PLAN, help=f'Name of the plan (default {DEFAULT_PLAN})')
+        parser.add_argument('--group', default=os.environ.get('ORACLE_CONSUMER_GROUP', DEFAULT_CONSUMER_GROUP),
+                            help='Consumer group of the sandbox users (default ORACLE_CONSUMER_GROUP or '
+                                 f'{DEFAULT_CONSUMER_GROUP})')
+        parser.add_argument('--cpu-share', type=int, default=50,
+                            help='Percentage of CPU guaranteed to sandbox users under contention (default 50)')
+        parser.add_argument('--cpu-limit', type=int, default=50,
+                            help='Maximum percentage of CPU used by sandbox users (default 50)')
+        parser.add_argument('--parallel', type=int, default=1,
+                            help='Maximum degree of parallelism of sandbox statements (default 1)')
+        parser.add_argument('--cancel-after', type=int, default=None,
+                            help='Cancel sandbox statements running more than CANCEL_AFTER seconds')
+        parser.add_argument('--max-io-mb', type=int, default=None,
+                            help='Cancel sandbox statements doing more than MAX_IO_MB megabytes of I/O')
+        parser.add_argument('--drop', action='store_true', help='Deactivate and remove the plan')
+
+    def handle(self, *args, **options):
+        executor = OracleExecutor.get()
+        conn = executor.connection_pool.acquire()
+        try:
+            if options['drop']:
+                drop_resource_plan(conn, options['plan'])
+                self.stdout.write(f'Removed resource plan {options["plan"]}')
+            else:
+                setup_resource_plan(conn, plan=options['plan'], group=options['group'],
+                                    cpu_share=options['cpu_share'], cpu_limit=options['cpu_limit'],
+                                    parallel=options['parallel'], cancel_after=options['cancel_after'],
+                                    max_io_mb=options['max_io_mb'])
+                self.stdout.write(f'Activated resource plan {options["plan"]} with consumer group {options["group"]}')
+        finally:
+            executor.connection_pool.release(conn)
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright Enrique Martín <emartinm@ucm.es> 2021
+
+In-process metrics about the duration of the stages of the judge, aggregated by stage (OracleStatusCode) and
+problem type (ProblemType), and timings of the judge of each submission
+"""
+
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from statistics import quantiles
+
+from .types import OracleStatusCode, ProblemType
+
+
+class StageMetrics:
+    """Durations of the last 'window' executions of every pair (stage, problem type), along with the total count and
+    sum of all the durations since the process started. Safe to use from several threads"""
+
+    QUANTILES = (0.5, 0.95, 0.99)
+
+    def __init__(self, window=1000):
+        """
+        :param window: (int) number of durations kept for every pair (stage, problem type) to compute quantiles
+        """
+        self.window = window
+        self.lock = threading.Lock()
+        self.samples = {}  # {(OracleStatusCode, ProblemType): deque of seconds}
+        self.totals = {}  # {(OracleStatusCode, ProblemType): [count, sum of seconds]}
+
+    def record(self, state, problem_type, seconds):
+        """
+        Stores the duration of a stage. It can be registered as a stage hook of OracleExecutor
+        :param state: (OracleStatusCode) stage
+        :param problem_type: (ProblemType) type of the problem judged
+        :param seconds: (float) duration of the stage
+        :return: None
+        """
+        key = (OracleStatusCode(state), ProblemType(problem_type))
+        with self.lock:
+            self.samples.setdefault(key, deque(maxlen=self.window)).append(seconds)
+            total = self.totals.setdefault(key, [0, 0.0])
+            total[0] += 1
+            total[1] += seconds
+
+    def reset(self):
+        """Removes all the stored durations"""
+        with self.lock:
+            self.samples.clear()
+            self.totals.clear()
+
+    def summary(self):
+        """
+        :return: list of dictionaries {'stage', 'problem_type', 'count', 'sum', 'p50', 'p95', 'p99'} sorted by
+                 problem type and stage. Quantiles are computed on the last 'window' durations
+        """
+        with self.lock:
+            data = [(key, list(self.samples[key]), self.totals[key]) for key in sorted(self.samples,
+                                                                                       key=lambda k: (k[1], k[0]))]
+        result = []
+        for (state, problem_type), values, (count, total) in data:
+            entry = {'stage': state.name, 'problem_type': problem_type.name, 'count': count, 'sum': total}
+            for quantile, value in zip(self.QUANTILES, percentiles(values, self.QUANTILES)):
+                entry[f'p{int(quantile * 100)}'] = value
+            result.append(entry)
+        return result
+
+    def prometheus(self):
+        """
+        :return: (str) metrics in the Prometheus text exposition format, as a summary
+        """
+        lines = ['# HELP lsql_judge_stage_seconds Duration of the stages of the judge',
+                 '# TYPE lsql_judge_stage_seconds summary']
+        for entry in self.summary():
+            labels = f'stage="{entry["stage"]}",problem_type="{entry["problem_type"]}"'
+            for quantile in self.QUANTILES:
+                value = entry[f'p{int(quantile * 100)}']
+                lines.append(f'lsql_judge_stage_seconds{{{labels},quantile="{quantile}"}} {value}')
+            lines.append(f'lsql_judge_stage_seconds_sum{{{labels}}} {entry["sum"]}')
+            lines.append(f'lsql_judge_stage_seconds_count{{{labels}}} {entry["count"]}')
+        return '\n'.join(lines) + '\n'
+
+
+def percentiles(values, points):
+    """
+    :param values: non-empty list of numbers
+    :param points: list of quantiles in (0, 1), e.g. (0.5, 0.95)
+    :return: list with the value of each quantile using linear interpolation
+    """
+    if len(values) == 1:
+        return [values[0]] * len(points)
+    cuts = quantiles(values, n=100, method='inclusive')  # 99 cut points: 1%, 2%, ..., 99%
+    return [cuts[int(round(point * 100)) - 1] for point in points]
+
+
+class JudgeTimings:
+    """Timings of the judge of one submission. All the times are in seconds, None if not measured"""
+
+    def __init__(self):
+        self.queue_time = None  # Waiting for a connection of the admin pool
+        self.execution_time = None  # Executing the code of the student
+        self.judge_time = None  # Whole judge, including the comparison of results
+        self.num_rows = None  # Largest number of rows returned by the code of the student
+
+    def record(self, state, seconds):
+        """
+        Adds the duration of a stage, as several sandboxes can be used to judge a submission
+        :param state: (OracleStatusCode) stage
+        :param seconds: (float) duration of the stage
+        :return: None
+        """
+        if state == OracleStatusCode.GET_ADMIN_CONNECTION:
+            self.queue_time = (self.queue_time or 0.0) + seconds
+        elif state == OracleStatusCode.EXECUTE_USER_CODE:
+            self.execution_time = (self.execution_time or 0.0) + seconds
+
+    def record_rows(self, num_rows):
+        """
+        :param num_rows: (int) number of rows returned by the code of the student in one sandbox
+        :return: None
+        """
+        self.num_rows = max(self.num_rows or 0, num_rows)
+
+
+__CURRENT = threading.local()
+
+
+@contextmanager
+def collect_timings():
+    """
+    Collects in a JudgeTimings the stages executed by this thread inside the 'with' block
+    :return: the JudgeTimings, with the 'judge_time' set when leaving the block
+    """
+    timings = JudgeTimings()
+    __CURRENT.timings = timings
+    init = time.time()
+    try:
+        yield timings
+    finally:
+        timings.judge_time = time.time() - init
+        __CURRENT.timings = None
+
+
+def current_timings():
+    """
+    :return: JudgeTimings collected in this thread, or None if outside collect_timings()
+    """
+    return getattr(__CURRENT, 'timings', None)
+
+
+def record_current(state, _problem_type, seconds):
+    """Stage hook that adds the duration of the stage to the timings collected in this thread, if any"""
+    timings = current_timings()
+    if timings is not None:
+        timings.record(state, seconds)
+
+
+def record_current_rows(num_rows):
+    """Adds the number of rows returned by the code of the student to the timings collected in this thread, if any"""
+    timings = current_timings()
+    if timings is not None:
+        timings.record_rows(num_rows)
+
+
+# Metrics of the judge in this process
+STAGE_METRICS = StageMetrics()
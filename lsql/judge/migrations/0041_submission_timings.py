@@ -0,0 +1,33 @@
+# Generated by Django 3.2.4 on 2026-10-19 10:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('judge', '0040_alter_usedhint_request_date'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='submission',
+            name='execution_time',
+            field=models.FloatField(blank=True, default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name='submission',
+            name='judge_time',
+            field=models.FloatField(blank=True, default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name='submission',
+            name='num_rows',
+            field=models.PositiveIntegerField(blank=True, default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name='submission',
+            name='queue_time',
+            field=models.FloatField(blank=True, default=None, null=True),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 3.2.4 on 2026-10-19 10:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('judge', '0041_submission_timings'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='problem',
+            name='max_rows',
+            field=models.PositiveIntegerField(blank=True, default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name='problem',
+            name='max_tables',
+            field=models.PositiveIntegerField(blank=True, default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name='problem',
+            name='stmt_timeout_ms',
+            field=models.PositiveIntegerField(blank=True, default=None, null=True),
+        ),
+    ]
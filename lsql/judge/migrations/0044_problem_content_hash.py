@@ -0,0 +1,23 @@
+# Generated by Django 3.2.4 on 2026-10-19 10:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('judge', '0043_import_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importjob',
+            name='unchanged',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='problem',
+            name='content_hash',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+    ]
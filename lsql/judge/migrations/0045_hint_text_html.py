@@ -0,0 +1,30 @@
+# Generated by Django 3.2.4 on 2026-10-19 10:46
+
+from django.db import migrations, models
+
+from judge.models import markdown_to_html
+
+
+def render_hints(apps, _):
+    """Generates the HTML of the existing hints"""
+    hint_model = apps.get_model('judge', 'Hint')
+    hints = list(hint_model.objects.all())
+    for hint in hints:
+        hint.text_html = markdown_to_html(hint.text_md, remove_initial_p=True)
+    hint_model.objects.bulk_update(hints, ['text_html'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('judge', '0044_problem_content_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='hint',
+            name='text_html',
+            field=models.TextField(blank=True, max_length=10000),
+        ),
+        migrations.RunPython(render_hints, migrations.RunPython.noop),
+    ]
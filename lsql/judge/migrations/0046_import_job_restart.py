@@ -0,0 +1,23 @@
+# Generated by Django 3.2.4 on 2026-10-19 11:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('judge', '0045_hint_text_html'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importjob',
+            name='heartbeat',
+            field=models.DateTimeField(blank=True, default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name='importjob',
+            name='zip_data',
+            field=models.BinaryField(blank=True, default=None, null=True),
+        ),
+    ]
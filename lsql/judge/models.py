@@ -4,27 +4,35 @@ Copyright Enrique Martín <emartinm@ucm.es> 2020
 
 Models to store objects in the DB
 """
+import hashlib
+import io
+import json
+import threading
+from datetime import timedelta
 from zipfile import ZipFile
 import markdown
 from lxml import html
 from logzero import logger
-from model_utils.managers import InheritanceManager
+from model_utils.managers import InheritanceManager, InheritanceQuerySet
 
 import django.utils.timezone
 from django.contrib.auth import get_user_model
 from django.core.exceptions import ValidationError
-from django.db import models
+from django.db import models, transaction, connection
 from django.conf import settings
 from django.core.validators import MinLengthValidator
 from django.db.models import JSONField, Subquery
+from django.db.models.functions import Coalesce
 from django.core.serializers.json import DjangoJSONEncoder
 from django.utils import translation
 
+from .bulk_import import validate_problems, import_stale_seconds
 from .feedback import compare_select_results, compare_db_results, compare_function_results, compare_discriminant_db
-from .oracle_driver import OracleExecutor
-from .types import VeredictCode, ProblemType
+from .executor import get_executor
+from .oracle_driver import execution_limits
+from .types import VeredictCode, ProblemType, ImportState
 from .parse import load_select_problem, load_dml_problem, load_function_problem, load_proc_problem, \
-    load_trigger_problem, load_discriminant_problem
+    load_trigger_problem, load_discriminant_problem, open_problem_zip
 from .exceptions import ZipFileParsingException
 
 
@@ -41,15 +49,15 @@ def markdown_to_html(markdown_text, remove_initial_p=False):
 def load_many_problems(file, collection):
     """Given a ZIP file containing several ZIP files (each one a problem),
        insert the problems into collection"""
-    problems = list()
+    problems = []
     try:
         with ZipFile(file) as zfile:
             for filename in zfile.infolist():
-                with zfile.open(filename) as curr_file:
-                    problem = load_problem_from_file(curr_file)
-                    problem.collection = collection
-                    problem.author = collection.author
-                    problems.append(problem)
+                # Every problem is decompressed once into memory, as it is accessed several times when parsing
+                problem = load_problem_from_file(io.BytesIO(zfile.read(filename)))
+                problem.collection = collection
+                problem.author = collection.author
+                problems.append(problem)
     except ZipFileParsingException as excp:
         raise ZipFileParsingException('{}: {}'.format(filename.filename, excp)) from excp
     except Exception as excp:
@@ -58,24 +66,97 @@ def load_many_problems(file, collection):
 
 
 def load_problem_from_file(file):
-    """Try to load all the types of problem from file, in order"""
-    problem_types = [(SelectProblem, load_select_problem),
-                     (DMLProblem, load_dml_problem),
-                     (FunctionProblem, load_function_problem),
-                     (ProcProblem, load_proc_problem),
-                     (TriggerProblem, load_trigger_problem),
-                     (DiscriminantProblem, load_discriminant_problem)
-                     ]
-
-    for pclass, load_fun in problem_types:
-        problem = pclass()
+    """Load the problem in the ZIP file, whose class is selected using the field "type" of its JSON file"""
+    problem_types = {ProblemType.SELECT: (SelectProblem, load_select_problem),
+                     ProblemType.DML: (DMLProblem, load_dml_problem),
+                     ProblemType.FUNCTION: (FunctionProblem, load_function_problem),
+                     ProblemType.PROC: (ProcProblem, load_proc_problem),
+                     ProblemType.TRIGGER: (TriggerProblem, load_trigger_problem),
+                     ProblemType.DISC: (DiscriminantProblem, load_discriminant_problem)
+                     }
+
+    with open_problem_zip(file) as pzip:
         try:
-            load_fun(problem, file)
-            return problem
-        except ZipFileParsingException:
-            # It is not the type, try next one
-            pass
-    raise ZipFileParsingException(f'Unable to load {file}')
+            pclass, load_fun = problem_types[ProblemType(pzip.json['type'])]
+        except (TypeError, ValueError):
+            raise ZipFileParsingException(f'Invalid "type" field in problem.json: {pzip.json["type"]}') from None
+        problem = pclass()
+        load_fun(problem, pzip)
+    return problem
+
+
+# Fields of Problem and its subclasses that do not change the results of executing the problem or that are computed
+# by executing it
+NON_EXECUTION_FIELDS = {'id', 'problem_ptr', 'title_md', 'title_html', 'text_md', 'text_html', 'language', 'position',
+                        'collection', 'author', 'creation_date', 'zipfile', 'content_hash', 'initial_db',
+                        'expected_result'}
+EXECUTION_RESULT_FIELDS = ['initial_db', 'expected_result']
+
+
+def import_errors_message(errors):
+    """
+    :param errors: list of (problem, error) returned by validate_problems
+    :return: (str) message with the title and the error of every invalid problem
+    """
+    return '\n'.join(f'{problem.title_md}: {error}' for problem, error in errors)
+
+
+def match_problems(collection, problems):
+    """
+    Matches the problems loaded from a ZIP file with the problems of the collection of the same type and title, so
+    that they are updated instead of added. Problems without a match are new, even if they take the position of a
+    stored problem, so a renamed problem is added as a new one. Matched problems whose execution_hash() has not changed
+    take the expected results of the stored problem, so they are not executed again
+    :param collection: Collection where the problems are loaded
+    :param problems: list of Problem loaded from the ZIP file
+    :return: tuple (list of problems that must be validated, list of unchanged problems)
+    """
+    stored = list(Problem.objects.filter(collection=collection).select_subclasses().order_by('pk')) \
+        if collection.pk is not None else []
+    changed, unchanged = [], []
+    for problem in problems:
+        old = next((old for old in stored if type(old) is type(problem) and old.title_md == problem.title_md), None)
+        if old is None:
+            changed.append(problem)
+            continue
+        stored.remove(old)
+        # Both the primary key of Problem and of the subclass, as they are different fields
+        problem.id, problem.pk = old.id, old.pk
+        problem.creation_date, problem.author = old.creation_date, old.author
+        if old.content_hash and old.content_hash == problem.execution_hash():
+            for field in EXECUTION_RESULT_FIELDS:
+                setattr(problem, field, getattr(old, field))
+            Problem.clean(problem)  # Only generates the HTML, without executing the problem
+            unchanged.append(problem)
+        else:
+            changed.append(problem)
+    return changed, unchanged
+
+
+def save_problems(problems):
+    """Saves (adding or updating) the problems in a single transaction, inserting all the new hints at once"""
+    hints, stale_hints = [], []
+    with transaction.atomic():
+        for problem in problems:
+            # The hints are not saved one by one in the post_save signal
+            hints_info = list(problem.__dict__.pop('hints_info', []))
+            updated = problem.pk is not None
+            problem.save()
+            if updated:
+                # Hints that are still in the ZIP file are kept, so that their uses are not lost
+                for hint in Hint.objects.filter(problem=problem):
+                    if (hint.num_submit, hint.text_md) in hints_info:
+                        hints_info.remove((hint.num_submit, hint.text_md))
+                    else:
+                        stale_hints.append(hint.pk)
+            hints.extend(Hint(text_md=description, problem=problem, num_submit=num_sub)
+                         for num_sub, description in hints_info)
+            logger.debug('%s problem %s "%s" from ZIP (batch)', 'Updated' if updated else 'Added', type(problem),
+                         problem)
+        Hint.objects.filter(pk__in=stale_hints).delete()
+        for hint in hints:
+            hint.render_html()
+        Hint.objects.bulk_create(hints)
 
 
 class Collection(models.Model):
@@ -90,15 +171,27 @@ class Collection(models.Model):
     # (Dirty) trick to load problems from a ZIP fil by editing a collection using the standard admin interface of Django
     zipfile = models.FileField(upload_to='problem_zips/', default=None, blank=True, null=True)
 
+    # If True, the problems of the ZIP file are only parsed in clean() and stored in 'pending_problems', so that they
+    # can be validated and saved by an ImportJob in background (see CollectionAdminForm)
+    background_import = False
+    pending_problems = None
+    pending_zip = None  # Content (bytes) of the ZIP file with the pending problems
+
     def clean(self):
         """Loads and overwrite data from the ZIP file (if it is set) and creates HTML from markdown"""
         try:
             if self.zipfile:
                 problems = load_many_problems(self.zipfile, self)
-                for problem in problems:
-                    problem.clean()
-                    problem.save()
-                    logger.debug('Added problem %s "%s" from ZIP (batch)', type(problem), problem)
+                if self.background_import:
+                    self.pending_problems = problems
+                    self.zipfile.seek(0)
+                    self.pending_zip = self.zipfile.read()
+                else:
+                    changed, _ = match_problems(self, problems)
+                    errors = validate_problems(changed)
+                    if errors:
+                        raise ZipFileParsingException(import_errors_message(errors))
+                    save_problems(problems)
                 self.zipfile = None  # Avoids storing the file in the filesystem
 
             super().clean()
@@ -112,8 +205,9 @@ class Collection(models.Model):
         return html.fromstring(self.name_html).text_content() if self.name_html else self.name_md
 
     def problems(self):
-        """Returns a list of Problem objects in the collection using the inverse FK from Problem to Collection"""
-        return self.problem_set.all().order_by('position', '-creation_date')
+        """Returns a list of Problem objects in the collection using the inverse FK from Problem to Collection, without
+        loading the fields not needed to list them (see ProblemQuerySet.listing)"""
+        return self.problem_set.listing().order_by('position', '-creation_date')
 
     def num_problems(self):
         """Number of problems in the collection"""
@@ -129,6 +223,48 @@ class Collection(models.Model):
         return list(self.problems().order_by('language').distinct('language').values_list('language', flat=True))
 
 
+# Fields of Problem and its subclasses that are not needed to list problems and can be large: statements, SQL code,
+# databases and expected results
+LISTING_DEFERRED_FIELDS = ['text_md', 'text_html', 'create_sql', 'insert_sql', 'initial_db', 'expected_result',
+                           'solution', 'calls', 'proc_call', 'tests', 'incorrect_query', 'correct_query']
+
+
+def listing_deferred_fields(model, prefix=''):
+    """
+    :param model: Problem or one of its subclasses
+    :param prefix: (str) path to the problem in the lookups, e.g. 'problem__' to defer fields of Submission.problem
+    :return: list of lookups of the fields in LISTING_DEFERRED_FIELDS defined in 'model' (not in its ancestors)
+    """
+    return [f'{prefix}{field.name}' for field in model._meta.local_concrete_fields
+            if field.name in LISTING_DEFERRED_FIELDS]
+
+
+class ProblemQuerySet(InheritanceQuerySet):
+    """QuerySet of problems that can avoid loading the fields not needed to list them"""
+
+    def listing(self):
+        """
+        :return: QuerySet that defers the fields in LISTING_DEFERRED_FIELDS, also in the subclasses if
+                 select_subclasses() has been invoked before. Deferred fields are loaded when accessed, with a query
+        """
+        fields = listing_deferred_fields(self.model)
+        for subclass in getattr(self, 'subclasses', []):
+            model = self.model
+            for link in subclass.split('__'):
+                model = model._meta.get_field(link).related_model
+            fields.extend(listing_deferred_fields(model, f'{subclass}__'))
+        return self.defer(*fields)
+
+
+class ProblemManager(InheritanceManager):
+    """InheritanceManager whose QuerySets can defer the fields not needed to list problems"""
+    _queryset_class = ProblemQuerySet
+
+    def listing(self):
+        """:return: QuerySet with all the problems, deferring the fields not needed to list them"""
+        return self.get_queryset().listing()
+
+
 class Problem(models.Model):
     """Base class for problems, with common attributes and methods"""
     __INSERT_SEPARATION = "-- @new data base@"
@@ -148,9 +284,15 @@ class Problem(models.Model):
     position = models.PositiveIntegerField(default=1, null=False)
     # (Dirty) trick to upload ZIP files using the standard admin interface of Django
     zipfile = models.FileField(upload_to='problem_zips/', default=None, blank=True, null=True)
+    # Execution limits of the problem. If not defined (null), the global limits from the environment are used
+    stmt_timeout_ms = models.PositiveIntegerField(default=None, blank=True, null=True)
+    max_rows = models.PositiveIntegerField(default=None, blank=True, null=True)
+    max_tables = models.PositiveIntegerField(default=None, blank=True, null=True)
+    # execution_hash() of the problem when it was validated, empty if unknown
+    content_hash = models.CharField(max_length=64, default='', blank=True)
 
-    # To query Problem to obtain subclass objects with '.select_subclasses()'
-    objects = InheritanceManager()
+    # To query Problem to obtain subclass objects with '.select_subclasses()', and '.listing()' to defer large fields
+    objects = ProblemManager()
 
     def clean(self):
         """Check the number of statements and creates HTML versions from MarkDown"""
@@ -161,11 +303,22 @@ class Problem(models.Model):
 
         self.title_html = markdown_to_html(self.title_md, remove_initial_p=True)
         self.text_html = markdown_to_html(self.text_md, remove_initial_p=False)
+        self.content_hash = self.execution_hash()
 
     def __str__(self):
         """String to show in the Admin interface"""
         return html.fromstring(self.title_html).text_content()
 
+    def execution_hash(self):
+        """
+        :return: (str) SHA-256 of the type of the problem and the fields that determine the results of executing it
+                 (SQL code, number of statements, limits...), i.e., all the fields except those in NON_EXECUTION_FIELDS
+        """
+        values = {field.attname: field.value_from_object(self) for field in self._meta.concrete_fields
+                  if field.name not in NON_EXECUTION_FIELDS}
+        content = json.dumps([type(self).__name__, values], sort_keys=True, cls=DjangoJSONEncoder)
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
     def template(self):
         """Name of the HTML template used to show the problem"""
         raise NotImplementedError
@@ -228,6 +381,10 @@ class Problem(models.Model):
         """List containing all sql inserts"""
         return self.insert_sql.split(self.__INSERT_SEPARATION)
 
+    def limits(self):
+        """Execution limits of the problem, using the global limits for those not defined"""
+        return execution_limits(self.stmt_timeout_ms, self.max_rows, self.max_tables)
+
 
 class SelectProblem(Problem):
     """Problem that requires a SELECT statement as solution"""
@@ -242,12 +399,12 @@ class SelectProblem(Problem):
                 # Replaces the fields with the information from the file
                 load_select_problem(self, self.zipfile)
             super().clean()
-            executor = OracleExecutor.get()
+            executor = get_executor()
             self.expected_result = []
             self.initial_db = []
             for insert_sql in self.insert_sql_list():
                 res = executor.execute_select_test(self.create_sql, insert_sql,
-                                                   self.solution, output_db=True)
+                                                   self.solution, output_db=True, limits=self.limits())
                 self.expected_result.append(res['result'])
                 self.initial_db.append(res['db'])
         except Exception as excp:
@@ -258,7 +415,8 @@ class SelectProblem(Problem):
 
     def judge(self, code, executor):
         first_insert_sql = self.insert_sql_list()[0]
-        oracle_result = executor.execute_select_test(self.create_sql, first_insert_sql, code, output_db=False)
+        oracle_result = executor.execute_select_test(self.create_sql, first_insert_sql, code, output_db=False,
+                                                     limits=self.limits())
         # Check first code with first db
         veredict, feedback = compare_select_results(self.expected_result[0], oracle_result['result'], self.check_order)
         if veredict != VeredictCode.AC:
@@ -267,7 +425,8 @@ class SelectProblem(Problem):
         insert_sql_extra_list = self.insert_sql_list()[1:]
         initial_db_count = 1
         for insert_sql_extra in insert_sql_extra_list:
-            oracle_result_extra = executor.execute_select_test(self.create_sql, insert_sql_extra, code, output_db=False)
+            oracle_result_extra = executor.execute_select_test(self.create_sql, insert_sql_extra, code, output_db=False,
+                                                               limits=self.limits())
             # Check secondary results
             veredict_extra, feedback_extra = compare_select_results(self.expected_result[initial_db_count],
                                                                     oracle_result_extra['result'],
@@ -298,8 +457,9 @@ class DMLProblem(Problem):
                 load_dml_problem(self, self.zipfile)
 
             super().clean()
-            executor = OracleExecutor.get()
-            res = executor.execute_dml_test(self.create_sql, self.insert_sql, self.solution, pre_db=True)
+            executor = get_executor()
+            res = executor.execute_dml_test(self.create_sql, self.insert_sql, self.solution, pre_db=True,
+                                            limits=self.limits())
             self.expected_result = [res['post']]
             self.initial_db = [res['pre']]
         except Exception as excp:
@@ -310,7 +470,8 @@ class DMLProblem(Problem):
 
     def judge(self, code, executor):
         oracle_result = executor.execute_dml_test(self.create_sql, self.insert_sql, code, pre_db=False,
-                                                  min_stmt=self.min_stmt, max_stmt=self.max_stmt)
+                                                  min_stmt=self.min_stmt, max_stmt=self.max_stmt,
+                                                  limits=self.limits())
         return compare_db_results(self.expected_result[0], oracle_result['post'])
 
     def problem_type(self):
@@ -333,8 +494,9 @@ class FunctionProblem(Problem):
                 load_function_problem(self, self.zipfile)
 
             super().clean()
-            executor = OracleExecutor.get()
-            res = executor.execute_function_test(self.create_sql, self.insert_sql, self.solution, self.calls)
+            executor = get_executor()
+            res = executor.execute_function_test(self.create_sql, self.insert_sql, self.solution, self.calls,
+                                                 limits=self.limits())
             self.expected_result = [res['results']]
             self.initial_db = [res['db']]
         except Exception as excp:
@@ -350,7 +512,8 @@ class FunctionProblem(Problem):
         return {'rows': rows, 'header': [('Llamada', None), ('Resultado', None)]}
 
     def judge(self, code, executor):
-        oracle_result = executor.execute_function_test(self.create_sql, self.insert_sql, code, self.calls)
+        oracle_result = executor.execute_function_test(self.create_sql, self.insert_sql, code, self.calls,
+                                                       limits=self.limits())
         return compare_function_results(self.expected_result[0], oracle_result['results'])
 
     def problem_type(self):
@@ -377,16 +540,17 @@ class ProcProblem(Problem):
                 self.zipfile = None  # Avoid saving the file to the filesystem
 
             super().clean()
-            executor = OracleExecutor.get()
+            executor = get_executor()
             res = executor.execute_proc_test(self.create_sql, self.insert_sql, self.solution, self.proc_call,
-                                             pre_db=True)
+                                             pre_db=True, limits=self.limits())
             self.expected_result = [res['post']]
             self.initial_db = [res['pre']]
         except Exception as excp:
             raise ValidationError(excp) from excp
 
     def judge(self, code, executor):
-        oracle_result = executor.execute_proc_test(self.create_sql, self.insert_sql, code, self.proc_call, pre_db=False)
+        oracle_result = executor.execute_proc_test(self.create_sql, self.insert_sql, code, self.proc_call, pre_db=False,
+                                                   limits=self.limits())
         return compare_db_results(self.expected_result[0], oracle_result['post'])
 
     def problem_type(self):
@@ -412,9 +576,9 @@ class TriggerProblem(Problem):
                 load_trigger_problem(self, self.zipfile)
 
             super().clean()
-            executor = OracleExecutor.get()
+            executor = get_executor()
             res = executor.execute_trigger_test(self.create_sql, self.insert_sql,
-                                                self.solution, self.tests, pre_db=True)
+                                                self.solution, self.tests, pre_db=True, limits=self.limits())
             self.expected_result = [res['post']]
             self.initial_db = [res['pre']]
         except Exception as excp:
@@ -422,7 +586,7 @@ class TriggerProblem(Problem):
 
     def judge(self, code, executor):
         oracle_result = executor.execute_trigger_test(self.create_sql, self.insert_sql, code, self.tests,
-                                                      pre_db=False)
+                                                      pre_db=False, limits=self.limits())
         return compare_db_results(self.expected_result[0], oracle_result['post'])
 
     def problem_type(self):
@@ -446,13 +610,13 @@ class DiscriminantProblem(Problem):
                 # Replaces the fields with the information from the file
                 load_discriminant_problem(self, self.zipfile)
             super().clean()
-            executor = OracleExecutor.get()
+            executor = get_executor()
             self.expected_result = []
             self.initial_db = []
             # In this case (this type of problem) there are only one database
             for insert_sql in self.insert_sql_list():
                 res = executor.execute_select_test(self.create_sql, insert_sql,
-                                                   self.incorrect_query, output_db=True)
+                                                   self.incorrect_query, output_db=True, limits=self.limits())
                 self.expected_result.append(res['result'])
                 self.initial_db.append(res['db'])
         except Exception as excp:
@@ -461,7 +625,7 @@ class DiscriminantProblem(Problem):
     def judge(self, code, executor):
         insert_sql = self.insert_sql_list()[0]  # In this type of problem there is only one database
         result = executor.execute_discriminant_test(self.create_sql, insert_sql, code, self.correct_query,
-                                                    self.incorrect_query)
+                                                    self.incorrect_query, limits=self.limits())
         incorrect_result = result["result_incorrect"]
         correct_result = result["result_correct"]
         return compare_discriminant_db(incorrect_result, correct_result, self.check_order)
@@ -482,6 +646,11 @@ class Submission(models.Model):
     veredict_message = models.CharField(max_length=5000, null=True)
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     problem = models.ForeignKey(Problem, on_delete=models.CASCADE)
+    # Timings in seconds and number of rows of the judge (see judge.metrics.JudgeTimings), null if not judged
+    execution_time = models.FloatField(default=None, blank=True, null=True)
+    judge_time = models.FloatField(default=None, blank=True, null=True)
+    queue_time = models.FloatField(default=None, blank=True, null=True)
+    num_rows = models.PositiveIntegerField(default=None, blank=True, null=True)
 
     def __str__(self):
         return f"{self.pk} - {self.user.email} - {self.veredict_code}"
@@ -683,13 +852,24 @@ class NumSubmissionsProblemsAchievementDefinition(AchievementDefinition, models.
 class Hint(models.Model):
     """Hints of a problem"""
     text_md = models.TextField(max_length=5000, validators=[MinLengthValidator(1)], blank=True)
+    # HTML version of text_md, generated when the hint is saved
+    text_html = models.TextField(max_length=10000, blank=True)
     problem = models.ForeignKey(Problem, on_delete=models.CASCADE)
     num_submit = models.PositiveIntegerField(default=0, null=False)
 
+    def render_html(self):
+        """Converts text_md into HTML and stores it in text_html (without saving). Must be invoked before bulk_create,
+        as it does not invoke save()"""
+        self.text_html = markdown_to_html(self.text_md, remove_initial_p=True)
+
+    def save(self, *args, **kwargs):
+        """Saves the hint with the HTML version of text_md"""
+        self.render_html()
+        super().save(*args, **kwargs)
+
     def get_text_html(self):
-        """Converts a markdown string into HTML"""
-        text_html = markdown_to_html(self.text_md, remove_initial_p=True)
-        return text_html
+        """HTML version of the hint"""
+        return self.text_html
 
 
 class UsedHint(models.Model):
@@ -697,3 +877,109 @@ class UsedHint(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     request_date = models.DateTimeField(auto_now_add=True)
     hint_definition = models.ForeignKey(Hint, on_delete=models.CASCADE)
+
+
+class ImportJob(models.Model):
+    """Import of the problems of a collection ZIP in background, validating them in parallel. Problems are saved only
+    if all of them are valid"""
+    collection = models.ForeignKey(Collection, on_delete=models.CASCADE)
+    author = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, on_delete=models.SET_NULL)
+    state = models.CharField(max_length=7, choices=ImportState.choices, default=ImportState.PENDING)
+    total = models.PositiveIntegerField(default=0)
+    processed = models.PositiveIntegerField(default=0)
+    # Problems already in the collection that have not changed, so they are not executed
+    unchanged = models.PositiveIntegerField(default=0)
+    # List of {"problem": title, "error": message} with the invalid problems
+    errors = JSONField(encoder=DjangoJSONEncoder, default=list, blank=True)
+    creation_date = models.DateTimeField(auto_now_add=True)
+    finish_date = models.DateTimeField(default=None, blank=True, null=True)
+    # Last time the job made progress, to detect jobs whose thread died with the server (see fail_stale)
+    heartbeat = models.DateTimeField(default=None, blank=True, null=True)
+    # Content of the ZIP file, kept until the import finishes correctly so that the job can be restarted
+    zip_data = models.BinaryField(default=None, blank=True, null=True)
+
+    def __str__(self):
+        """String to show in the Admin"""
+        return f'{self.collection}: {self.processed}/{self.total} ({self.state})'
+
+    def update(self, **fields):
+        """Stores the values of the fields in the object and in the DB, refreshing the heartbeat"""
+        fields.setdefault('heartbeat', django.utils.timezone.now())
+        for name, value in fields.items():
+            setattr(self, name, value)
+        ImportJob.objects.filter(pk=self.pk).update(**fields)
+
+    def run(self, problems, workers=None):
+        """
+        Validates concurrently the problems that are new or have changed (see match_problems), updating the progress
+        after each one, and saves all of them if valid
+        :param problems: list of Problem parsed from the ZIP file
+        :param workers: (int) problems validated at the same time, by default judge.bulk_import.import_workers()
+        :return: None
+        """
+        def progress(problem, error):
+            if error is not None:
+                self.update(errors=[*self.errors, {'problem': problem.title_md, 'error': error}])
+            self.update(processed=self.processed + 1)
+
+        try:
+            changed, unchanged = match_problems(self.collection, problems)
+            self.update(state=ImportState.RUNNING, total=len(problems), processed=len(unchanged),
+                        unchanged=len(unchanged), errors=[])
+            errors = validate_problems(changed, workers, progress)
+            if not errors:
+                save_problems(problems)
+            if errors:
+                self.update(state=ImportState.FAILED, finish_date=django.utils.timezone.now())
+            else:
+                self.update(state=ImportState.DONE, finish_date=django.utils.timezone.now(), zip_data=None)
+            logger.info('Import of %s problems (%s unchanged) in collection %s: %s', len(problems), len(unchanged),
+                        self.collection_id, self.state)
+        except Exception as excp:  # pylint: disable=broad-except
+            logger.exception('Error importing problems in collection %s', self.collection_id)
+            self.update(state=ImportState.FAILED, errors=[*self.errors, {'problem': '', 'error': f'{excp}'}],
+                        finish_date=django.utils.timezone.now())
+
+    def start(self, problems, workers=None):
+        """Runs the job in a background thread once the current transaction (that created the job) is committed"""
+        def run():
+            try:
+                self.run(problems, workers)
+            finally:
+                connection.close()  # The thread has its own connection to the DB
+        transaction.on_commit(lambda: threading.Thread(target=run, name=f'import-{self.pk}', daemon=True).start())
+
+    def restart(self, workers=None):
+        """
+        Parses again the stored ZIP file and runs the job from the beginning in a background thread (see start)
+        :param workers: (int) problems validated at the same time, by default judge.bulk_import.import_workers()
+        :return: None, raises ZipFileParsingException if the job has no ZIP file or it cannot be parsed
+        """
+        if self.zip_data is None:
+            raise ZipFileParsingException('The import job has no ZIP file to restart it')
+        problems = load_many_problems(io.BytesIO(self.zip_data), self.collection)
+        self.update(state=ImportState.PENDING, total=len(problems), processed=0, unchanged=0, errors=[],
+                    finish_date=None)
+        self.start(problems, workers)
+
+    @staticmethod
+    def fail_stale(timeout=None):
+        """
+        Marks as FAILED the pending or running jobs without progress in the last 'timeout' seconds. The jobs run in
+        threads of the server, so they are interrupted if it is restarted and would remain pending or running forever
+        :param timeout: (int) seconds, by default judge.bulk_import.import_stale_seconds()
+        :return: (int) number of jobs marked as FAILED
+        """
+        timeout = import_stale_seconds() if timeout is None else timeout
+        now = django.utils.timezone.now()
+        stale = (ImportJob.objects.filter(state__in=[ImportState.PENDING, ImportState.RUNNING])
+                 .annotate(last_progress=Coalesce('heartbeat', 'creation_date'))
+                 .filter(last_progress__lt=now - timedelta(seconds=timeout)))
+        num = 0
+        for job in stale:
+            logger.warning('Import job %s in collection %s interrupted', job.pk, job.collection_id)
+            job.update(state=ImportState.FAILED, finish_date=now,
+                       errors=[*job.errors, {'problem': '', 'error': 'Interrupted (no progress in '
+                                                                     f'{timeout} seconds), it can be restarted'}])
+            num += 1
+        return num
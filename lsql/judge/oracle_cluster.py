@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright Enrique Martín <emartinm@ucm.es> 2021
+
+Executor that distributes the submissions among several Oracle instances, each one with its own OracleExecutor and
+pool of connections. It is selected with JUDGE_EXECUTOR='judge.oracle_cluster.OracleClusterExecutor' and the
+instances are taken from ORACLE_INSTANCES, e.g. 'localhost:1521/xe,localhost:1522/xe'
+"""
+
+import os
+import random
+import re
+import threading
+from collections import namedtuple
+from logzero import logger
+
+from .exceptions import ExecutorException
+from .executor import Executor
+from .metrics import STAGE_METRICS, record_current
+from .oracle_driver import OracleExecutor
+from .reaper import DanglingUserReaper
+from .types import OracleStatusCode
+
+# Stages whose errors are caused by the instance and not by the code judged, so the submission can be sent to
+# another instance
+INSTANCE_STAGES = (OracleStatusCode.GET_ADMIN_CONNECTION, OracleStatusCode.CREATE_USER,
+                   OracleStatusCode.GET_USER_CONNECTION)
+
+# Seconds between health checks of the instances if ORACLE_HEALTH_INTERVAL_S is not defined
+DEFAULT_HEALTH_INTERVAL_S = 10
+
+# Aggregated use of the admin pools of all the instances
+PoolUsage = namedtuple('PoolUsage', ['busy', 'max'])
+
+
+def parse_instances(text):
+    """
+    :param text: (str) Oracle instances 'SERVER:PORT/SID' separated by commas
+    :return: list of tuples (server, port, sid)
+    """
+    instances = []
+    for item in text.split(','):
+        if not item.strip():
+            continue
+        match = re.fullmatch(r'([^:/]+):(\d+)/(\w+)', item.strip())
+        if match is None:
+            raise ValueError(f'Invalid Oracle instance "{item}", use SERVER:PORT/SID')
+        instances.append((match.group(1), int(match.group(2)), match.group(3)))
+    return instances
+
+
+class OracleNode:
+    """Oracle instance of the cluster. Its executor is created on demand, so that an instance that is down when the
+    process starts can join later"""
+
+    def __init__(self, name, factory):
+        """
+        :param name: (str) name of the instance in logs and metrics
+        :param factory: function without parameters that creates the executor of the instance
+        """
+        self.name = name
+        self.factory = factory
+        self.executor = None
+        self.outstanding = 0  # Submissions being judged in the instance
+        self.failures = 0  # Consecutive errors caused by the instance
+        self.healthy = True
+        self.drained = False  # Removed by hand, for example for maintenance
+
+    def connect(self, hooks):
+        """
+        Creates the executor of the instance if it does not exist, registering the stage hooks
+        :param hooks: list of stage hooks (see OracleExecutor.add_stage_hook)
+        :return: the executor
+        """
+        if self.executor is None:
+            executor = self.factory()
+            for hook in hooks:
+                executor.add_stage_hook(hook)
+            self.executor = executor
+        return self.executor
+
+    def load(self):
+        """:return: (float) fraction of the admin pool used by the submissions in the instance"""
+        return self.outstanding / max(self.executor.connection_pool.max, 1)
+
+    def available(self):
+        """:return: (bool) whether new submissions can be sent to the instance"""
+        return self.healthy and not self.drained and self.executor is not None
+
+
+class OracleClusterExecutor(Executor):
+    """Executor that sends every submission to the available instance with less outstanding work (relative to the
+    size of its pool). Instances with 'max_failures' consecutive errors of connection or user creation are drained
+    until a health check succeeds, and submissions that failed for those reasons are retried in another instance"""
+
+    def __init__(self, nodes, max_failures=3, hooks=(), reaper_interval=None):
+        """
+        :param nodes: list of OracleNode
+        :param max_failures: (int) consecutive errors after which an instance is drained
+        :param hooks: stage hooks registered in the executors of all the instances
+        :param reaper_interval: (int) if not None, seconds between rounds of the DanglingUserReaper started for
+                                every instance
+        """
+        super().__init__()
+        self.nodes = nodes
+        self.max_failures = max_failures
+        self.lock = threading.Lock()
+        self.stage_hooks.extend(hooks)
+        self.reaper_interval = reaper_interval
+        for node in nodes:
+            self.connect(node)
+
+    @classmethod
+    def create(cls):
+        """Shared executor with one OracleExecutor for each instance in ORACLE_INSTANCES. As in OracleExecutor,
+        stages are recorded in judge.metrics and dangling users are removed if ORACLE_REAPER_INTERVAL_S is defined.
+        A background thread checks the instances every ORACLE_HEALTH_INTERVAL_S seconds (DEFAULT_HEALTH_INTERVAL_S
+        if not defined), so that drained instances can receive submissions again"""
+        nodes = [OracleNode(f'{server}:{port}/{sid}',
+                            lambda server=server, port=port, sid=sid: OracleExecutor(server, port, sid))
+                 for server, port, sid in parse_instances(os.environ['ORACLE_INSTANCES'])]
+        reaper_interval = os.environ.get('ORACLE_REAPER_INTERVAL_S')
+        cluster = cls(nodes, hooks=[STAGE_METRICS.record, record_current],
+                      reaper_interval=int(reaper_interval) if reaper_interval else None)
+        interval = os.environ.get('ORACLE_HEALTH_INTERVAL_S')
+        HealthChecker(cluster, interval=int(interval) if interval else DEFAULT_HEALTH_INTERVAL_S).start()
+        return cluster
+
+    @property
+    def connection_pool(self):
+        """:return: PoolUsage with the busy and maximum connections of all the instances"""
+        executors = [node.executor for node in self.nodes if node.executor is not None]
+        return PoolUsage(busy=sum(executor.connection_pool.busy for executor in executors),
+                         max=sum(executor.connection_pool.max for executor in executors))
+
+    def add_stage_hook(self, hook):
+        """Registers a stage hook in the executors of all the instances (see OracleExecutor.add_stage_hook)"""
+        self.stage_hooks.append(hook)
+        for node in self.nodes:
+            if node.executor is not None:
+                node.executor.add_stage_hook(hook)
+
+    def connect(self, node):
+        """
+        Creates the executor of an instance. If it is not possible, the instance is marked as not healthy
+        :return: (bool) whether the instance has an executor
+        """
+        if node.executor is not None:
+            return True
+        try:
+            node.connect(self.stage_hooks)
+            if self.reaper_interval:
+                DanglingUserReaper(node.executor, interval=self.reaper_interval).start()
+            return True
+        except Exception as excp:  # pylint: disable=broad-except
+            logger.error('Unable to connect to Oracle instance %s: %s', node.name, excp)
+            node.healthy = False
+            return False
+
+    def choose(self, exclude=()):
+        """
+        Selects the instance for a submission and increases its outstanding work. If no instance is healthy, the
+        instances marked as not healthy (but not drained by hand) are tried anyway, as they may have recovered
+        before the next health check
+        :param exclude: instances that must not be chosen
+        :return: OracleNode. Raises an ExecutorException if there are no available instances
+        """
+        with self.lock:
+            candidates = [node for node in self.nodes if node.available() and node not in exclude]
+            if not candidates:
+                candidates = [node for node in self.nodes
+                              if not node.drained and node.executor is not None and node not in exclude]
+            if not candidates:
+                raise ExecutorException(OracleStatusCode.GET_ADMIN_CONNECTION, 'No Oracle instance available')
+            node = min(candidates, key=lambda candidate: (candidate.load(), random.random()))
+            node.outstanding += 1
+            return node
+
+    def failure(self, node, excp):
+        """Registers an error caused by an instance, draining it after 'max_failures' consecutive errors"""
+        with self.lock:
+            node.failures += 1
+            if node.failures >= self.max_failures and node.healthy:
+                node.healthy = False
+                logger.error('Draining Oracle instance %s after %s consecutive errors: %s', node.name, node.failures,
+                             excp.message)
+
+    def route(self, method, *args, **kwargs):
+        """
+        Executes a method of OracleExecutor in the chosen instance, retrying in other instances while the errors
+        are caused by the instances
+        :param method: (str) name of the method
+        :return: the result of the method
+        """
+        tried, errors = [], []
+        while True:
+            try:
+                node = self.choose(tried)
+            except ExecutorException:
+                if errors:
+                    raise errors[-1] from None  # The error of the last instance tried
+                raise
+            try:
+                result = getattr(node.executor, method)(*args, **kwargs)
+                node.failures = 0
+                return result
+            except ExecutorException as excp:
+                if excp.error_code not in INSTANCE_STAGES:
+                    node.failures = 0  # Error in the code judged, the instance works
+                    raise
+                logger.info('Error in Oracle instance %s, trying another instance: %s', node.name, excp.message)
+                self.failure(node, excp)
+                tried.append(node)
+                errors.append(excp)
+            finally:
+                with self.lock:
+                    node.outstanding -= 1
+
+    def check_health(self):
+        """
+        Checks all the instances (not drained by hand) with a query, marking them as healthy or not
+        :return: list of names of the healthy instances
+        """
+        for node in self.nodes:
+            if node.drained or not self.connect(node):
+                continue
+            try:
+                node.executor.ping()
+                if not node.healthy:
+                    logger.info('Oracle instance %s is back', node.name)
+                with self.lock:
+                    node.healthy, node.failures = True, 0
+            except Exception as excp:  # pylint: disable=broad-except
+                if node.healthy:
+                    logger.error('Draining Oracle instance %s after a failed health check: %s', node.name, excp)
+                node.healthy = False
+        return [node.name for node in self.nodes if node.available()]
+
+    def drain(self, name, drained=True):
+        """
+        Stops (or resumes, if drained=False) sending submissions to an instance. Submissions already sent finish
+        :param name: (str) name of the instance
+        :return: None
+        """
+        for node in self.nodes:
+            if node.name == name:
+                node.drained = drained
+                logger.info('Oracle instance %s %s', name, 'drained' if drained else 'resumed')
+
+    def execute_select_test(self, creation, insertion, select, output_db=False, limits=None):
+        return self.route('execute_select_test', creation, insertion, select, output_db=output_db, limits=limits)
+
+    def execute_dml_test(self, creation, insertion, dml, pre_db=True, min_stmt=0, max_stmt=float("inf"),
+                         limits=None):
+        # pylint: disable=too-many-arguments
+        return self.route('execute_dml_test', creation, insertion, dml, pre_db=pre_db, min_stmt=min_stmt,
+                          max_stmt=max_stmt, limits=limits)
+
+    def execute_function_test(self, creation, insertion, func_creation, tests, limits=None):
+        # pylint: disable=too-many-arguments
+        return self.route('execute_function_test', creation, insertion, func_creation, tests, limits=limits)
+
+    def execute_proc_test(self, creation, insertion, proc_creation, proc_call, pre_db=True, limits=None):
+        # pylint: disable=too-many-arguments
+        return self.route('execute_proc_test', creation, insertion, proc_creation, proc_call, pre_db=pre_db,
+                          limits=limits)
+
+    def execute_trigger_test(self, creation, insertion, trigger_definition, tests, pre_db=True, limits=None):
+        # pylint: disable=too-many-arguments
+        return self.route('execute_trigger_test', creation, insertion, trigger_definition, tests, pre_db=pre_db,
+                          limits=limits)
+
+    def execute_discriminant_test(self, creation, insertion_base, insertion_user, select_correct, select_incorrect,
+                                  limits=None):
+        # pylint: disable=too-many-arguments
+        return self.route('execute_discriminant_test', creation, insertion_base, insertion_user, select_correct,
+                          select_incorrect, limits=limits)
+
+
+class HealthChecker(threading.Thread):
+    """Daemon thread that checks the instances of an OracleClusterExecutor periodically"""
+
+    def __init__(self, cluster, interval=10):
+        """
+        :param cluster: OracleClusterExecutor
+        :param interval: (int) seconds between checks
+        """
+        super().__init__(name='oracle-health-checker', daemon=True)
+        self.cluster = cluster
+        self.interval = interval
+        self.stop_event = threading.Event()
+
+    def run(self):
+        """Checks the instances every 'interval' seconds until stop() is invoked"""
+        while not self.stop_event.wait(self.interval):
+            self.cluster.check_health()
+
+    def stop(self):
+        """Asks the thread to finish after the current check"""
+        self.stop_event.set()
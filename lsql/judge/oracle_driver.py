@@ -4,6 +4,7 @@ Copyright Enrique Martín <emartinm@ucm.es> 2020
 
 Class to connect to Oracle and execute the different types of problems
 """
+# pylint: disable=too-many-lines
 
 # Needs to use cx_Oracle
 # export LD_LIBRARY_PATH=$LD_LIBRARY_PATH:/home/kike/xDownload/instantclient_19_6
@@ -14,6 +15,10 @@ import random
 import os
 import re
 import json
+from collections import namedtuple
+from contextlib import contextmanager
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
 import cx_Oracle
 from logzero import logger
 import sqlparse
@@ -21,7 +26,16 @@ import sqlparse
 from django.core.serializers.json import DjangoJSONEncoder
 
 from .exceptions import ExecutorException
-from .types import OracleStatusCode
+from .executor import Executor
+from .metrics import record_current_rows
+from .reaper import DanglingUserReaper
+from .teardown import DeferredTeardown
+from .types import OracleStatusCode, ProblemType
+
+
+# Maximum number of INSERT statements sent together in the same anonymous PL/SQL block when loading data
+INSERT_BLOCK_SIZE = 200
+__INSERT_VALUES_PATTERN = re.compile(r'^\s*INSERT\s+INTO\s.+\sVALUES\s*\(', flags=re.IGNORECASE | re.DOTALL)
 
 
 def replace_rest_stmt_blanks(statements):
@@ -107,17 +121,64 @@ def uniform_dict(dictionary):
     return json.loads(string_rep)
 
 
-def table_from_cursor(cursor):
+# Limits when executing a submission: statement timeout in milliseconds and maximum number of rows, columns and tables
+ExecutionLimits = namedtuple('ExecutionLimits', ['stmt_timeout_ms', 'max_rows', 'max_cols', 'max_tables'])
+
+
+@lru_cache(maxsize=None)
+def default_limits():
+    """Global limits from the environment variables ORACLE_STMT_TIMEOUT_MS, ORACLE_MAX_ROWS, ORACLE_MAX_COLS and
+    ORACLE_MAX_TABLES. They are read only once"""
+    return ExecutionLimits(
+        stmt_timeout_ms=int(os.environ['ORACLE_STMT_TIMEOUT_MS']),
+        max_rows=int(os.environ['ORACLE_MAX_ROWS']),
+        max_cols=int(os.environ['ORACLE_MAX_COLS']),
+        max_tables=int(os.environ['ORACLE_MAX_TABLES'])
+    )
+
+
+def execution_limits(stmt_timeout_ms=None, max_rows=None, max_tables=None):
+    """
+    Limits of a problem, taking the global limits for those not defined (None)
+    :param stmt_timeout_ms: (int) milliseconds that a statement can run
+    :param max_rows: (int) maximum number of rows in a result or table
+    :param max_tables: (int) maximum number of tables of the user
+    :return: ExecutionLimits
+    """
+    values = {'stmt_timeout_ms': stmt_timeout_ms, 'max_rows': max_rows, 'max_tables': max_tables}
+    return default_limits()._replace(**{name: value for name, value in values.items() if value is not None})
+
+
+def fetch_limited(cursor, limits):
+    """
+    Fetches all the rows of a cursor that has executed a SELECT statement, raising an ExecutorException with status
+    code OracleStatusCode.TLE_USER_CODE if it has more than 'max_cols' columns or more than 'max_rows' rows. Shared
+    by the table_from_cursor of all the executors
+    :param cursor: DB cursor with description
+    :param limits: ExecutionLimits
+    :return: list of rows
+    """
+    if len(cursor.description) > limits.max_cols:
+        logger.debug('TLE caused by too many columns in cursor')
+        raise ExecutorException(OracleStatusCode.TLE_USER_CODE)
+    rows = cursor.fetchmany(limits.max_rows)  # Takes MAX rows
+    if cursor.fetchone():  # There are more rows
+        logger.debug('TLE caused by too many rows in cursor')
+        raise ExecutorException(OracleStatusCode.TLE_USER_CODE)
+    return rows
+
+
+def table_from_cursor(cursor, limits=None):
     """
     Takes a cursor that has executed a SELECT statement and returns all the results
     in a dictionary. It checks if the number of columns in the cursor exceeds
     ORACLE_MAX_COLS or the number of rows exceeds ORACLE_MAX_ROWS. In those cases
     raises an ExecutorException with status code OracleStatusCode.TLE_USER_CODE
     :param cursor: DB cursor
+    :param limits: ExecutionLimits to use instead of the global limits
     :return: a dictionary {'header':[[NAME:str, TYPE:str]], 'rows': [list]}
     """
-    max_rows = int(os.environ['ORACLE_MAX_ROWS'])
-    max_cols = int(os.environ['ORACLE_MAX_COLS'])
+    limits = limits or default_limits()
     table = dict()
 
     if cursor.description is None:
@@ -126,32 +187,26 @@ def table_from_cursor(cursor):
         table['rows'] = list()
         return table  # return empty table (no columns, no rows)
 
-    if len(cursor.description) > max_cols:
-        logger.debug('TLE caused by too many columns in cursor')
-        raise ExecutorException(OracleStatusCode.TLE_USER_CODE)
     table['header'] = [[e[0], str(e[1])] for e in cursor.description]
-
-    batch = cursor.fetchmany(numRows=max_rows)  # Takes MAX rows
-    if cursor.fetchone():  # There are more rows
-        logger.debug('TLE caused by too many rows in cursor')
-        raise ExecutorException(OracleStatusCode.TLE_USER_CODE)
-    table['rows'] = [list(e) for e in batch]
+    table['rows'] = [list(e) for e in fetch_limited(cursor, limits)]
 
     return uniform_dict(table)  # Represents datetime as uniform strings
 
 
-def get_all_tables(conn):
+def get_all_tables(conn, limits=None):
     """
     Returns a dictionary representing all the tables in the DB. It checks if the
     number of tables owned by the user exceeds ORACLE_MAX_TABLES, and raises an
     ExecutorException with status code OracleStatusCode.TLE_USER_CODE
     :param conn: DB connection
+    :param limits: ExecutionLimits to use instead of the global limits
     :return: dictionary {table_name: TABLE}, where TABLE is the dictionary
              generated by table_from_cursor
     """
+    limits = limits or default_limits()
     with conn.cursor() as cursor:
         cursor.execute("SELECT table_name FROM USER_TABLES")
-        tables = cursor.fetchmany(int(os.environ['ORACLE_MAX_TABLES']))
+        tables = cursor.fetchmany(limits.max_tables)
         if cursor.fetchone():
             logger.debug('Too many tables in user DB')
             raise ExecutorException(OracleStatusCode.TLE_USER_CODE)
@@ -165,17 +220,18 @@ def get_all_tables(conn):
                 cursor.execute("SELECT * FROM {}".format(table_name))  # Direct name
             except cx_Oracle.DatabaseError:
                 cursor.execute('SELECT * FROM "{}"'.format(table_name))  # Quoted name
-            table = table_from_cursor(cursor)
+            table = table_from_cursor(cursor, limits)
             db_dict[table_name] = table
 
         return db_dict
 
 
-def execute_select_statement(conn, statement):
+def execute_select_statement(conn, statement, limits=None):
     """
     Given a connection to an Oracle database, executes a string containing exactly ONE statement
     :param conn: Oracle connection
     :param statement: String containing one SQL Select statement
+    :param limits: ExecutionLimits to use instead of the global limits
     :return: List with the results of the SELECT statement. It raises an IncorrectNumberOfSentences
              exception if 'statement' contains more than one SQL statement, and a
              cx_Oracle.DatabaseError if the execution of the statements is not correct
@@ -191,7 +247,7 @@ def execute_select_statement(conn, statement):
         cursor.execute(statements[0])
         logger.debug('User %s - SQL select statement <<%s>> executed in %s seconds',
                      conn.username, statement, time.time() - init)
-        table = table_from_cursor(cursor)
+        table = table_from_cursor(cursor, limits)
     return table
 
 
@@ -234,6 +290,77 @@ def execute_sql_script(conn, script):
                          conn.username, statements, time.time() - init)
 
 
+def is_insert_values(statement: str) -> bool:
+    """Whether statement is an 'INSERT INTO table ... VALUES (...)' statement"""
+    return __INSERT_VALUES_PATTERN.match(statement) is not None
+
+
+def group_insert_statements(statements, block_size=INSERT_BLOCK_SIZE):
+    """
+    Groups consecutive 'INSERT INTO ... VALUES (...)' statements in batches of at most block_size statements.
+    :param statements: [str] SQL statements as returned by clean_sql
+    :param block_size: maximum number of statements in a batch
+    :return: [(bool, [str])] list of pairs (is_batch, statements). Batches contain 2 or more INSERT statements, and
+             the rest of statements appear alone in their own group, keeping the original order
+    """
+    groups = []
+    batch = []
+    for statement in statements:
+        if is_insert_values(statement) and len(batch) < block_size:
+            batch.append(statement)
+            continue
+        if batch:
+            groups.append((len(batch) > 1, batch))
+        if is_insert_values(statement):
+            batch = [statement]  # The previous batch was full
+        else:
+            batch = []
+            groups.append((False, [statement]))
+    if batch:
+        groups.append((len(batch) > 1, batch))
+    return groups
+
+
+def insert_block(statements):
+    """Anonymous PL/SQL block that executes all the statements in the list"""
+    body = '\n'.join(f'{stmt.strip()};' for stmt in statements)
+    return f'BEGIN\n{body}\nEND;'
+
+
+def execute_insert_script(conn, script):
+    """
+    Given an Oracle connection, executes a script formed by one or more statements. Consecutive
+    'INSERT INTO ... VALUES (...)' statements are sent together in anonymous PL/SQL blocks, so loading
+    the data of a problem needs a handful of round trips instead of one per row. The rest of statements
+    are executed one by one as in execute_sql_script. If a block fails, Oracle discards all its changes and its
+    statements are executed one by one to raise the error of the concrete statement.
+    It must only be used with trusted code (problem definitions), as the offsets in the errors of the blocks
+    do not correspond to the original script.
+    :param conn: Oracle connection
+    :param script: String containing one or more SQL statements (DDL, DML, etc)
+    :return: None. It raises a cx_Oracle.DatabaseError if the execution of any of the
+             statements is not correct.
+    """
+    init = time.time()
+    statements = clean_sql(script)
+    if len(statements) > 0:
+        with conn.cursor() as cursor:
+            for is_batch, group in group_insert_statements(statements):
+                if is_batch:
+                    try:
+                        cursor.execute(insert_block(group))
+                        continue
+                    except cx_Oracle.DatabaseError as excp:
+                        logger.debug('User %s - Error in block of %s INSERT statements, executing them one by one '
+                                     '(%s)', conn.username, len(group), excp)
+                for statement in group:
+                    logger.debug('Executing SQL statement <<%s>>', statement)
+                    cursor.execute(statement)
+            conn.commit()
+            logger.debug('User %s - SQL insert script with %s statements executed in %s seconds',
+                         conn.username, len(statements), time.time() - init)
+
+
 def get_compilation_errors(conn):
     """
     Extracts compilation errors from table SYS.USER_ERRORS and returns
@@ -286,16 +413,228 @@ def offset_from_oracle_exception(excp: cx_Oracle.DatabaseError) -> int:
 #     return correct
 
 
-def build_dsn_tns():
-    """Build a Data Source Name from values in the environment"""
+def build_dsn_tns(pooled=False, server=None, port=None, sid=None):
+    """Build a Data Source Name from the server, port and SID, taking those not given from the environment. If
+    pooled=True, the DSN asks for a pooled server of Database Resident Connection Pooling (DRCP) instead of a
+    dedicated server"""
     dsn_tns = cx_Oracle.makedsn(
-        os.environ['ORACLE_SERVER'],
-        int(os.environ['ORACLE_PORT']),
-        os.environ['ORACLE_SID'])
-    return dsn_tns
+        server or os.environ['ORACLE_SERVER'],
+        int(port or os.environ['ORACLE_PORT']),
+        sid or os.environ['ORACLE_SID'])
+    return pooled_dsn(dsn_tns) if pooled else dsn_tns
+
+
+def pooled_dsn(dsn_tns):
+    """DSN that asks for a pooled server of DRCP in the same database as 'dsn_tns'"""
+    return dsn_tns.replace('(CONNECT_DATA=', '(CONNECT_DATA=(SERVER=POOLED)', 1)
+
+
+class OracleSandbox:  # pylint: disable=too-many-instance-attributes
+    """Fresh Oracle user where a submission is judged. Used as a context manager, it provisions the user and its
+    connection when entering and tears everything down when leaving. Every step is executed inside a stage that
+    records its status code (used to report errors) and its duration (passed to the stage hooks of the executor).
+    Sandboxes of other databases extend this class, so the steps shared by all the executors (select_test, dml_test
+    and discriminant_test) are written only once"""
+
+    DRIVER_ERROR = cx_Oracle.DatabaseError  # Errors of the driver of the database
+
+    def __init__(self, executor, problem_type, limits=None):
+        """
+        :param executor: OracleExecutor that provides the connections and creates/drops users
+        :param problem_type: (ProblemType) type of the problem judged, passed to the stage hooks
+        :param limits: ExecutionLimits of the problem, the global limits if None
+        """
+        self.executor = executor
+        self.problem_type = problem_type
+        self.limits = limits or default_limits()
+        self.state = OracleStatusCode.GET_ADMIN_CONNECTION
+        self.gestor, self.user, self.conn = None, None, None
+        self.statement = None  # Last statement executed with execute(), to report errors
+        self.timings = {}  # {OracleStatusCode: seconds}
+
+    @contextmanager
+    def stage(self, state):
+        """
+        Executes a block of code as stage 'state', so that errors raised inside are reported with that status code
+        :param state: (OracleStatusCode) stage
+        """
+        self.state = state
+        init = time.time()
+        try:
+            yield
+        finally:
+            elapsed = time.time() - init
+            self.timings[state] = self.timings.get(state, 0) + elapsed
+            for hook in self.executor.stage_hooks:
+                hook(state, self.problem_type, elapsed)
+
+    def __enter__(self):
+        try:
+            self.provision()
+        except BaseException:
+            # __exit__ is not invoked when __enter__ fails: the admin connection and the user must be released here
+            self.cleanup()
+            raise
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is None:
+                self.teardown()
+        finally:
+            self.cleanup()
+        return False
+
+    def provision(self):
+        """Creates a new user and connects to Oracle with it"""
+        with self.stage(OracleStatusCode.GET_ADMIN_CONNECTION):
+            self.gestor = self.executor.connection_pool.acquire()
+        with self.stage(OracleStatusCode.CREATE_USER):
+            self.user, passwd = self.executor.create_user(self.gestor)
+        with self.stage(OracleStatusCode.GET_USER_CONNECTION):
+            self.conn = self.connect(passwd)
+
+    def connect(self, passwd):
+        """
+        :param passwd: (str) password of the new user
+        :return: connection of the new user, with the statement timeout of the limits
+        """
+        conn = self.executor.create_connection(self.user, passwd)
+        conn.callTimeout = self.limits.stmt_timeout_ms
+        return conn
+
+    def execute(self, statements):
+        """
+        Executes a list of statements and commits, keeping in 'statement' the statement being executed
+        :param statements: [str] statements as returned by clean_sql
+        :return: None. It raises DRIVER_ERROR if the execution of any of the statements is not correct
+        """
+        with self.conn.cursor() as cursor:
+            for statement in statements:
+                self.statement = statement
+                logger.debug('Executing SQL statement <<%s>>', statement)
+                cursor.execute(statement)
+        self.conn.commit()
+
+    def select(self, statement):
+        """
+        :param statement: (str) code that must contain exactly one SELECT statement
+        :return: dictionary with the result of the SELECT statement (see table_from_cursor)
+        """
+        return execute_select_statement(self.conn, statement, self.limits)
+
+    def insert(self, insertion):
+        """
+        Inserts the data of the problem, sending consecutive INSERT statements in blocks (see execute_insert_script)
+        :param insertion: (str) Statements to insert data into tables
+        """
+        execute_insert_script(self.conn, insertion)
+
+    def load(self, creation, insertion):
+        """
+        Creates the tables and inserts the data of the problem
+        :param creation: (str) Statements to create the tables and other structures
+        :param insertion: (str) Statements to insert data into tables
+        """
+        with self.stage(OracleStatusCode.EXECUTE_CREATE):
+            self.execute(clean_sql(creation))
+        with self.stage(OracleStatusCode.EXECUTE_INSERT):
+            self.insert(insertion)
+
+    def tables(self):
+        """
+        :return: dictionary {table_name: TABLE} with all the tables of the user (see get_all_tables)
+        """
+        return get_all_tables(self.conn, self.limits)
+
+    def snapshot(self):
+        """
+        :return: dictionary representing all the tables of the user
+        """
+        with self.stage(OracleStatusCode.GET_ALL_TABLES):
+            return self.tables()
+
+    def teardown(self):
+        """Closes the connection, drops the user and releases the admin connection, raising any error"""
+        with self.stage(OracleStatusCode.CLOSE_USER_CONNECTION):
+            self.executor.close_connection(self.conn)
+            self.conn = None
+        with self.stage(OracleStatusCode.DROP_USER):
+            self.executor.release_user(self.user, self.gestor)
+            self.user = None
+        with self.stage(OracleStatusCode.RELEASE_ADMIN_CONNECTION):
+            self.executor.connection_pool.release(self.gestor)
+            self.gestor = None
+
+    def cleanup(self):
+        """Releases everything that remains after an error. Users that cannot be dropped remain as dangling users"""
+        if self.conn:
+            self.executor.close_connection(self.conn)
+        if self.user:
+            try:
+                # Sometimes when TLE, the connections can be closed but the user cannot be dropped because
+                # "is currently connected". This looks like a bug or undocumented behavior of cx_Oracle
+                # These users will be removed later as dangling users (see judge.reaper)
+                self.executor.release_user(self.user, self.gestor)
+            except self.DRIVER_ERROR as drop_except:  # pragma: no cover
+                logger.error('Unable to drop user %s, it remains as a dangling user (%s)', self.user, drop_except)
+        if self.gestor:
+            self.executor.connection_pool.release(self.gestor)
+
+    def select_test(self, creation, insertion, select, output_db=False):
+        """
+        Loads the problem and executes the SELECT statement of the user (see Executor.execute_select_test)
+        :return: {"result": result, "db": db}, the result of the SELECT statement and all the tables if output_db
+        """
+        db = None
+        with self:
+            self.load(creation, insertion)
+            with self.stage(OracleStatusCode.EXECUTE_USER_CODE):
+                result = self.select(select)
+            record_current_rows(len(result['rows']))
+            if output_db:
+                db = self.snapshot()
+        return {"result": result, "db": db}
+
+    def dml_test(self, creation, insertion, dml, pre_db=True, min_stmt=0, max_stmt=float("inf")):
+        # pylint: disable=too-many-arguments
+        """
+        Loads the problem and executes the DML statements of the user (see Executor.execute_dml_test)
+        :return: {'pre': DB, 'post': DB}, all the tables before and after executing the DML statements
+        """
+        pre = {}
+        with self:
+            self.load(creation, insertion)
+            if pre_db:
+                pre = self.snapshot()
+            with self.stage(OracleStatusCode.EXECUTE_USER_CODE):
+                statements = clean_sql(dml, min_stmt, max_stmt)
+                if not statements:
+                    logger.debug('User %s - <<%s>> contains unexpected number of statements [%s - %s]',
+                                 self.user, dml, min_stmt, max_stmt)
+                    raise ExecutorException(OracleStatusCode.NUMBER_STATEMENTS)
+                self.execute(statements)
+            post = self.snapshot()
+        return {'pre': pre, 'post': post}
+
+    def discriminant_test(self, creation, insertion_base, insertion_user, select_correct, select_incorrect):
+        # pylint: disable=too-many-arguments
+        """
+        Loads the problem with the data of the user and executes both SELECT statements (see
+        Executor.execute_discriminant_test)
+        :return: {'result_correct': result, 'result_incorrect': result}, the results of both SELECT statements
+        """
+        with self:
+            self.load(creation, insertion_base)
+            with self.stage(OracleStatusCode.EXECUTE_USER_CODE):
+                self.execute(clean_sql(insertion_user))
+            with self.stage(OracleStatusCode.EXECUTE_DISCRIMINANT_SELECT):
+                result_correct = self.select(select_correct)
+                result_incorrect = self.select(select_incorrect)
+        return {"result_correct": result_correct, "result_incorrect": result_incorrect}
 
 
-class OracleExecutor:
+class OracleExecutor(Executor):  # pylint: disable=too-many-public-methods
     """Class to connect to Oracle DB and execute problems"""
 
     __USER_PREFIX = 'lsql_'
@@ -322,28 +661,42 @@ class OracleExecutor:
                               FROM all_users
                               WHERE USERNAME LIKE 'LSQ_%' AND (SYSDATE-CREATED)*24*60*60 > :age_seconds"""
     __KILL_SESSION = """ALTER SYSTEM KILL SESSION '{},{}'"""
+    __GRANT_PROXY_SCRIPT = 'ALTER USER {} GRANT CONNECT THROUGH {}'
+    __CONSUMER_GROUP_SCRIPT = """BEGIN
+                                   DBMS_RESOURCE_MANAGER_PRIVS.GRANT_SWITCH_CONSUMER_GROUP(:username, :grp, FALSE);
+                                   DBMS_RESOURCE_MANAGER.SET_INITIAL_CONSUMER_GROUP(:username, :grp);
+                                 END;"""
+    __DRCP_CONNECTION_CLASS = 'LSQL'
+    # How connections of the sandbox users are obtained (environment variable ORACLE_SANDBOX_CONNECTION):
+    #  - 'direct': a new dedicated connection authenticated with the password of the user (default)
+    #  - 'drcp': a new connection to a pooled server of Database Resident Connection Pooling
+    #  - 'proxy': a session from a pool of the admin user, proxied to the sandbox user
+    SANDBOX_DIRECT = 'direct'
+    SANDBOX_DRCP = 'drcp'
+    SANDBOX_PROXY = 'proxy'
     __SLEEP_AFTER_TIMEOUT = 100
     # milliseconds to sleep after a timeout when obtaining a
     # a timeout error, so that user connections can be properly
     # closed (otherwise, DROP USER throws an 'ORA-01940: cannot
     # drop a user that is currently connected')
 
-    __DB = None
-
     @classmethod
-    def get(cls):
-        """Singleton DB"""
-        if cls.__DB is None:
-            cls.__DB = OracleExecutor()
-        return cls.__DB
-
-    def __init__(self):
+    def create(cls):
+        """Same as Executor.create. If ORACLE_REAPER_INTERVAL_S is defined, it also starts a background thread that
+        removes dangling users periodically"""
+        executor = super().create()
+        if os.environ.get('ORACLE_REAPER_INTERVAL_S'):
+            DanglingUserReaper(executor, interval=int(os.environ['ORACLE_REAPER_INTERVAL_S'])).start()
+        return executor
+
+    def __init__(self, server=None, port=None, sid=None):
         """
         Creates a pool of connections with the admin user, taking the details from
         the configuration file. Throws a cx_Oracle.DatabaseError if it is not
         possible to create the pool
+        :param server: Oracle server, ORACLE_SERVER if None (the same for port and SID)
         """
-        self.dsn_tns = build_dsn_tns()
+        self.dsn_tns = build_dsn_tns(False, server, port, sid)
         self.connection_pool = cx_Oracle.SessionPool(
             os.environ['ORACLE_USER'],
             os.environ['ORACLE_PASS'],
@@ -361,6 +714,69 @@ class OracleExecutor:
                      int(os.environ['ORACLE_MAX_GESTOR_CONNECTIONS']),
                      int(os.environ['ORACLE_GESTOR_POOL_TIMEOUT_MS'])
                      )
+        self.user_pool = None
+        self.sandbox_mode = os.environ.get('ORACLE_SANDBOX_CONNECTION', self.SANDBOX_DIRECT).lower()
+        if self.sandbox_mode == self.SANDBOX_PROXY:
+            self.user_pool = self.create_proxy_pool()
+        elif self.sandbox_mode not in (self.SANDBOX_DIRECT, self.SANDBOX_DRCP):
+            logger.error('Unknown ORACLE_SANDBOX_CONNECTION "%s", using direct connections', self.sandbox_mode)
+            self.sandbox_mode = self.SANDBOX_DIRECT
+        logger.debug('Connections of sandbox users in mode %s', self.sandbox_mode)
+        self.teardown = None
+        if os.environ.get('ORACLE_ASYNC_DROP_QUEUE'):
+            self.teardown = DeferredTeardown(self, maxsize=int(os.environ['ORACLE_ASYNC_DROP_QUEUE']))
+            self.teardown.start()
+        super().__init__()
+
+    def close(self):
+        """
+        Stops the thread that drops users in the background (after dropping the enqueued users) and closes the pools
+        of connections. The executor cannot be used afterwards
+        :return: None
+        """
+        if self.teardown is not None:
+            self.teardown.stop()
+            self.teardown = None
+        if self.user_pool is not None:
+            self.user_pool.close()
+        self.connection_pool.close()
+
+    def create_proxy_pool(self):
+        """
+        Creates a heterogeneous pool of the admin user used to open proxy sessions for the sandbox users.
+        If it is not possible to create the pool, falls back to direct connections
+        :return: cx_Oracle.SessionPool or None
+        """
+        try:
+            return cx_Oracle.SessionPool(
+                os.environ['ORACLE_USER'],
+                os.environ['ORACLE_PASS'],
+                self.dsn_tns,
+                homogeneous=False,
+                threaded=True,
+                encoding='UTF-8', nencoding='UTF-8',
+                min=0,
+                max=int(os.environ['ORACLE_MAX_GESTOR_CONNECTIONS']),
+                getmode=cx_Oracle.SPOOL_ATTRVAL_TIMEDWAIT,
+                waitTimeout=int(os.environ['ORACLE_GESTOR_POOL_TIMEOUT_MS'])
+            )
+        except cx_Oracle.DatabaseError as excp:  # pragma: no cover
+            logger.error('Unable to create the pool for proxy sessions, using direct connections. Reason: %s', excp)
+            self.sandbox_mode = self.SANDBOX_DIRECT
+            return None
+
+    def ping(self):
+        """
+        Checks that the server answers using a dedicated connection of the admin user, so that a timeout waiting for
+        a connection of a busy admin pool is not taken as a failure of the server. Raises a cx_Oracle.DatabaseError
+        if the server does not answer
+        :return: None
+        """
+        with cx_Oracle.connect(os.environ['ORACLE_USER'], os.environ['ORACLE_PASS'], self.dsn_tns,
+                               encoding='UTF-8', nencoding='UTF-8') as connection:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1 FROM dual')
+                cursor.fetchone()
 
     def get_version(self):
         """Returns the version of the Oracle server"""
@@ -374,7 +790,8 @@ class OracleExecutor:
         """
         Creates a new user in the local Oracle DB with a random name and password. The user
         has acces to the TABLESPACE defined in the configuration file, and its username
-        starts with a given prefix defined in the configuration file
+        starts with a given prefix defined in the configuration file. If ORACLE_CONSUMER_GROUP is defined, the user
+        is assigned to that resource consumer group
         :param connection: Connection with privileges for creating users
         :return: A pair (username, password) of the created user
         """
@@ -392,34 +809,101 @@ class OracleExecutor:
             cursor.execute(create_script)
             logger.debug('User %s - Created user %s', connection.username, user_name)
             cursor.execute(grant_script)
+            if self.user_pool is not None:
+                cursor.execute(self.__GRANT_PROXY_SCRIPT.format(user_name, os.environ['ORACLE_USER']))
+            if os.environ.get('ORACLE_CONSUMER_GROUP'):
+                # Limits the resources of the user (see judge.resource_plan)
+                cursor.execute(self.__CONSUMER_GROUP_SCRIPT, username=user_name.upper(),
+                               grp=os.environ['ORACLE_CONSUMER_GROUP'].upper())
         logger.debug('User %s - Granted privileges to user %s', connection.username, user_name)
         return user_name, user_passwd
 
-    def remove_dangling_users(self, age_seconds=60):
+    def remove_dangling_users(self, age_seconds=60, workers=1, exclude=()):
         """
-        Removes all the LSQL_* users created more than 'age_seconds' ago
+        Removes all the LSQL_* users created more than 'age_seconds' ago. Users are dropped in parallel using
+        'workers' threads, each one with its own connection from the pool. The number of workers is limited to half
+        of the pool so that submissions can still obtain connections
         :param age_seconds: (int) number of seconds
-        :return: None
+        :param workers: (int) number of users dropped at the same time
+        :param exclude: names of users that must not be dropped in this invocation
+        :return: pair of lists (dropped, failed) with the names of the users
         """
         gestor = None
+        users = []
         try:
             gestor = self.connection_pool.acquire()
             with gestor.cursor() as cursor:
                 cursor.execute(self.__DANGLING_USERS, age_seconds=age_seconds)
-                users = cursor.fetchall()
-                for user in users:
-                    logger.info('Removing dangling user %s created at %s', user[0], user[1])
-                    cursor.execute(self.__USER_CONNECTIONS, username=user[0])
-                    connections = cursor.fetchall()
+                users = [user for user in cursor.fetchall() if user[0] not in exclude]
+        except cx_Oracle.DatabaseError as excp:  # pragma: no cover
+            logger.error('Unable to remove dangling users. Reason: %s', excp)
+        finally:
+            if gestor is not None:
+                self.connection_pool.release(gestor)
+
+        for user in users:
+            logger.info('Removing dangling user %s created at %s', user[0], user[1])
+        names = [user[0] for user in users]
+        workers = max(1, min(workers, self.connection_pool.max // 2))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(self.remove_dangling_user, names))
+        dropped = [name for name, ok in zip(names, results) if ok]
+        failed = [name for name, ok in zip(names, results) if not ok]
+        return dropped, failed
+
+    def remove_dangling_user(self, user_name, retries=3, backoff=0.5):
+        """
+        Kills all the sessions of a user and drops it, retrying with exponential backoff if the user cannot be
+        dropped (usually 'ORA-01940: cannot drop a user that is currently connected')
+        :param user_name: Name of the user to remove
+        :param retries: (int) number of attempts
+        :param backoff: (float) seconds to wait after the first failed attempt, doubled after every attempt. The
+                        connection is released before waiting and a new one is acquired for the next attempt
+        :return: (bool) whether the user has been dropped
+        """
+        for attempt in range(retries):
+            if attempt > 0:
+                # Waits without holding a connection, so that the pool is available for submissions meanwhile
+                time.sleep(backoff * 2 ** (attempt - 1))
+            gestor = None
+            try:
+                gestor = self.connection_pool.acquire()
+                with gestor.cursor() as cursor:
+                    cursor.execute(self.__USER_CONNECTIONS, username=user_name)
                     # Kills all the possible connections of username
-                    for connection in connections:  # pragma: no cover
+                    for connection in cursor.fetchall():  # pragma: no cover
                         cursor.execute(self.__KILL_SESSION.format(connection[0], connection[1]))
-                    self.drop_user(user[0], gestor)
+                self.drop_user(user_name, gestor)
+                return True
+            except cx_Oracle.DatabaseError as excp:  # pragma: no cover
+                if 'ORA-01918' in str(excp):
+                    # User does not exist, it has been removed by someone else
+                    return True
+                logger.info('Attempt %s to drop user %s failed: %s', attempt + 1, user_name, excp)
+            finally:
+                if gestor is not None:
+                    self.connection_pool.release(gestor)
+        return False  # pragma: no cover
+
+    def get_dangling_users(self, age_seconds=60):
+        """
+        Returns the names of the dangling users, i.e., users created more than 'age_seconds' ago
+        :param age_seconds: (int) number of seconds
+        :return: list of str, None if error
+        """
+        gestor = None
+        users = None
+        try:
+            gestor = self.connection_pool.acquire()
+            with gestor.cursor() as cursor:
+                cursor.execute(self.__DANGLING_USERS, age_seconds=age_seconds)
+                users = [user[0] for user in cursor.fetchall()]
         except cx_Oracle.DatabaseError as excp:  # pragma: no cover
-            logger.error('Unable to remove dangling users. Reason: %s', excp)
+            logger.error('Unable to get dangling users. Reason: %s', excp)
         finally:
             if gestor is not None:
                 self.connection_pool.release(gestor)
+        return users
 
     def get_number_dangling_users(self, age_seconds=60):
         """
@@ -453,21 +937,62 @@ class OracleExecutor:
             cursor.execute(self.__USER_CONNECTIONS, username=user_name)
             active_connections = cursor.fetchall()
             logger.debug('User %s has %s active connections', user_name, len(active_connections))
+            if self.sandbox_mode == self.SANDBOX_DRCP:
+                # Closed DRCP connections can keep their session cached in the pooled server
+                for session in active_connections:  # pragma: no cover
+                    cursor.execute(self.__KILL_SESSION.format(session[0], session[1]))
             drop_script = self.__DROP_USER_SCRIPT.format(user_name)
             cursor.execute(drop_script)
         logger.debug('User %s - Dropped user %s', connection.username, user_name)
 
+    def release_user(self, user_name, connection):
+        """
+        Removes a user after judging a submission. If ORACLE_ASYNC_DROP_QUEUE is defined the user is dropped in the
+        background, unless the queue is full
+        :param user_name: Name of the user to remove
+        :param connection: Connection with priviledges to drop users, used if the user is dropped synchronously
+        :return: None
+        """
+        if self.teardown is None or not self.teardown.submit(user_name):
+            self.drop_user(user_name, connection)
+
     def create_connection(self, user, passwd):
         """
-        Creates an Oracle connection to localhost/xe using UTF-8
+        Creates an Oracle connection to localhost/xe using UTF-8. Depending on ORACLE_SANDBOX_CONNECTION it is a
+        dedicated connection, a DRCP connection or a proxy session taken from the pool of the admin user
         :param user: Name of the Oracle user
         :param passwd: Password of the Oracle user
         :return: Oracle connection
         """
+        if self.user_pool is not None:
+            return self.user_pool.acquire(user=user)
+        if self.sandbox_mode == self.SANDBOX_DRCP:
+            return cx_Oracle.connect(user, passwd, pooled_dsn(self.dsn_tns), encoding='UTF-8', nencoding='UTF-8',
+                                     cclass=self.__DRCP_CONNECTION_CLASS, purity=cx_Oracle.ATTR_PURITY_NEW)
         connection = cx_Oracle.connect(user, passwd, self.dsn_tns, encoding='UTF-8', nencoding='UTF-8')
         return connection
 
-    def execute_select_test(self, creation, insertion, select, output_db=False):
+    def close_connection(self, connection):
+        """
+        Closes a connection obtained with create_connection. Proxy sessions are removed from the pool
+        because their user is going to be dropped
+        :param connection: Oracle connection
+        :return: None
+        """
+        if self.user_pool is not None:
+            self.user_pool.drop(connection)
+        else:
+            connection.close()
+
+    def sandbox(self, problem_type, limits=None):
+        """
+        :param problem_type: (ProblemType) type of the problem to judge
+        :param limits: ExecutionLimits of the problem, the global limits if None
+        :return: new OracleSandbox to be used in a 'with' statement
+        """
+        return OracleSandbox(self, problem_type, limits)
+
+    def execute_select_test(self, creation, insertion, select, output_db=False, limits=None):
         """
         Using a new fresh user, creates a set of tables ('creation) and inserts some data.
         Then, executes a correct SELECT statement and also a SELECT statement to test
@@ -475,69 +1000,25 @@ class OracleExecutor:
         :param creation: (str) Statements to create the tables and other structures
         :param insertion: (str) Statements to insert data into tables
         :param select: (str) One SELECT statement to execute
+        :param limits: ExecutionLimits of the problem, the global limits if None
         :return: {"result": result, "db": db}. result is a dictionary representing the statement result, and db is a
                  dictionary representing all the tables. In case of error, throws a ExecutorException
         """
-        conn, gestor, result, user, db = None, None, None, None, None
-        state = OracleStatusCode.GET_ADMIN_CONNECTION
+        sandbox = self.sandbox(ProblemType.SELECT, limits)
         try:
-            gestor = self.connection_pool.acquire()
-
-            state = OracleStatusCode.CREATE_USER
-            user, passwd = self.create_user(gestor)
-
-            state = OracleStatusCode.GET_USER_CONNECTION
-            conn = self.create_connection(user, passwd)
-
-            conn.callTimeout = int(os.environ['ORACLE_STMT_TIMEOUT_MS'])
-            state = OracleStatusCode.EXECUTE_CREATE
-            execute_sql_script(conn, creation)
-
-            state = OracleStatusCode.EXECUTE_INSERT
-            execute_sql_script(conn, insertion)
-
-            state = OracleStatusCode.EXECUTE_USER_CODE
-            result = execute_select_statement(conn, select)
-
-            state = OracleStatusCode.GET_ALL_TABLES
-            if output_db:
-                db = get_all_tables(conn)
-
-            state = OracleStatusCode.CLOSE_USER_CONNECTION
-            conn.close()
-            conn = None
-
-            state = OracleStatusCode.DROP_USER
-            self.drop_user(user, gestor)
-            user = None
-
-            state = OracleStatusCode.RELEASE_ADMIN_CONNECTION
-            self.connection_pool.release(gestor)
-            gestor = None
-            return {"result": result, "db": db}
+            return sandbox.select_test(creation, insertion, select, output_db)
         except cx_Oracle.DatabaseError as excp:
             error_msg = str(excp)
+            state = sandbox.state
             logger.info('Error when testing SELECT statements: %s - %s - %s', state, excp, select)
             if ('ORA-3156' in error_msg or 'ORA-24300' in error_msg) and state == OracleStatusCode.EXECUTE_USER_CODE:
                 # Time limit exceeded
                 raise ExecutorException(OracleStatusCode.TLE_USER_CODE, error_msg, select) from excp
             pos = line_col_from_offset(select, offset_from_oracle_exception(excp))
             raise ExecutorException(state, error_msg, select, pos) from excp
-        finally:
-            if conn:
-                conn.close()
-            if user:
-                try:
-                    # Sometimes when TLE, the connections can be closed but the user cannot be dropped because
-                    # "is currently connected". This looks like a bug or undocumented behavior of cx_Oracle
-                    # These users must be removed manually later
-                    self.drop_user(user, gestor)
-                except cx_Oracle.DatabaseError as drop_except:  # pragma: no cover
-                    logger.error('Unable to drop user %s, REMOVE IT MANUALLY (%s)', user, drop_except)
-            if gestor:
-                self.connection_pool.release(gestor)
 
-    def execute_dml_test(self, creation, insertion, dml, pre_db=True, min_stmt=0, max_stmt=float("inf")):
+    def execute_dml_test(self, creation, insertion, dml, pre_db=True, min_stmt=0, max_stmt=float("inf"),
+                         limits=None):
         """
         Using a new fresh user, creates a set of tables ('creation) and inserts some data.
         Then, executes some DML statements
@@ -547,84 +1028,22 @@ class OracleExecutor:
         :param creation: (str) Statements to create the tables and other structures
         :param insertion: (str) Statements to insert data into tables
         :param dml: (str) DML statements to execute (insert, delete, update)
+        :param limits: ExecutionLimits of the problem, the global limits if None
         :return: {'pre': DB, 'post': DB} dictionary containing the state of the DB before and after executing dml
         """
-        conn, gestor, user, post, stmt = None, None, None, None, None
-        state = OracleStatusCode.GET_ADMIN_CONNECTION
+        sandbox = self.sandbox(ProblemType.DML, limits)
         try:
-            gestor = self.connection_pool.acquire()
-
-            state = OracleStatusCode.CREATE_USER
-            user, passwd = self.create_user(gestor)
-
-            state = OracleStatusCode.GET_USER_CONNECTION
-            conn = self.create_connection(user, passwd)
-
-            conn.callTimeout = int(os.environ['ORACLE_STMT_TIMEOUT_MS'])
-            state = OracleStatusCode.EXECUTE_CREATE
-            execute_sql_script(conn, creation)
-
-            state = OracleStatusCode.EXECUTE_INSERT
-            execute_sql_script(conn, insertion)
-
-            pre = dict()
-            if pre_db:
-                state = OracleStatusCode.GET_ALL_TABLES
-                pre = get_all_tables(conn)
-
-            state = OracleStatusCode.EXECUTE_USER_CODE
-            init = time.time()
-            statements = clean_sql(dml, min_stmt, max_stmt)
-            if not statements:
-                logger.debug('User %s - <<%s>> contains unexpected number of statements [%s - %s]',
-                             conn.username, statements, min_stmt, max_stmt)
-                raise ExecutorException(OracleStatusCode.NUMBER_STATEMENTS)
-            with conn.cursor() as cursor:
-                for stmt in statements:
-                    cursor.execute(stmt)
-                conn.commit()
-
-            logger.debug('User %s - SQL DML statements <<%s>> executed in %s seconds',
-                         conn.username, statements, time.time() - init)
-
-            state = OracleStatusCode.GET_ALL_TABLES
-            post = get_all_tables(conn)
-
-            state = OracleStatusCode.CLOSE_USER_CONNECTION
-            conn.close()
-            conn = None
-
-            state = OracleStatusCode.DROP_USER
-            self.drop_user(user, gestor)
-            user = None
-
-            state = OracleStatusCode.RELEASE_ADMIN_CONNECTION
-            self.connection_pool.release(gestor)
-            gestor = None
-
-            return {'pre': pre, 'post': post}
+            return sandbox.dml_test(creation, insertion, dml, pre_db, min_stmt, max_stmt)
         except cx_Oracle.DatabaseError as excp:
             error_msg = str(excp)
+            state, stmt = sandbox.state, sandbox.statement
             logger.info('Error when testing DML statements: %s - %s - %s', state, excp, stmt)
             if ('ORA-3156' in error_msg or 'ORA-24300' in error_msg) and state == OracleStatusCode.EXECUTE_USER_CODE:
                 # Time limit exceeded
                 raise ExecutorException(OracleStatusCode.TLE_USER_CODE, error_msg, stmt) from excp
             raise ExecutorException(state, error_msg, stmt) from excp
-        finally:
-            if conn:
-                conn.close()
-            if user:
-                try:
-                    # Sometimes when TLE, the connections can be closed but the user cannot be dropped because
-                    # "is currently connected". This looks like a bug or undocumented behavior of cx_Oracle
-                    # These users must be removed manually later
-                    self.drop_user(user, gestor)
-                except cx_Oracle.DatabaseError as drop_except:  # pragma: no cover
-                    logger.error('Unable to drop user %s, REMOVE IT MANUALLY (%s)', user, drop_except)
-            if gestor:
-                self.connection_pool.release(gestor)
 
-    def execute_function_test(self, creation, insertion, func_creation, tests):
+    def execute_function_test(self, creation, insertion, func_creation, tests, limits=None):
         """
         Using a new fresh user, creates a set of tables ('creation) and inserts some data.
         Then, executes some DML statements
@@ -632,94 +1051,48 @@ class OracleExecutor:
         :param func_creation:
         :param creation: (str) Statements to create the tables and other structures
         :param insertion: (str) Statements to insert data into tables
+        :param limits: ExecutionLimits of the problem, the global limits if None
 
         :return: {'pre': DB, 'results': dict} dictionary containing the initial state of the DB and a dictionary
                  {call: result} with the different calls and its expected result
         """
-        conn, gestor, user, stmt = None, None, None, None
-        state = OracleStatusCode.GET_ADMIN_CONNECTION
+        sandbox, stmt = self.sandbox(ProblemType.FUNCTION, limits), None
         try:
-            gestor = self.connection_pool.acquire()
-
-            state = OracleStatusCode.CREATE_USER
-            user, passwd = self.create_user(gestor)
-
-            state = OracleStatusCode.GET_USER_CONNECTION
-            conn = self.create_connection(user, passwd)
-
-            conn.callTimeout = int(os.environ['ORACLE_STMT_TIMEOUT_MS'])
-            state = OracleStatusCode.EXECUTE_CREATE
-            execute_sql_script(conn, creation)
-
-            state = OracleStatusCode.EXECUTE_INSERT
-            execute_sql_script(conn, insertion)
-
-            state = OracleStatusCode.GET_ALL_TABLES
-            db = get_all_tables(conn)
-
-            state = OracleStatusCode.EXECUTE_USER_CODE
-            init = time.time()
-
-            # sqlparse does not consider the whole CREATE FUNCTION as a single statement, so we cannot check
-            # the minimum and maximum number of statements in this kind of problems :-(
-
-            with conn.cursor() as cursor:
-                stmt = func_creation
-                cursor.execute(stmt)
-
-                # Stops if there is some compilation error with the function
-                # We must handle it manually because executing a FUNCTION creation with failures does not throw
-                # any Oracle exception
-                errors = get_compilation_errors(conn)
-                if len(errors['rows']) > 0:
-                    raise ExecutorException(OracleStatusCode.COMPILATION_ERROR, message=errors, statement=stmt)
-
-                results = dict()
-                tests = [s.strip() for s in tests.split('\n') if len(s.strip()) > 0]
-                for stmt in tests:
-                    func_call = f'SELECT {stmt} FROM DUAL'
-                    cursor.execute(func_call)
-                    row = cursor.fetchone()
-                    results[stmt] = row[0]
-
-            logger.debug('User %s - Function creation and testing executed in %s seconds',
-                         conn.username, time.time() - init)
-
-            state = OracleStatusCode.CLOSE_USER_CONNECTION
-            conn.close()
-            conn = None
-
-            state = OracleStatusCode.DROP_USER
-            self.drop_user(user, gestor)
-            user = None
-
-            state = OracleStatusCode.RELEASE_ADMIN_CONNECTION
-            self.connection_pool.release(gestor)
-            gestor = None
+            with sandbox:
+                sandbox.load(creation, insertion)
+                db = sandbox.snapshot()
+
+                # sqlparse does not consider the whole CREATE FUNCTION as a single statement, so we cannot check
+                # the minimum and maximum number of statements in this kind of problems :-(
+                with sandbox.stage(OracleStatusCode.EXECUTE_USER_CODE), sandbox.conn.cursor() as cursor:
+                    stmt = func_creation
+                    cursor.execute(stmt)
 
+                    # Stops if there is some compilation error with the function
+                    # We must handle it manually because executing a FUNCTION creation with failures does not throw
+                    # any Oracle exception
+                    errors = get_compilation_errors(sandbox.conn)
+                    if len(errors['rows']) > 0:
+                        raise ExecutorException(OracleStatusCode.COMPILATION_ERROR, message=errors, statement=stmt)
+
+                    results = dict()
+                    tests = [s.strip() for s in tests.split('\n') if len(s.strip()) > 0]
+                    for stmt in tests:
+                        func_call = f'SELECT {stmt} FROM DUAL'
+                        cursor.execute(func_call)
+                        row = cursor.fetchone()
+                        results[stmt] = row[0]
             return {'db': db, 'results': results}
         except cx_Oracle.DatabaseError as excp:
             error_msg = str(excp)
+            state = sandbox.state
             logger.info('Error when testing function statements: %s - %s - %s', state, excp, stmt)
             if ('ORA-3156' in error_msg or 'ORA-24300' in error_msg) and state == OracleStatusCode.EXECUTE_USER_CODE:
                 # Time limit exceeded
                 raise ExecutorException(OracleStatusCode.TLE_USER_CODE, excp, stmt) from excp
             raise ExecutorException(state, excp, stmt) from excp
-        finally:
-            if conn:
-                conn.close()
-            if user:
-                try:
-                    # Sometimes when TLE, the connections can be closed but the user cannot be dropped because
-                    # "is currently connected". This looks like a bug or undocumented behavior of cx_Oracle
-                    # These users must be removed manually later
-                    self.drop_user(user, gestor)
-                except cx_Oracle.DatabaseError as drop_except:  # pragma: no cover
-                    logger.error('Unable to drop user %s, REMOVE IT MANUALLY (%s)', user, drop_except)
-            if gestor:
-                self.connection_pool.release(gestor)
 
-    def execute_proc_test(self, creation, insertion, proc_creation, proc_call, pre_db=True):
+    def execute_proc_test(self, creation, insertion, proc_creation, proc_call, pre_db=True, limits=None):
         """
         Using a new fresh user, creates a set of tables ('creation) and inserts some data.
         Then, creates a PROCEDURE defined in proc_creation and invokes the call in proc_call
@@ -728,94 +1101,46 @@ class OracleExecutor:
         :param proc_creation:
         :param creation: (str) Statements to create the tables and other structures
         :param insertion: (str) Statements to insert data into tables
+        :param limits: ExecutionLimits of the problem, the global limits if None
 
         :return: {'pre': DB, 'post': DB} dictionary containing the state of the DB before defining the procedure and
                    and after invoking the procedure
         """
-        conn, gestor, user, post, stmt = None, None, None, None, None
-        state = OracleStatusCode.GET_ADMIN_CONNECTION
+        sandbox, db, stmt = self.sandbox(ProblemType.PROC, limits), None, None
         try:
-            gestor = self.connection_pool.acquire()
-
-            state = OracleStatusCode.CREATE_USER
-            user, passwd = self.create_user(gestor)
-
-            state = OracleStatusCode.GET_USER_CONNECTION
-            conn = self.create_connection(user, passwd)
-
-            conn.callTimeout = int(os.environ['ORACLE_STMT_TIMEOUT_MS'])
-            state = OracleStatusCode.EXECUTE_CREATE
-            execute_sql_script(conn, creation)
-
-            state = OracleStatusCode.EXECUTE_INSERT
-            execute_sql_script(conn, insertion)
-
-            db = None
-            if pre_db:
-                state = OracleStatusCode.GET_ALL_TABLES
-                db = get_all_tables(conn)
-
-            state = OracleStatusCode.EXECUTE_USER_CODE
-            init = time.time()
-
-            # sqlparse does not consider the whole CREATE PROCEDURE as a single statement, so we cannot check
-            # the minimum and maximum number of statements in this kind of problems :-(
-
-            with conn.cursor() as cursor:
-                stmt = proc_creation
-                cursor.execute(stmt)
-
-                # Stops if there is some compilation error in the procedure
-                # We must handle it manually because executing a PROCEDURE creation with failures does not throw
-                # any Oracle exception
-                errors = get_compilation_errors(conn)
-                if len(errors['rows']) > 0:
-                    raise ExecutorException(OracleStatusCode.COMPILATION_ERROR, message=errors, statement=stmt)
-
-                stmt = f"BEGIN {proc_call.strip()}; END;"
-                cursor.execute(stmt)
-
-            state = OracleStatusCode.GET_ALL_TABLES
-            post = get_all_tables(conn)
-
-            logger.debug('User %s - Procedure creation and testing executed in %s seconds',
-                         conn.username, time.time() - init)
-
-            state = OracleStatusCode.CLOSE_USER_CONNECTION
-            conn.close()
-            conn = None
+            with sandbox:
+                sandbox.load(creation, insertion)
+                if pre_db:
+                    db = sandbox.snapshot()
+
+                # sqlparse does not consider the whole CREATE PROCEDURE as a single statement, so we cannot check
+                # the minimum and maximum number of statements in this kind of problems :-(
+                with sandbox.stage(OracleStatusCode.EXECUTE_USER_CODE), sandbox.conn.cursor() as cursor:
+                    stmt = proc_creation
+                    cursor.execute(stmt)
 
-            state = OracleStatusCode.DROP_USER
-            self.drop_user(user, gestor)
-            user = None
+                    # Stops if there is some compilation error in the procedure
+                    # We must handle it manually because executing a PROCEDURE creation with failures does not throw
+                    # any Oracle exception
+                    errors = get_compilation_errors(sandbox.conn)
+                    if len(errors['rows']) > 0:
+                        raise ExecutorException(OracleStatusCode.COMPILATION_ERROR, message=errors, statement=stmt)
 
-            state = OracleStatusCode.RELEASE_ADMIN_CONNECTION
-            self.connection_pool.release(gestor)
-            gestor = None
+                    stmt = f"BEGIN {proc_call.strip()}; END;"
+                    cursor.execute(stmt)
 
+                post = sandbox.snapshot()
             return {'pre': db, 'post': post}
         except cx_Oracle.DatabaseError as excp:
             error_msg = str(excp)
+            state = sandbox.state
             logger.info('Error when testing procedure creation and call: %s - %s - %s', state, excp, stmt)
             if ('ORA-3156' in error_msg or 'ORA-24300' in error_msg) and state == OracleStatusCode.EXECUTE_USER_CODE:
                 # Time limit exceeded
                 raise ExecutorException(OracleStatusCode.TLE_USER_CODE, error_msg, stmt) from excp
             raise ExecutorException(state, error_msg, stmt) from excp
-        finally:
-            if conn:
-                conn.close()
-            if user:
-                try:
-                    # Sometimes when TLE, the connections can be closed but the user cannot be dropped because
-                    # "is currently connected". This looks like a bug or undocumented behavior of cx_Oracle
-                    # These users must be removed manually later
-                    self.drop_user(user, gestor)
-                except cx_Oracle.DatabaseError as drop_except:  # pragma: no cover
-                    logger.error('Unable to drop user %s, REMOVE IT MANUALLY (%s)', user, drop_except)
-            if gestor:
-                self.connection_pool.release(gestor)
 
-    def execute_trigger_test(self, creation, insertion, trigger_definition, tests, pre_db=True):
+    def execute_trigger_test(self, creation, insertion, trigger_definition, tests, pre_db=True, limits=None):
         """
         Using a new fresh user, creates a set of tables ('creation) and inserts some data.
         Then, creates a PROCEDURE defined in proc_creation and invokes the call in proc_call
@@ -824,92 +1149,49 @@ class OracleExecutor:
         :param trigger_definition:
         :param creation: (str) Statements to create the tables and other structures
         :param insertion: (str) Statements to insert data into tables
+        :param limits: ExecutionLimits of the problem, the global limits if None
 
         :return: {'pre': DB, 'post': DB} dictionary containing the state of the DB before defining the trigger and
                    and after executing the tests
         """
-        conn, gestor, user, post, stmt = None, None, None, None, None
-        state = OracleStatusCode.GET_ADMIN_CONNECTION
+        sandbox, db, stmt = self.sandbox(ProblemType.TRIGGER, limits), None, None
         try:
-            gestor = self.connection_pool.acquire()
-
-            state = OracleStatusCode.CREATE_USER
-            user, passwd = self.create_user(gestor)
-
-            state = OracleStatusCode.GET_USER_CONNECTION
-            conn = self.create_connection(user, passwd)
-
-            conn.callTimeout = int(os.environ['ORACLE_STMT_TIMEOUT_MS'])
-            state = OracleStatusCode.EXECUTE_CREATE
-            execute_sql_script(conn, creation)
-
-            state = OracleStatusCode.EXECUTE_INSERT
-            execute_sql_script(conn, insertion)
-
-            db = None
-            if pre_db:
-                state = OracleStatusCode.GET_ALL_TABLES
-                db = get_all_tables(conn)
-
-            state = OracleStatusCode.EXECUTE_USER_CODE
-            init = time.time()
-
-            # sqlparse does not consider the whole CREATE TRIGGER as a single statement, so we cannot check
-            # the minimum and maximum number of statements in this kind of problems :-(
-
-            with conn.cursor() as cursor:
-                stmt = trigger_definition
-                cursor.execute(stmt)
-            # cx_Oracle does not seem to compile trigger at this point. Syntax error in the trigger will be detected
-            # when firing the trigger
-
-            execute_dml_statements(conn, tests)
-
-            state = OracleStatusCode.GET_ALL_TABLES
-            post = get_all_tables(conn)
-
-            logger.debug('User %s - Procedure creation and testing executed in %s seconds',
-                         conn.username, time.time() - init)
-
-            state = OracleStatusCode.CLOSE_USER_CONNECTION
-            conn.close()
-            conn = None
-
-            state = OracleStatusCode.DROP_USER
-            self.drop_user(user, gestor)
-            user = None
-
-            state = OracleStatusCode.RELEASE_ADMIN_CONNECTION
-            self.connection_pool.release(gestor)
-            gestor = None
-
+            with sandbox:
+                sandbox.load(creation, insertion)
+                if pre_db:
+                    db = sandbox.snapshot()
+
+                # sqlparse does not consider the whole CREATE TRIGGER as a single statement, so we cannot check
+                # the minimum and maximum number of statements in this kind of problems :-(
+                with sandbox.stage(OracleStatusCode.EXECUTE_USER_CODE):
+                    with sandbox.conn.cursor() as cursor:
+                        stmt = trigger_definition
+                        cursor.execute(stmt)
+                    # cx_Oracle does not seem to compile trigger at this point. Syntax error in the trigger will be
+                    # detected when firing the trigger
+                    try:
+                        execute_dml_statements(sandbox.conn, tests)
+                    except cx_Oracle.DatabaseError as excp:
+                        if 'ORA-04098' in str(excp):
+                            # trigger is invalid and failed re-validation => compilation error
+                            errors = get_compilation_errors(sandbox.conn)
+                            raise ExecutorException(OracleStatusCode.COMPILATION_ERROR, message=errors,
+                                                    statement=stmt) from excp
+                        raise
+
+                post = sandbox.snapshot()
             return {'pre': db, 'post': post}
         except cx_Oracle.DatabaseError as excp:
             error_msg = str(excp)
+            state = sandbox.state
             logger.info('Error when testing trigger creation and call: %s - %s - %s', state, excp, stmt)
             if ('ORA-3156' in error_msg or 'ORA-24300' in error_msg) and state == OracleStatusCode.EXECUTE_USER_CODE:
                 # Time limit exceeded
                 raise ExecutorException(OracleStatusCode.TLE_USER_CODE, error_msg, stmt) from excp
-            if 'ORA-04098' in error_msg:
-                # trigger is invalid and failed re-validation => compilation error
-                errors = get_compilation_errors(conn)
-                raise ExecutorException(OracleStatusCode.COMPILATION_ERROR, message=errors, statement=stmt) from excp
             raise ExecutorException(state, error_msg, stmt) from excp
-        finally:
-            if conn:
-                conn.close()
-            if user:
-                try:
-                    # Sometimes when TLE, the connections can be closed but the user cannot be dropped because
-                    # "is currently connected". This looks like a bug or undocumented behavior of cx_Oracle
-                    # These users must be removed manually later
-                    self.drop_user(user, gestor)
-                except cx_Oracle.DatabaseError as drop_except:  # pragma: no cover
-                    logger.error('Unable to drop user %s, REMOVE IT MANUALLY (%s)', user, drop_except)
-            if gestor:
-                self.connection_pool.release(gestor)
 
-    def execute_discriminant_test(self, creation, insertion_base, insertion_user, select_correct, select_incorrect):
+    def execute_discriminant_test(self, creation, insertion_base, insertion_user, select_correct, select_incorrect,
+                                  limits=None):
         """
         Using a new fresh user, creates a set of tables (creation) and inserts some data: the base INSERT sentences
         and also the INSERT sentences from the user. Then, executes a correct and wrong SELECT statements, returning
@@ -919,51 +1201,18 @@ class OracleExecutor:
         :param insertion_user: (str) Statements to insert data into tables from the user submission
         :param select_correct: (str) One SELECT statement to execute that returns correct results
         :param select_incorrect: (str) One SELECT statement to execute that returns incorreect results
+        :param limits: ExecutionLimits of the problem, the global limits if None
         :return: {"result_correct": result, "result_wrong": result}. 'result' is a dictionary representing the
                  statement result of a query (in this case, select_correct and select_incorrect)
                  In case of error, throws a ExecutorException
         """
-        conn, gestor, result_correct, result_incorrect, user = None, None, None, None, None
-        state = OracleStatusCode.GET_ADMIN_CONNECTION
+        sandbox = self.sandbox(ProblemType.DISC, limits)
         try:
-            gestor = self.connection_pool.acquire()
-
-            state = OracleStatusCode.CREATE_USER
-            user, passwd = self.create_user(gestor)
-
-            state = OracleStatusCode.GET_USER_CONNECTION
-            conn = self.create_connection(user, passwd)
-
-            conn.callTimeout = int(os.environ['ORACLE_STMT_TIMEOUT_MS'])
-            state = OracleStatusCode.EXECUTE_CREATE
-            execute_sql_script(conn, creation)
-
-            state = OracleStatusCode.EXECUTE_INSERT
-            execute_sql_script(conn, insertion_base)
-
-            state = OracleStatusCode.EXECUTE_USER_CODE
-            execute_sql_script(conn, insertion_user)
-
-            state = OracleStatusCode.EXECUTE_DISCRIMINANT_SELECT
-            result_correct = execute_select_statement(conn, select_correct)
-
-            state = OracleStatusCode.EXECUTE_DISCRIMINANT_SELECT
-            result_incorrect = execute_select_statement(conn, select_incorrect)
-
-            state = OracleStatusCode.CLOSE_USER_CONNECTION
-            conn.close()
-            conn = None
-
-            state = OracleStatusCode.DROP_USER
-            self.drop_user(user, gestor)
-            user = None
-
-            state = OracleStatusCode.RELEASE_ADMIN_CONNECTION
-            self.connection_pool.release(gestor)
-            gestor = None
-            return {"result_correct": result_correct, "result_incorrect": result_incorrect}
+            return sandbox.discriminant_test(creation, insertion_base, insertion_user, select_correct,
+                                             select_incorrect)
         except cx_Oracle.DatabaseError as excp:
             error_msg = str(excp)
+            state = sandbox.state
             logger.info('Error when testing DISCRIMINANT problem: %s - %s - %s - %s - %s', state, excp, insertion_user,
                         select_correct, select_incorrect)
             if 'ORA-3156' in error_msg or 'ORA-24300' in error_msg:
@@ -973,16 +1222,3 @@ class OracleExecutor:
             # Errors can only happen in user code, i.e., insertion_user
             pos = line_col_from_offset(insertion_user, offset_from_oracle_exception(excp))
             raise ExecutorException(state, error_msg, insertion_user, pos) from excp
-        finally:
-            if conn:
-                conn.close()
-            if user:
-                try:
-                    # Sometimes when TLE, the connections can be closed but the user cannot be dropped because
-                    # "is currently connected". This looks like a bug or undocumented behavior of cx_Oracle
-                    # These users must be removed manually later
-                    self.drop_user(user, gestor)
-                except cx_Oracle.DatabaseError as drop_except:  # pragma: no cover
-                    logger.error('Unable to drop user %s, REMOVE IT MANUALLY (%s)', user, drop_except)
-            if gestor:
-                self.connection_pool.release(gestor)
@@ -4,6 +4,7 @@ Copyright Enrique Martín <emartinm@ucm.es> 2020
 
 Parse problem and set of collections from a ZIP file
 """
+from contextlib import contextmanager
 from zipfile import ZipFile
 import json
 
@@ -24,26 +25,72 @@ __DISCRIMINANT_PROBLEM_FILES = {'create.sql', 'insert.sql', 'problem.json', 'tex
                                 'incorrect_query.sql', 'correct_query.sql'}
 
 
-def extract_json(file, problem_type):
+class ProblemZip:
+    """ZIP file of a problem opened only once. The JSON file is parsed when opening and the rest of files are read
+    only when needed"""
+
+    def __init__(self, zfile, problem_json):
+        """
+        :param zfile: opened ZipFile
+        :param problem_json: dict with the JSON file inside the ZIP
+        """
+        self.zfile = zfile
+        self.json = problem_json
+        self.names = set(zfile.namelist())
+
+    def read(self, name):
+        """:return: (str) content of the file 'name' in UTF-8"""
+        return self.zfile.read(name).decode(encoding='utf-8')
+
+    def close(self):
+        """Closes the ZIP file"""
+        self.zfile.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+
+def open_problem_zip(file):
     """
-    :param problem_type: Problem type that should appear in the JSON file
-    :param file: ZIP file
-    :return: dict with the JSON file inside the ZIP
+    Opens a problem ZIP and reads its JSON file
+    :param file: ZIP file (path or file-like object)
+    :return: ProblemZip or raises ZipFileParsingException if the JSON file is missing or has no "type"
     """
-    with ZipFile(file) as zfile:
+    # The ZipFile is closed by the returned ProblemZip (a context manager), or here if the JSON file is not correct
+    zfile = ZipFile(file)  # pylint: disable=consider-using-with
+    try:
         if __JSON_NAME not in zfile.namelist():
             raise ZipFileParsingException('Falta el fichero {}'.format(__JSON_NAME))
-
         with zfile.open(__JSON_NAME, 'r') as jsonfile:
             problem_json = json.load(jsonfile)
-
-        json_problem_type = problem_json.get('type', None)
-        if json_problem_type is None:
+        if problem_json.get('type', None) is None:
             raise ZipFileParsingException(f'Missing field "type" in file {__JSON_NAME}')
+    except Exception:
+        zfile.close()
+        raise
+    return ProblemZip(zfile, problem_json)
+
+
+@contextmanager
+def problem_zip(file, problem_type):
+    """
+    Context manager with the ProblemZip of 'file', checking that it contains a problem of type 'problem_type'
+    :param file: ProblemZip already opened (that is not closed when leaving) or ZIP file (path or file-like object)
+    :param problem_type: Problem type that should appear in the JSON file
+    """
+    pzip = file if isinstance(file, ProblemZip) else open_problem_zip(file)
+    try:
+        json_problem_type = pzip.json['type']
         if json_problem_type != problem_type:
             raise ZipFileParsingException(f'Invalid "type" field in {__JSON_NAME}: '
                                           f'expected {problem_type} but {json_problem_type} obtained')
-    return problem_json
+        yield pzip
+    finally:
+        if pzip is not file:
+            pzip.close()
 
 
 def get_language_from_json(problem_json):
@@ -54,6 +101,21 @@ def get_language_from_json(problem_json):
     return lang
 
 
+def get_limits_from_json(problem, problem_json):
+    """ Sets the optional execution limits of the problem ("stmt_timeout_ms", "max_rows" and "max_tables") from the
+        problem JSON. Limits not defined are None, so the global limits are used """
+    for field in ['stmt_timeout_ms', 'max_rows', 'max_tables']:
+        value = problem_json.get(field)
+        if value is not None:
+            try:
+                value = int(value)
+            except (TypeError, ValueError) as excp:
+                raise ZipFileParsingException(f'Invalid value in {__JSON_NAME} for "{field}": {value}') from excp
+            if value <= 0:
+                raise ZipFileParsingException(f'Invalid value in {__JSON_NAME} for "{field}": {value}')
+        setattr(problem, field, value)
+
+
 def extract_hints_from_file(problem, zfile):
     """ Extracts the hints from the file hints.md"""
     hint_separation = "@@@new hint@@@"
@@ -81,328 +143,135 @@ def extract_hints_from_file(problem, zfile):
 
     problem.hints_info = hints
 
-def load_select_problem(problem, file) -> None:
+def load_problem(problem, file, required_files, extra_files, check_json):
     """
     Load the problem information from a ZIP file and updates the attributes of 'problem'
-    :param problem: SelectProblem to update
-    :param file: ZipFile previoulsy opened and with a JSON File
+    :param problem: Problem to update
+    :param file: ProblemZip or ZIP file
+    :param required_files: set of files that the ZIP must contain
+    :param extra_files: list of (file, attribute, strip) with the files specific of the problem type
+    :param check_json: function that receives the problem and the JSON, updates the fields specific of the problem
+                       type and raises ZipFileParsingException if some value is invalid
     :return: None or raise ZipFileParsingException if there is any problem
     """
     state = 'Checking file existence'
     try:
-        problem_json = extract_json(file, problem.problem_type())
-        with ZipFile(file) as zfile:
-            if not __SELECT_PROBLEM_FILES <= set(zfile.namelist()):
-                raise ZipFileParsingException(
-                    f'ZIP file must contain the following files: {__SELECT_PROBLEM_FILES}')
+        with problem_zip(file, problem.problem_type()) as pzip:
+            if not required_files <= pzip.names:
+                raise ZipFileParsingException(f'ZIP file must contain the following files: {required_files}')
 
             state = 'Reading JSON file'
+            problem_json = pzip.json
             problem.title_md = problem_json.get('title', '')
             problem.language = get_language_from_json(problem_json)
+            get_limits_from_json(problem, problem_json)
             problem.min_stmt = int(problem_json.get('min_stmt', '1'))
             problem.max_stmt = int(problem_json.get('max_stmt', '1'))
             problem.position = int(problem_json['position'])
-            problem.check_order = bool(problem_json.get('check_order'))  # None will be converted to False
-            if not problem.title_md or problem.min_stmt != 1 or problem.max_stmt != 1:
-                raise ZipFileParsingException('Invalid value in JSON file: "title", "min_stmt" or "max_stmt"')
-
-            state = 'Reading text.md file'
-            with zfile.open('text.md', 'r') as text_file:
-                problem.text_md = text_file.read().decode(encoding='utf-8')
-
-            state = 'Reading create.sql file'
-            with zfile.open('create.sql', 'r') as create_file:
-                create_str = create_file.read().decode(encoding='utf-8')
-                problem.create_sql = create_str
-
-            state = 'Reading insert.sql file'
-            with zfile.open('insert.sql', 'r') as insert_file:
-                insert_str = insert_file.read().decode(encoding='utf-8')
-                problem.insert_sql = insert_str
+            check_json(problem, problem_json)
 
-            state = 'Reading solution.sql file'
-            with zfile.open('solution.sql', 'r') as solution_file:
-                problem.solution = solution_file.read().decode(encoding='utf-8')
+            common_files = [('text.md', 'text_md', False), ('create.sql', 'create_sql', False),
+                            ('insert.sql', 'insert_sql', False)]
+            for filename, attribute, strip in common_files + extra_files:
+                state = f'Reading {filename} file'
+                content = pzip.read(filename)
+                setattr(problem, attribute, content.strip() if strip else content)
 
-            if 'hints.md' in zfile.namelist():
+            if 'hints.md' in pzip.names:
                 state = 'Reading hints.md file'
-                extract_hints_from_file(problem, zfile)
+                extract_hints_from_file(problem, pzip.zfile)
     except ZipFileParsingException:
         raise
     except Exception as excp:
         raise ZipFileParsingException("{}: {} - {}".format(state, type(excp), excp)) from excp
 
 
-def load_dml_problem(problem, file):
-    """
-    Load the problem information from a ZIP file and updates the attributes of 'problem'
-    :param problem: DMLProblem to update
-    :param file: ZipFile previoulsy opened and with a JSON File
-    :return: None or raise ZipFileParsingException if there is any problem
-    """
-    state = 'Checking file existence'
-    try:
-        problem_json = extract_json(file, problem.problem_type())
-        with ZipFile(file) as zfile:
-            if not __DML_PROBLEM_FILES <= set(zfile.namelist()):
-                raise ZipFileParsingException(
-                    f'ZIP file must contain the following files: {__DML_PROBLEM_FILES}')
+def check_title(problem, _problem_json):
+    """Raises ZipFileParsingException if the problem has no title"""
+    if not problem.title_md:
+        raise ZipFileParsingException('Invalid value in JSON file: "title"')
 
-            state = 'Reading JSON file'
-            problem.title_md = problem_json.get('title', '')
-            problem.language = get_language_from_json(problem_json)
-            problem.min_stmt = int(problem_json.get('min_stmt', '1'))
-            problem.max_stmt = int(problem_json.get('max_stmt', '1'))
-            problem.position = int(problem_json['position'])
-            if (not problem.title_md or problem.min_stmt <= 0 or problem.max_stmt <= 0 or
-                    problem.min_stmt > problem.max_stmt):
-                raise ZipFileParsingException('Invalid value in JSON file: "title", "min_stmt" or "max_stmt"')
 
-            state = 'Reading text.md file'
-            with zfile.open('text.md', 'r') as text_file:
-                problem.text_md = text_file.read().decode(encoding='utf-8')
+def check_stmt(problem, _problem_json):
+    """Raises ZipFileParsingException if the title or the number of statements is invalid"""
+    if (not problem.title_md or problem.min_stmt <= 0 or problem.max_stmt <= 0 or
+            problem.min_stmt > problem.max_stmt):
+        raise ZipFileParsingException('Invalid value in JSON file: "title", "min_stmt" or "max_stmt"')
 
-            state = 'Reading create.sql file'
-            with zfile.open('create.sql', 'r') as create_file:
-                create_str = create_file.read().decode(encoding='utf-8')
-                problem.create_sql = create_str
 
-            state = 'Reading insert.sql file'
-            with zfile.open('insert.sql', 'r') as insert_file:
-                insert_str = insert_file.read().decode(encoding='utf-8')
-                problem.insert_sql = insert_str
+def check_stmt_order(problem, problem_json):
+    """Same as check_stmt, also reading "check_order" """
+    problem.check_order = bool(problem_json.get('check_order'))  # None will be converted to False
+    check_stmt(problem, problem_json)
 
-            state = 'Reading solution.sql file'
-            with zfile.open('solution.sql', 'r') as solution_file:
-                problem.solution = solution_file.read().decode(encoding='utf-8')
 
-            if 'hints.md' in zfile.namelist():
-                state = 'Reading hints.md file'
-                extract_hints_from_file(problem, zfile)
-    except ZipFileParsingException:
-        raise
-    except Exception as excp:
-        raise ZipFileParsingException("{}: {} - {}".format(state, type(excp), excp)) from excp
+def check_select(problem, problem_json):
+    """Same as check_stmt_order but SELECT problems must have exactly one statement"""
+    check_stmt_order(problem, problem_json)
+    if problem.min_stmt != 1 or problem.max_stmt != 1:
+        raise ZipFileParsingException('Invalid value in JSON file: "title", "min_stmt" or "max_stmt"')
 
 
-def load_function_problem(problem, file):
+def load_select_problem(problem, file) -> None:
     """
     Load the problem information from a ZIP file and updates the attributes of 'problem'
-    :param problem: DMLProblem to update
-    :param file: ZipFile previoulsy opened and with a JSON File
+    :param problem: SelectProblem to update
+    :param file: ZIP file or ProblemZip previously opened
     :return: None or raise ZipFileParsingException if there is any problem
     """
-    state = 'Checking file existence'
-    try:
-        problem_json = extract_json(file, problem.problem_type())
-        with ZipFile(file) as zfile:
-            if not __FUNCTION_PROBLEM_FILES <= set(zfile.namelist()):
-                raise ZipFileParsingException(
-                    f'ZIP file must contain the following files: {__FUNCTION_PROBLEM_FILES}')
-
-            state = 'Reading JSON file'
-            problem.title_md = problem_json.get('title', '')
-            problem.language = get_language_from_json(problem_json)
-            problem.min_stmt = int(problem_json.get('min_stmt', '1'))
-            problem.max_stmt = int(problem_json.get('max_stmt', '1'))
-            problem.position = int(problem_json['position'])
-
-            if not problem.title_md:
-                raise ZipFileParsingException('Invalid value in JSON file: "title"')
-
-            state = 'Reading text.md file'
-            with zfile.open('text.md', 'r') as text_file:
-                problem.text_md = text_file.read().decode(encoding='utf-8')
-
-            state = 'Reading create.sql file'
-            with zfile.open('create.sql', 'r') as create_file:
-                create_str = create_file.read().decode(encoding='utf-8')
-                problem.create_sql = create_str
-
-            state = 'Reading insert.sql file'
-            with zfile.open('insert.sql', 'r') as insert_file:
-                insert_str = insert_file.read().decode(encoding='utf-8')
-                problem.insert_sql = insert_str
-
-            state = 'Reading solution.sql file'
-            with zfile.open('solution.sql', 'r') as solution_file:
-                problem.solution = solution_file.read().decode(encoding='utf-8')
-
-            state = 'Leyendo fichero tests.sql'
-            with zfile.open('tests.sql', 'r') as tests_file:
-                problem.calls = tests_file.read().decode(encoding='utf-8')
-
-            if 'hints.md' in zfile.namelist():
-                state = 'Reading hints.md file'
-                extract_hints_from_file(problem, zfile)
-    except ZipFileParsingException:
-        raise
-    except Exception as excp:
-        raise ZipFileParsingException("{}: {} - {}".format(state, type(excp), excp)) from None
+    load_problem(problem, file, __SELECT_PROBLEM_FILES, [('solution.sql', 'solution', False)], check_select)
 
 
-def load_proc_problem(problem, file):
+def load_dml_problem(problem, file):
     """
     Load the problem information from a ZIP file and updates the attributes of 'problem'
     :param problem: DMLProblem to update
-    :param file: ZipFile previoulsy opened and with a JSON File
+    :param file: ZIP file or ProblemZip previously opened
     :return: None or raise ZipFileParsingException if there is any problem
     """
-    state = 'Checking file existence'
-    try:
-        problem_json = extract_json(file, problem.problem_type())
-        with ZipFile(file) as zfile:
-            if not __PROC_PROBLEM_FILES <= set(zfile.namelist()):
-                raise ZipFileParsingException(
-                    f'ZIP file must contain the following files: {__PROC_PROBLEM_FILES}')
-
-            state = 'Reading JSON file'
-            problem.title_md = problem_json.get('title', '')
-            problem.language = get_language_from_json(problem_json)
-            problem.min_stmt = int(problem_json.get('min_stmt', '1'))
-            problem.max_stmt = int(problem_json.get('max_stmt', '1'))
-            problem.position = int(problem_json['position'])
-            if not problem.title_md:
-                raise ZipFileParsingException('Invalid value in JSON file: "title"')
-
-            state = 'Reading text.md file'
-            with zfile.open('text.md', 'r') as text_file:
-                problem.text_md = text_file.read().decode(encoding='utf-8')
+    load_problem(problem, file, __DML_PROBLEM_FILES, [('solution.sql', 'solution', False)], check_stmt)
 
-            state = 'Reading create.sql file'
-            with zfile.open('create.sql', 'r') as create_file:
-                create_str = create_file.read().decode(encoding='utf-8')
-                problem.create_sql = create_str
 
-            state = 'Reading insert.sql file'
-            with zfile.open('insert.sql', 'r') as insert_file:
-                insert_str = insert_file.read().decode(encoding='utf-8')
-                problem.insert_sql = insert_str
-
-            state = 'Reading solution.sql file'
-            with zfile.open('solution.sql', 'r') as solution_file:
-                problem.solution = solution_file.read().decode(encoding='utf-8')
+def load_function_problem(problem, file):
+    """
+    Load the problem information from a ZIP file and updates the attributes of 'problem'
+    :param problem: FunctionProblem to update
+    :param file: ZIP file or ProblemZip previously opened
+    :return: None or raise ZipFileParsingException if there is any problem
+    """
+    load_problem(problem, file, __FUNCTION_PROBLEM_FILES,
+                 [('solution.sql', 'solution', False), ('tests.sql', 'calls', False)], check_title)
 
-            state = 'Leyendo fichero tests.sql'
-            with zfile.open('tests.sql', 'r') as tests_file:
-                problem.proc_call = tests_file.read().decode(encoding='utf-8').strip()
 
-            if 'hints.md' in zfile.namelist():
-                state = 'Reading hints.md file'
-                extract_hints_from_file(problem, zfile)
-    except ZipFileParsingException:
-        raise
-    except Exception as excp:
-        raise ZipFileParsingException("{}: {} - {}".format(state, type(excp), excp)) from excp
+def load_proc_problem(problem, file):
+    """
+    Load the problem information from a ZIP file and updates the attributes of 'problem'
+    :param problem: ProcProblem to update
+    :param file: ZIP file or ProblemZip previously opened
+    :return: None or raise ZipFileParsingException if there is any problem
+    """
+    load_problem(problem, file, __PROC_PROBLEM_FILES,
+                 [('solution.sql', 'solution', False), ('tests.sql', 'proc_call', True)], check_title)
 
 
 def load_trigger_problem(problem, file):
     """
-        Load the problem information from a ZIP file and updates the attributes of 'problem'
-        :param problem: DMLProblem to update
-        :param file: ZipFile previoulsy opened and with a JSON File
-        :return: None or raise ZipFileParsingException if there is any problem
-        """
-    state = 'Checking file existence'
-    try:
-        problem_json = extract_json(file, problem.problem_type())
-        with ZipFile(file) as zfile:
-            if not __TRIGGER_PROBLEM_FILES <= set(zfile.namelist()):
-                raise ZipFileParsingException(
-                    f'ZIP file must contain the following files: {__TRIGGER_PROBLEM_FILES}')
-
-            state = 'Reading JSON file'
-            problem.title_md = problem_json.get('title', '')
-            problem.language = get_language_from_json(problem_json)
-            problem.min_stmt = int(problem_json.get('min_stmt', '1'))
-            problem.max_stmt = int(problem_json.get('max_stmt', '1'))
-            problem.position = int(problem_json['position'])
-            if not problem.title_md:
-                raise ZipFileParsingException('Invalid values in JSON file: "title"')
-
-            state = 'Reading text.md file'
-            with zfile.open('text.md', 'r') as text_file:
-                problem.text_md = text_file.read().decode(encoding='utf-8')
-
-            state = 'Reading create.sql file'
-            with zfile.open('create.sql', 'r') as create_file:
-                create_str = create_file.read().decode(encoding='utf-8')
-                problem.create_sql = create_str
-
-            state = 'Reading insert.sql file'
-            with zfile.open('insert.sql', 'r') as insert_file:
-                insert_str = insert_file.read().decode(encoding='utf-8')
-                problem.insert_sql = insert_str
-
-            state = 'Reading solution.sql file'
-            with zfile.open('solution.sql', 'r') as solution_file:
-                problem.solution = solution_file.read().decode(encoding='utf-8')
-
-            state = 'Leyendo fichero tests.sql'
-            with zfile.open('tests.sql', 'r') as tests_file:
-                problem.tests = tests_file.read().decode(encoding='utf-8').strip()
-
-            if 'hints.md' in zfile.namelist():
-                state = 'Reading hints.md file'
-                extract_hints_from_file(problem, zfile)
-    except ZipFileParsingException:
-        raise
-    except Exception as excp:
-        raise ZipFileParsingException("{}: {} - {}".format(state, type(excp), excp)) from excp
+    Load the problem information from a ZIP file and updates the attributes of 'problem'
+    :param problem: TriggerProblem to update
+    :param file: ZIP file or ProblemZip previously opened
+    :return: None or raise ZipFileParsingException if there is any problem
+    """
+    load_problem(problem, file, __TRIGGER_PROBLEM_FILES,
+                 [('solution.sql', 'solution', False), ('tests.sql', 'tests', True)], check_title)
 
 
 def load_discriminant_problem(problem, file):
     """
-        Load the problem information from a ZIP file and updates the attributes of 'problem'
-        :param problem: DiscriminantProblem to update
-        :param file: ZipFile previoulsy opened and with a JSON File
-        :return: None or raise ZipFileParsingException if there is any problem
-        """
-    state = 'Checking file existence'
-    try:
-        problem_json = extract_json(file, problem.problem_type())
-        with ZipFile(file) as zfile:
-            if not __DISCRIMINANT_PROBLEM_FILES <= set(zfile.namelist()):
-                raise ZipFileParsingException(
-                    f'ZIP file must contain the following files: {__DISCRIMINANT_PROBLEM_FILES}')
-
-            state = 'Reading JSON file'
-            problem.title_md = problem_json.get('title', '')
-            problem.language = get_language_from_json(problem_json)
-            problem.min_stmt = int(problem_json.get('min_stmt', '1'))
-            problem.max_stmt = int(problem_json.get('max_stmt', '1'))
-            problem.position = int(problem_json['position'])
-            problem.check_order = bool(problem_json.get('check_order'))  # None will be converted to False
-            if (not problem.title_md or problem.min_stmt <= 0 or problem.max_stmt <= 0 or
-                    problem.min_stmt > problem.max_stmt):
-                raise ZipFileParsingException('Invalid value in JSON file: "title", "min_stmt" or "max_stmt"')
-
-            state = 'Reading text.md file'
-            with zfile.open('text.md', 'r') as text_file:
-                problem.text_md = text_file.read().decode(encoding='utf-8')
-
-            state = 'Reading create.sql file'
-            with zfile.open('create.sql', 'r') as create_file:
-                create_str = create_file.read().decode(encoding='utf-8')
-                problem.create_sql = create_str
-
-            state = 'Reading insert.sql file'
-            with zfile.open('insert.sql', 'r') as insert_file:
-                insert_str = insert_file.read().decode(encoding='utf-8')
-                problem.insert_sql = insert_str
-
-            state = 'Reading incorrect_query.sql file'
-            with zfile.open('incorrect_query.sql', 'r') as incorrect_file:
-                problem.incorrect_query = incorrect_file.read().decode(encoding='utf-8')
-
-            state = 'Reading correct_query.sql file'
-            with zfile.open('correct_query.sql', 'r') as correct_file:
-                problem.correct_query = correct_file.read().decode(encoding='utf-8')
-
-            if 'hints.md' in zfile.namelist():
-                state = 'Reading hints.md file'
-                extract_hints_from_file(problem, zfile)
-    except ZipFileParsingException:
-        raise
-    except Exception as excp:
-        raise ZipFileParsingException("{}: {} - {}".format(state, type(excp), excp)) from excp
+    Load the problem information from a ZIP file and updates the attributes of 'problem'
+    :param problem: DiscriminantProblem to update
+    :param file: ZIP file or ProblemZip previously opened
+    :return: None or raise ZipFileParsingException if there is any problem
+    """
+    load_problem(problem, file, __DISCRIMINANT_PROBLEM_FILES,
+                 [('incorrect_query.sql', 'incorrect_query', False), ('correct_query.sql', 'correct_query', False)],
+                 check_stmt_order)
@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright Enrique Martín <emartinm@ucm.es> 2021
+
+Executor that judges SELECT, DML and discriminant problems in PostgreSQL. Every submission is executed by a new role
+that owns a new schema, both dropped afterwards, so several servers (or replicas of the sandbox database) can be used
+to scale horizontally. Problems must be written in the SQL dialect of PostgreSQL.
+The connection details are taken from the environment variables JUDGE_PG_SERVER, JUDGE_PG_PORT, JUDGE_PG_DB,
+JUDGE_PG_USER (a role with CREATEROLE), JUDGE_PG_PASS, JUDGE_PG_MAX_CONNECTIONS and JUDGE_PG_POOL_TIMEOUT_MS
+"""
+
+import os
+import string
+import threading
+from contextlib import contextmanager
+import psycopg2
+import psycopg2.pool
+from psycopg2 import sql
+from logzero import logger
+
+from .exceptions import ExecutorException
+from .executor import Executor
+from .oracle_driver import OracleSandbox, clean_sql, default_limits, uniform_dict, fetch_limited, random_str, \
+    line_col_from_offset
+from .types import OracleStatusCode, ProblemType
+
+
+def table_from_cursor(cursor, type_names, limits=None):
+    """
+    Same as oracle_driver.table_from_cursor for PostgreSQL cursors. Unquoted names are lowercase in PostgreSQL,
+    so column names are uppercased as in Oracle
+    :param cursor: psycopg2 cursor that has executed a statement
+    :param type_names: dict {oid: name} of the types of PostgreSQL
+    :param limits: ExecutionLimits to use instead of the global limits
+    :return: a dictionary {'header':[[NAME:str, TYPE:str]], 'rows': [list]}
+    """
+    limits = limits or default_limits()
+    if cursor.description is None:
+        return {'header': [], 'rows': []}
+    rows = fetch_limited(cursor, limits)
+    header = [[column.name.upper(), type_names.get(column.type_code, str(column.type_code)).upper()]
+              for column in cursor.description]
+    return uniform_dict({'header': header, 'rows': [list(row) for row in rows]})
+
+
+class AdminPool:
+    """Pool of connections of the admin role. Like the SessionPool of cx_Oracle, acquire() waits for a free
+    connection up to 'timeout' milliseconds and the number of connections in use is available in 'busy'"""
+
+    def __init__(self, size, timeout_ms, **params):
+        self.max = size
+        self.busy = 0
+        self.timeout = timeout_ms / 1000
+        self.lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(size)
+        self.pool = psycopg2.pool.ThreadedConnectionPool(0, size, **params)
+
+    def acquire(self):
+        """
+        :return: connection of the admin role. Raises a psycopg2.pool.PoolError if there is no free connection
+        """
+        if not self.slots.acquire(timeout=self.timeout):  # pylint: disable=consider-using-with
+            raise psycopg2.pool.PoolError('No free connections in the admin pool')
+        try:
+            conn = self.pool.getconn()
+        except psycopg2.Error:
+            self.slots.release()
+            raise
+        with self.lock:
+            self.busy += 1
+        return conn
+
+    def release(self, conn):
+        """Returns a connection obtained with acquire()"""
+        self.pool.putconn(conn)
+        with self.lock:
+            self.busy -= 1
+        self.slots.release()
+
+
+class PostgreSQLSandbox(OracleSandbox):
+    """Fresh role and schema where a submission is judged, with the same stages as OracleSandbox. Besides the
+    statement_timeout of the session, which the code of the user could change, running statements of the user are
+    cancelled from the client when the timeout expires"""
+
+    DRIVER_ERROR = psycopg2.Error
+
+    @contextmanager
+    def stage(self, state):
+        """Stage that also enforces the statement timeout while executing the code of the user"""
+        timer = None
+        if state in (OracleStatusCode.EXECUTE_USER_CODE, OracleStatusCode.EXECUTE_DISCRIMINANT_SELECT):
+            timer = threading.Timer(self.limits.stmt_timeout_ms / 1000, self.conn.cancel)
+            timer.start()
+        try:
+            with super().stage(state):
+                yield
+        finally:
+            if timer is not None:
+                timer.cancel()
+
+    def connect(self, passwd):
+        """:return: connection of the new role, using its schema and with the statement timeout of the limits"""
+        return self.executor.create_connection(self.user, passwd, self.limits.stmt_timeout_ms)
+
+    def select(self, statement):
+        statements = clean_sql(statement)
+        if len(statements) != 1:
+            raise ExecutorException(OracleStatusCode.NUMBER_STATEMENTS)
+        with self.conn.cursor() as cursor:
+            cursor.execute(statements[0])
+            result = table_from_cursor(cursor, self.executor.type_names, self.limits)
+        self.conn.rollback()
+        return result
+
+    def insert(self, insertion):
+        self.execute(clean_sql(insertion))
+
+    def tables(self):
+        """
+        :return: dictionary {table_name: TABLE} with all the tables in the schema of the user
+        """
+        with self.conn.cursor() as cursor:
+            cursor.execute("SELECT table_name FROM information_schema.tables "
+                           "WHERE table_schema = current_schema() AND table_type = 'BASE TABLE' "
+                           "ORDER BY table_name")
+            tables = cursor.fetchmany(self.limits.max_tables)
+            if cursor.fetchone():
+                logger.debug('Too many tables in user DB')
+                raise ExecutorException(OracleStatusCode.TLE_USER_CODE)
+            db_dict = {}
+            for table_name, in tables:
+                cursor.execute(sql.SQL('SELECT * FROM {}').format(sql.Identifier(table_name)))
+                db_dict[table_name.upper()] = table_from_cursor(cursor, self.executor.type_names, self.limits)
+        self.conn.commit()
+        return db_dict
+
+
+class PostgreSQLExecutor(Executor):
+    """Executor that judges SELECT, DML and discriminant problems in PostgreSQL. Functions, procedures and triggers
+    are not supported and raise an ExecutorException with status code OracleStatusCode.OTHER"""
+
+    __USER_PREFIX = 'lsql_'
+    __ALPHABET = string.ascii_lowercase + string.digits
+    __CREATE_USER_SCRIPT = 'CREATE ROLE {user} LOGIN PASSWORD {passwd} CONNECTION LIMIT 2'
+    __CREATE_SCHEMA_SCRIPT = 'CREATE SCHEMA {user} AUTHORIZATION {user}'
+    __GRANT_CONNECT_SCRIPT = 'GRANT CONNECT ON DATABASE {db} TO {user}'
+    __DROP_SCHEMA_SCRIPT = 'DROP SCHEMA IF EXISTS {user} CASCADE'
+    __REVOKE_CONNECT_SCRIPT = 'REVOKE CONNECT ON DATABASE {db} FROM {user}'
+    __DROP_USER_SCRIPT = 'DROP ROLE IF EXISTS {user}'
+
+    def __init__(self):
+        """Creates the pool of connections of the admin role, taking the details from the environment"""
+        self.params = {
+            'host': os.environ.get('JUDGE_PG_SERVER', os.environ.get('PG_SERVER', 'localhost')),
+            'port': int(os.environ.get('JUDGE_PG_PORT', os.environ.get('PG_PORT', 5432))),
+            'dbname': os.environ.get('JUDGE_PG_DB', 'lsql_sandbox'),
+        }
+        self.connection_pool = AdminPool(int(os.environ.get('JUDGE_PG_MAX_CONNECTIONS', 10)),
+                                         int(os.environ.get('JUDGE_PG_POOL_TIMEOUT_MS', 1000)),
+                                         user=os.environ.get('JUDGE_PG_USER', os.environ.get('PG_USER', 'postgres')),
+                                         password=os.environ.get('JUDGE_PG_PASS', os.environ.get('PG_PASS', '')),
+                                         **self.params)
+        super().__init__()
+        gestor = self.connection_pool.acquire()
+        try:
+            with gestor.cursor() as cursor:
+                cursor.execute('SELECT oid, typname FROM pg_type')
+                self.type_names = dict(cursor.fetchall())
+            gestor.commit()
+        finally:
+            self.connection_pool.release(gestor)
+        logger.debug('Created a PostgreSQLExecutor to %s with a pool of %s connections', self.params,
+                     self.connection_pool.max)
+
+    def create_user(self, connection):
+        """
+        Creates a new role with a schema of the same name
+        :param connection: connection of the admin role
+        :return: (user, passwd) of the new role
+        """
+        user = self.__USER_PREFIX + random_str(self.__ALPHABET, 8)
+        passwd = random_str(self.__ALPHABET, 20)
+        names = {'user': sql.Identifier(user), 'passwd': sql.Literal(passwd),
+                 'db': sql.Identifier(self.params['dbname'])}
+        with connection.cursor() as cursor:
+            for script in (self.__CREATE_USER_SCRIPT, self.__CREATE_SCHEMA_SCRIPT, self.__GRANT_CONNECT_SCRIPT):
+                cursor.execute(sql.SQL(script).format(**names))
+        connection.commit()
+        return user, passwd
+
+    def drop_user(self, user_name, connection):
+        """
+        Drops the schema of a role and the role
+        :param user_name: name of the role
+        :param connection: connection of the admin role
+        :return: None
+        """
+        names = {'user': sql.Identifier(user_name), 'db': sql.Identifier(self.params['dbname'])}
+        try:
+            with connection.cursor() as cursor:
+                for script in (self.__DROP_SCHEMA_SCRIPT, self.__REVOKE_CONNECT_SCRIPT, self.__DROP_USER_SCRIPT):
+                    cursor.execute(sql.SQL(script).format(**names))
+            connection.commit()
+        except psycopg2.Error:
+            connection.rollback()
+            raise
+
+    def release_user(self, user_name, connection):
+        """Drops a role once its submission has been judged"""
+        self.drop_user(user_name, connection)
+
+    def create_connection(self, user, passwd, stmt_timeout_ms):
+        """
+        :return: new connection of the role, using its schema and with a statement timeout
+        """
+        return psycopg2.connect(user=user, password=passwd,
+                                options=f'-c search_path={user} -c statement_timeout={stmt_timeout_ms}',
+                                **self.params)
+
+    @staticmethod
+    def close_connection(connection):
+        """Closes a connection obtained with create_connection"""
+        connection.close()
+
+    @staticmethod
+    def error(sandbox, excp, code):
+        """
+        :return: ExecutorException for an error of PostgreSQL in the current stage of the sandbox
+        """
+        error_msg = str(excp).strip()
+        logger.info('Error when testing in PostgreSQL: %s - %s - %s', sandbox.state, error_msg, code)
+        if isinstance(excp, psycopg2.extensions.QueryCanceledError):
+            return ExecutorException(OracleStatusCode.TLE_USER_CODE, error_msg, code)
+        position = (0, 0)
+        if getattr(excp, 'diag', None) is not None and excp.diag.statement_position:
+            position = line_col_from_offset(code, int(excp.diag.statement_position) - 1)
+        return ExecutorException(sandbox.state, error_msg, code, position)
+
+    def execute_select_test(self, creation, insertion, select, output_db=False, limits=None):
+        sandbox = PostgreSQLSandbox(self, ProblemType.SELECT, limits)
+        try:
+            return sandbox.select_test(creation, insertion, select, output_db)
+        except psycopg2.Error as excp:
+            raise self.error(sandbox, excp, select) from excp
+
+    def execute_dml_test(self, creation, insertion, dml, pre_db=True, min_stmt=0, max_stmt=float("inf"),
+                         limits=None):
+        # pylint: disable=too-many-arguments
+        sandbox = PostgreSQLSandbox(self, ProblemType.DML, limits)
+        try:
+            return sandbox.dml_test(creation, insertion, dml, pre_db, min_stmt, max_stmt)
+        except psycopg2.Error as excp:
+            raise self.error(sandbox, excp, dml) from excp
+
+    def execute_discriminant_test(self, creation, insertion_base, insertion_user, select_correct, select_incorrect,
+                                  limits=None):
+        # pylint: disable=too-many-arguments
+        sandbox = PostgreSQLSandbox(self, ProblemType.DISC, limits)
+        try:
+            return sandbox.discriminant_test(creation, insertion_base, insertion_user, select_correct,
+                                             select_incorrect)
+        except psycopg2.Error as excp:
+            raise self.error(sandbox, excp, insertion_user) from excp
+
+    def execute_function_test(self, creation, insertion, func_creation, tests, limits=None):
+        # pylint: disable=too-many-arguments
+        raise ExecutorException(OracleStatusCode.OTHER, 'Functions are not supported by PostgreSQLExecutor')
+
+    def execute_proc_test(self, creation, insertion, proc_creation, proc_call, pre_db=True, limits=None):
+        # pylint: disable=too-many-arguments
+        raise ExecutorException(OracleStatusCode.OTHER, 'Procedures are not supported by PostgreSQLExecutor')
+
+    def execute_trigger_test(self, creation, insertion, trigger_definition, tests, pre_db=True, limits=None):
+        # pylint: disable=too-many-arguments
+        raise ExecutorException(OracleStatusCode.OTHER, 'Triggers are not supported by PostgreSQLExecutor')
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright Enrique Martín <emartinm@ucm.es> 2021
+
+Background removal of dangling Oracle users, i.e., sandbox users that could not be dropped after judging a
+submission (usually after a TLE, when Oracle still considers the user connected)
+"""
+
+import threading
+import time
+from logzero import logger
+
+
+class DanglingUserReaper(threading.Thread):
+    """Daemon thread that periodically drops dangling users using an OracleExecutor. Users that cannot be dropped
+    are retried in later rounds with exponential backoff, so the reaper never blocks on a single user"""
+
+    MAX_BACKOFF = 3600  # Maximum number of seconds to wait before retrying a failed user
+
+    def __init__(self, executor, interval=60, age_seconds=60, workers=2):
+        """
+        :param executor: OracleExecutor used to remove the users
+        :param interval: (int) seconds between rounds
+        :param age_seconds: (int) only users created more than 'age_seconds' ago are considered dangling
+        :param workers: (int) number of users dropped in parallel
+        """
+        super().__init__(name='dangling-user-reaper', daemon=True)
+        self.executor = executor
+        self.interval = interval
+        self.age_seconds = age_seconds
+        self.workers = workers
+        self.failures = {}  # {username: (failed attempts, time when it can be retried)}
+        self.backlog = None  # Number of dangling users after the last round, None if unknown
+        self.stop_event = threading.Event()
+
+    def reap(self):
+        """
+        Removes the dangling users in one round, skipping those users whose backoff has not expired
+        :return: pair of lists (dropped, failed) with the names of the users
+        """
+        now = time.time()
+        waiting = {user for user, (_, not_before) in self.failures.items() if not_before > now}
+        dropped, failed = self.executor.remove_dangling_users(age_seconds=self.age_seconds, workers=self.workers,
+                                                              exclude=waiting)
+        for user in dropped:
+            self.failures.pop(user, None)
+        for user in failed:
+            attempts = self.failures.get(user, (0, 0))[0] + 1
+            delay = min(self.interval * 2 ** attempts, self.MAX_BACKOFF)
+            self.failures[user] = (attempts, now + delay)
+            logger.error('Unable to drop dangling user %s after %s rounds, retrying in %s seconds',
+                         user, attempts, delay)
+        remaining = self.executor.get_dangling_users(age_seconds=self.age_seconds)
+        if remaining is not None:
+            # Forgets the failures of users that no longer exist (dropped by someone else), so the dict does not grow
+            for user in set(self.failures).difference(remaining):
+                del self.failures[user]
+            self.backlog = len(remaining)
+        logger.info('Reaper removed %s dangling users, %s failed, %s remaining',
+                    len(dropped), len(failed), self.backlog)
+        return dropped, failed
+
+    def run(self):
+        """Removes dangling users every 'interval' seconds until stop() is invoked"""
+        while not self.stop_event.is_set():
+            try:
+                self.reap()
+            except Exception as excp:  # pylint: disable=broad-except
+                # The thread must survive any error (for example, Oracle not available for some time)
+                logger.error('Error while removing dangling users: %s', excp)
+            self.stop_event.wait(self.interval)
+
+    def stop(self):
+        """Asks the thread to finish after the current round"""
+        self.stop_event.set()
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright Enrique Martín <emartinm@ucm.es> 2021
+
+Rejudge of submissions calling directly the judge of the problems. Submissions with the same problem and code are
+judged only once, and several codes are judged at the same time using the connections of the executor. Every result
+is written to the report (JSON lines or CSV) as soon as it is available, so an interrupted rejudge can be resumed
+skipping the submissions already in the report
+"""
+
+import csv
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection
+from logzero import logger
+
+from .bulk_import import executor_workers
+from .exceptions import ExecutorException
+from .executor import get_executor
+from .feedback import exception_verdict
+from .models import Problem, Submission
+from .types import VeredictCode
+
+# Columns of the report, one row per submission
+REPORT_FIELDS = ['submission', 'problem', 'user', 'date', 'old', 'new', 'feedback']
+
+
+def judge_code(problem, code):
+    """
+    Judges a code as the submit view, without the admission control
+    :param problem: Problem subclass object
+    :param code: (str) code submitted
+    :return: dict with 'veredict' (VeredictCode), 'message' and 'feedback'
+    """
+    try:
+        veredict, feedback = problem.judge(code, get_executor())
+        return {'veredict': veredict, 'message': veredict.message(), 'feedback': feedback}
+    except ExecutorException as excp:
+        return exception_verdict(problem, excp)
+    except Exception as excp:  # pylint: disable=broad-except
+        logger.exception('Error rejudging a submission to problem %s', problem.pk)
+        return {'veredict': VeredictCode.IE, 'message': VeredictCode.IE.message(),
+                'feedback': f'{type(excp).__name__}: {excp}'}
+    finally:
+        connection.close()  # Every thread of the pool has its own connection to the DB, if it was used
+
+
+def rejudge_submissions(submissions, workers=None, update=False, skip=()):
+    """
+    Judges again the submissions, judging concurrently the different codes
+    :param submissions: iterable of Submission
+    :param workers: (int) codes judged at the same time, by default the connections in the pool of the executor
+    :param update: if True, stores the new verdict of the submissions whose verdict changes
+    :param skip: collection with the pk of submissions that must not be judged (e.g., judged in a previous execution)
+    :return: generator of (submission, data), being 'data' the result of judge_code. Submissions are generated in the
+             order their judgements finish, with the verdict before the rejudge
+    """
+    groups = {}
+    for submission in submissions:
+        if submission.pk not in skip:
+            groups.setdefault((submission.problem_id, submission.code), []).append(submission)
+    problems = {problem.pk: problem for problem in
+                Problem.objects.filter(pk__in={problem_id for problem_id, _ in groups}).select_subclasses()}
+    logger.info('Rejudging %s submissions with %s different codes',
+                sum(len(group) for group in groups.values()), len(groups))
+
+    workers = min(workers or executor_workers(), max(len(groups), 1))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='rejudge') as pool:
+        futures = {pool.submit(judge_code, problems[problem_id], code): (problem_id, code)
+                   for problem_id, code in groups}
+        for future in as_completed(futures):
+            data = future.result()
+            group = groups[futures[future]]
+            if update:
+                Submission.objects.filter(pk__in=[sub.pk for sub in group if sub.veredict_code != data['veredict']])\
+                    .update(veredict_code=data['veredict'], veredict_message=str(data['message']))
+            for submission in group:
+                yield submission, data
+
+
+class RejudgeReport:
+    """
+    Report of a rejudge with one row per submission, in CSV if the name of the file ends with '.csv' or in JSON lines
+    otherwise. Used as a context manager, every row is flushed once written
+    """
+
+    def __init__(self, filename, resume=False):
+        """
+        :param filename: (str) path of the report
+        :param resume: if True, the rows are added to an existing report and 'done' contains its submissions
+        """
+        self.filename = filename
+        self.is_csv = filename.lower().endswith('.csv')
+        self.resume = resume and os.path.exists(filename) and os.path.getsize(filename) > 0
+        self.done = self.judged() if self.resume else set()
+        self.changes = {}
+        self.file = None
+        self.writer = None
+
+    def rows(self, report):
+        """:return: generator of the rows (dict) of the report, ignoring incomplete rows from an interrupted run"""
+        if self.is_csv:
+            yield from (row for row in csv.DictReader(report) if None not in row.values())
+        else:
+            for line in report:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    pass
+
+    def judged(self):
+        """:return: set with the pk of the submissions in the report"""
+        with open(self.filename, encoding='utf-8', newline='') as report:
+            return {int(row['submission']) for row in self.rows(report)}
+
+    def __enter__(self):
+        complete = True
+        if self.resume:
+            with open(self.filename, 'rb') as report:
+                report.seek(-1, os.SEEK_END)
+                complete = report.read() == b'\n'
+        self.file = open(self.filename, 'a' if self.resume else 'w', encoding='utf-8', newline='')
+        if not complete:
+            self.file.write('\n')  # Ends the last row, written partially
+        if self.is_csv:
+            self.writer = csv.DictWriter(self.file, REPORT_FIELDS)
+            if not self.resume:
+                self.writer.writeheader()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.file.close()
+
+    def write(self, submission, data):
+        """Writes the row of a rejudged submission and counts the change of verdict"""
+        row = {'submission': submission.pk, 'problem': submission.problem_id, 'user': submission.user.username,
+               'date': submission.creation_date.isoformat(), 'old': submission.veredict_code,
+               'new': str(data['veredict']), 'feedback': str(data['feedback'])}
+        if self.is_csv:
+            self.writer.writerow(row)
+        else:
+            self.file.write(json.dumps(row, ensure_ascii=False, cls=DjangoJSONEncoder) + '\n')
+        self.file.flush()
+        change = f'{row["old"]} --> {row["new"]}'
+        self.changes[change] = self.changes.get(change, 0) + 1
+
+
+def rejudge_to_report(submissions, filename, workers=None, update=False, resume=False):
+    """
+    Judges again the submissions writing the results in a report (see RejudgeReport)
+    :param submissions: QuerySet of Submission
+    :param filename: (str) path of the report
+    :param workers: (int) codes judged at the same time, by default the connections in the pool of the executor
+    :param update: if True, stores the new verdict of the submissions whose verdict changes
+    :param resume: if True, skips the submissions already in the report
+    :return: dict with the number of submissions rejudged in this execution for every change of verdict, e.g.
+             {'IE --> AC': 3, 'AC --> AC': 10}
+    """
+    with RejudgeReport(filename, resume) as report:
+        for submission, data in rejudge_submissions(submissions.select_related('user'), workers, update,
+                                                    report.done):
+            report.write(submission, data)
+    return report.changes
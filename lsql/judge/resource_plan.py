@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright Enrique Martín <emartinm@ucm.es> 2021
+
+Oracle Resource Manager plan that limits the resources used by the sandbox users, so that one expensive
+submission cannot slow down the rest. Sandbox users are assigned to the consumer group when created if the
+environment variable ORACLE_CONSUMER_GROUP is defined (see OracleExecutor.create_user)
+"""
+
+from logzero import logger
+
+DEFAULT_PLAN = 'LSQL_PLAN'
+DEFAULT_CONSUMER_GROUP = 'LSQL_SANDBOX'
+
+__DROP_PLAN = """
+BEGIN
+  DBMS_RESOURCE_MANAGER.CLEAR_PENDING_AREA();
+  DBMS_RESOURCE_MANAGER.CREATE_PENDING_AREA();
+  DBMS_RESOURCE_MANAGER.DELETE_PLAN_CASCADE(plan => :plan);
+  DBMS_RESOURCE_MANAGER.SUBMIT_PENDING_AREA();
+EXCEPTION
+  WHEN OTHERS THEN
+    DBMS_RESOURCE_MANAGER.CLEAR_PENDING_AREA();
+    IF SQLCODE != -29358 THEN  -- ORA-29358: resource plan does not exist
+      RAISE;
+    END IF;
+END;"""
+
+__CREATE_PLAN = """
+BEGIN
+  DBMS_RESOURCE_MANAGER.CLEAR_PENDING_AREA();
+  DBMS_RESOURCE_MANAGER.CREATE_PENDING_AREA();
+  DBMS_RESOURCE_MANAGER.CREATE_CONSUMER_GROUP(consumer_group => :grp, comment => 'LSQL sandbox users');
+  DBMS_RESOURCE_MANAGER.CREATE_PLAN(plan => :plan, comment => 'LSQL judge');
+  DBMS_RESOURCE_MANAGER.CREATE_PLAN_DIRECTIVE(
+    plan => :plan,
+    group_or_subplan => :grp,
+    comment => 'Sandbox users of the judge',
+    mgmt_p1 => :cpu_share,
+    max_utilization_limit => :cpu_limit,
+    parallel_degree_limit_p1 => :parallel,
+    switch_group => 'CANCEL_SQL',
+    switch_time => :cancel_after,
+    switch_io_megabytes => :max_io_mb,
+    switch_estimate => TRUE);
+  DBMS_RESOURCE_MANAGER.CREATE_PLAN_DIRECTIVE(
+    plan => :plan,
+    group_or_subplan => 'OTHER_GROUPS',
+    comment => 'Rest of users, including the admin user of the judge',
+    mgmt_p1 => 100 - :cpu_share);
+  DBMS_RESOURCE_MANAGER.VALIDATE_PENDING_AREA();
+  DBMS_RESOURCE_MANAGER.SUBMIT_PENDING_AREA();
+END;"""
+
+# The prefix FORCE: prevents the maintenance windows of the scheduler from replacing the plan
+__ACTIVATE_PLAN = "ALTER SYSTEM SET RESOURCE_MANAGER_PLAN = '{}'"
+
+__ACTIVE_PLAN = "SELECT value FROM v$parameter WHERE name = 'resource_manager_plan'"
+
+
+def active_resource_plan(conn):
+    """
+    :param conn: Oracle connection with access to V$PARAMETER
+    :return: (str) name of the active plan without the prefix FORCE:, or '' if there is no active plan
+    """
+    with conn.cursor() as cursor:
+        cursor.execute(__ACTIVE_PLAN)
+        row = cursor.fetchone()
+    value = (row[0] or '') if row else ''
+    return value[len('FORCE:'):] if value.upper().startswith('FORCE:') else value
+
+
+def drop_resource_plan(conn, plan=DEFAULT_PLAN):
+    """
+    Removes the plan along with its consumer groups, deactivating it first only if it is the active plan (so that
+    a plan activated by the DBA is kept). Does nothing if the plan does not exist
+    :param conn: Oracle connection with the ADMINISTER_RESOURCE_MANAGER privilege
+    :param plan: (str) name of the plan
+    :return: None
+    """
+    active = active_resource_plan(conn)
+    with conn.cursor() as cursor:
+        if active.upper() == plan.upper():
+            cursor.execute(__ACTIVATE_PLAN.format(''))
+        cursor.execute(__DROP_PLAN, plan=plan.upper())
+    logger.info('Dropped resource plan %s', plan)
+
+
+def setup_resource_plan(conn, plan=DEFAULT_PLAN, group=DEFAULT_CONSUMER_GROUP, cpu_share=50, cpu_limit=50,
+                        parallel=1, cancel_after=None, max_io_mb=None):
+    """
+    Creates (or replaces) and activates a plan with a consumer group for the sandbox users
+    :param conn: Oracle connection with the ADMINISTER_RESOURCE_MANAGER privilege
+    :param plan: (str) name of the plan
+    :param group: (str) name of the consumer group of the sandbox users
+    :param cpu_share: (int) percentage of CPU guaranteed to the group when the CPU is saturated
+    :param cpu_limit: (int) maximum percentage of CPU that the group can use
+    :param parallel: (int) maximum degree of parallelism of a statement of the group
+    :param cancel_after: (int) seconds after which a statement of the group is cancelled, None for no limit
+    :param max_io_mb: (int) megabytes of I/O after which a statement of the group is cancelled, None for no limit
+    :return: None
+    """
+    drop_resource_plan(conn, plan)
+    with conn.cursor() as cursor:
+        cursor.execute(__CREATE_PLAN, plan=plan.upper(), grp=group.upper(), cpu_share=cpu_share,
+                       cpu_limit=cpu_limit, parallel=parallel, cancel_after=cancel_after, max_io_mb=max_io_mb)
+        cursor.execute(__ACTIVATE_PLAN.format(f'FORCE:{plan.upper()}'))
+    logger.info('Activated resource plan %s for consumer group %s', plan, group)
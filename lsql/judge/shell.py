@@ -8,51 +8,74 @@ For example: create a group of users from a CSV list of students
 
 import csv
 import datetime
+import os
+from concurrent.futures import ProcessPoolExecutor
 
+import django
 from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
 from django.contrib.auth.models import Group
-from django.test import Client
-from django.urls import reverse
-from django.conf import settings
+from django.db import transaction
 
 from .models import Problem, Submission
+from .rejudge import rejudge_submissions
 
 
 def create_users_from_csv(csv_filename: str, group_name: str, dry: bool = False):
     """
     Batch creation of users from a CSV file, each line representing a new user. The username is the
     first part of the email (before @) and the password is the document number. Assigns every new
-    user to a new created group with name 'group_name'
+    user to a new created group with name 'group_name'. The group and the users are created in a single transaction
 
     If dry = True does not modify the DB but only show messages of the actions
 
     Each line has the following fields:
       FOTOGRAFÍA,NOMBRE COMPLETO,DOCUMENTO,ASIGNATURA,MAT.,CONV.,OBSERVACIÓN,CORREO,TELÉFONO
+    :return: list of usernames not created because they were repeated or already existed
     """
-    if dry:
-        print('Creating users from CSV (DRY RUN): NO USERS OR GROUPS WILL BE SAVED!')
-        group = Group(name=group_name)  # Dummy group not saved for dry run
-    else:
-        print('Creating users from CSV')
-        group = Group.objects.create(name=group_name)
-    print(f'* Created group {group_name}')
-    with open(csv_filename, encoding='utf_8') as csvfile:
-        reader = csv.DictReader(csvfile)
-        create_users_from_list(reader, group, dry)
+    with open(csv_filename, encoding='utf_8') as csvfile, transaction.atomic():
+        if dry:
+            print('Creating users from CSV (DRY RUN): NO USERS OR GROUPS WILL BE SAVED!')
+            group = Group(name=group_name)  # Dummy group not saved for dry run
+        else:
+            print('Creating users from CSV')
+            group = Group.objects.create(name=group_name)
+        print(f'* Created group {group_name}')
+        duplicates = create_users_from_list(csv.DictReader(csvfile), group, dry)
     print()
+    return duplicates
+
+
+def hash_passwords(passwords, workers=None):
+    """
+    Hashes the passwords in a pool of processes, as hashing a password is slow by design
+    :param passwords: list of str
+    :param workers: number of processes, by default the number of CPUs
+    :return: list of hashed passwords, in the same order
+    """
+    if len(passwords) < 2:
+        return [make_password(password) for password in passwords]
+    workers = min(workers or os.cpu_count() or 1, len(passwords))
+    # django.setup() is needed when the processes are spawned instead of forked (Windows, macOS)
+    with ProcessPoolExecutor(max_workers=workers, initializer=django.setup) as pool:
+        return list(pool.map(make_password, passwords, chunksize=max(1, len(passwords) // (4 * workers))))
 
 
 def create_users_from_list(dict_list, group: Group, dry: bool):
     """
     Batch creation of users from a list of dictionaries, each dictionary representing a new user. The username is the
-    first part of the email (before @) and the password is the document number.
+    first part of the email (before @) and the password is the document number. Users that are repeated in the
+    list or already exist are not created, and all the new users are inserted at once in 'group'
 
     If dry = True does not modify the DB but only show messages of the actions
 
     Dictionaries have the following keys:
       FOTOGRAFÍA,NOMBRE COMPLETO,DOCUMENTO,ASIGNATURA,MAT.,CONV.,OBSERVACIÓN,CORREO,TELÉFONO
+    :return: list of usernames not created because they were repeated or already existed
     """
     assert group  # Group is set
+    users, passwords, duplicates = [], [], []
+    usernames = set()
     for user_dict in dict_list:
         email = user_dict['CORREO']
         username = email.split('@')[0]
@@ -70,14 +93,33 @@ def create_users_from_list(dict_list, group: Group, dry: bool):
         assert first_name
         assert last_name
 
-        if not dry:
-            user = get_user_model().objects.create_user(username, email, password)
-            user.first_name = first_name
-            user.last_name = last_name
-            user.save()
-            group.user_set.add(user)
-        print(f'* Saved User("username:{username}", email:"{email}", passwd:"{password}", '
-              f'first_name:"{first_name}", last_name:"{last_name}") in group "{group}"')
+        if username in usernames:
+            duplicates.append(username)
+            print(f'* Skipped User("username:{username}", email:"{email}"): repeated in the list')
+            continue
+        usernames.add(username)
+        users.append(get_user_model()(username=username, email=get_user_model().objects.normalize_email(email),
+                                      first_name=first_name, last_name=last_name))
+        passwords.append(password)
+
+    existing = set(get_user_model().objects.filter(username__in=usernames).values_list('username', flat=True))
+    for user in [user for user in users if user.username in existing]:
+        duplicates.append(user.username)
+        print(f'* Skipped User("username:{user.username}", email:"{user.email}"): already exists')
+    passwords = [password for user, password in zip(users, passwords) if user.username not in existing]
+    users = [user for user in users if user.username not in existing]
+
+    if not dry:
+        for user, hashed in zip(users, hash_passwords(passwords)):
+            user.password = hashed
+        with transaction.atomic():
+            users = get_user_model().objects.bulk_create(users)
+            membership = get_user_model().groups.through
+            membership.objects.bulk_create(membership(user_id=user.pk, group_id=group.pk) for user in users)
+    for user, password in zip(users, passwords):
+        print(f'* Saved User("username:{user.username}", email:"{user.email}", passwd:"{password}", '
+              f'first_name:"{user.first_name}", last_name:"{user.last_name}") in group "{group}"')
+    return duplicates
 
 
 def is_list_of_dict(value):
@@ -103,47 +145,29 @@ def adapt_db_result_to_list():
         prob.save()
 
 
-def rejudge(verdict_code, filename='rejudge.txt', tests=False, start=datetime.datetime(1970, 1, 1),
-            end=datetime.datetime.now()):
+def rejudge(verdict_code, filename='rejudge.txt', tests=False, start=datetime.datetime(1970, 1, 1), end=None):
     """ Judges again all the submission in the period [start, end] with some verdict_code. For each submission,
-        submit the code, compares the veredict, and stores detailed information in the 'filename'.
-        Use tests=False for Django tests, tests=True for normal use
+        judges the code, compares the veredict, and stores detailed information in the 'filename'.
+        The argument 'tests' is kept for compatibility, submissions are judged directly without HTTP requests.
+        See the command 'rejudge' for a rejudge that can be resumed and writes a JSON lines or CSV report
     """
-    username = 'rejudge_user_test_983'
-    passwd = '1111'
-
-    try:
-        subs = Submission.objects.filter(veredict_code=verdict_code, creation_date__gte=start, creation_date__lte=end)
-        rejudge_users = get_user_model().objects.filter(username=username)
-        # In case the user was not deleted in a previous execution
-        user = (rejudge_users[0] if len(rejudge_users) == 1 else
-                get_user_model().objects.create_user(username=username, password=passwd))
-        client = Client()
-        client.login(username=username, password=passwd)
-
-        changes = dict()
-        with open(filename, 'w', encoding='utf8') as report:
-            for sub in subs:
-                submit_url = reverse('judge:submit', args=[sub.problem.pk])
-                # Using Client outside the Django testing command requires adjustment in the HTTP Host header
-                http_host = '127.0.0.1' if settings.DEBUG else 'learn.fdi.ucm.es'
-                response = client.post(submit_url, {'code': sub.code}, HTTP_HOST=http_host, follow=True) if not tests \
-                    else client.post(submit_url, {'code': sub.code}, follow=True)
-                report.write(f'Submission #{sub.pk}\n')
-                report.write('----------------------------\n')
-                report.write(f'Problem: {sub.problem.pk}\n')
-                report.write(f'User: {sub.user}\n')
-                report.write(f'Date: {sub.creation_date}\n')
-                report.write(f'Code ({len(sub.code)} chars):\n{sub.code}\n')
-                response_json = response.json()
-                verdict_change = f'{sub.veredict_code} --> {response_json["veredict"]}'
-                report.write(f'Verdict: {verdict_change}\n')
-                report.write(f'New feedback: {response_json["feedback"]}\n')
-                report.write('\n\n')
-                changes[verdict_change] = changes.get(verdict_change, 0) + 1
-
-            client.logout()
-            report.write(f'\n\nSummary of changes in verdicts (see {filename} for details):')
-            report.write(str(changes))
-    finally:
-        user.delete()
+    del tests  # Unused
+    subs = Submission.objects.filter(veredict_code=verdict_code, creation_date__gte=start,
+                                     creation_date__lte=end or datetime.datetime.now()).select_related('user')
+    changes = {}
+    with open(filename, 'w', encoding='utf8') as report:
+        for sub, data in rejudge_submissions(subs):
+            report.write(f'Submission #{sub.pk}\n')
+            report.write('----------------------------\n')
+            report.write(f'Problem: {sub.problem_id}\n')
+            report.write(f'User: {sub.user}\n')
+            report.write(f'Date: {sub.creation_date}\n')
+            report.write(f'Code ({len(sub.code)} chars):\n{sub.code}\n')
+            verdict_change = f'{sub.veredict_code} --> {data["veredict"]}'
+            report.write(f'Verdict: {verdict_change}\n')
+            report.write(f'New feedback: {data["feedback"]}\n')
+            report.write('\n\n')
+            changes[verdict_change] = changes.get(verdict_change, 0) + 1
+
+        report.write(f'\n\nSummary of changes in verdicts (see {filename} for details):')
+        report.write(str(changes))
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright Enrique Martín <emartinm@ucm.es> 2021
+
+Executor that runs SELECT, DML and discriminant problems in in-memory SQLite databases created inside the process.
+It does not need Oracle, so it is useful to test and profile the rest of the judge (views, feedback, ranking,
+achievements). Results imitate those of OracleExecutor: unquoted names are uppercased and column types are named
+as in cx_Oracle, but SQL dialects differ, so it must not be used to judge real submissions
+"""
+
+import sqlite3
+import time
+from logzero import logger
+
+from .exceptions import ExecutorException
+from .executor import Executor
+from .oracle_driver import OracleSandbox, clean_sql, default_limits, uniform_dict, fetch_limited
+from .types import OracleStatusCode, ProblemType
+
+# SQLite calls the progress handler every PROGRESS_STEPS virtual machine instructions to check the timeout
+PROGRESS_STEPS = 1000
+
+
+def column_type(rows, index):
+    """
+    :return: (str) name of the type of column 'index' as in cx_Oracle, from the first value that is not NULL
+    """
+    names = {int: 'DB_TYPE_NUMBER', float: 'DB_TYPE_NUMBER', str: 'DB_TYPE_VARCHAR', bytes: 'DB_TYPE_BLOB'}
+    value = next((row[index] for row in rows if row[index] is not None), '')
+    return f'<cx_Oracle.DbType {names.get(type(value), "DB_TYPE_VARCHAR")}>'
+
+
+def table_from_cursor(cursor, limits=None):
+    """
+    Same as oracle_driver.table_from_cursor for SQLite cursors
+    :param cursor: SQLite cursor that has executed a statement
+    :param limits: ExecutionLimits to use instead of the global limits
+    :return: a dictionary {'header':[[NAME:str, TYPE:str]], 'rows': [list]}
+    """
+    limits = limits or default_limits()
+    if cursor.description is None:
+        return {'header': [], 'rows': []}
+    rows = fetch_limited(cursor, limits)
+    header = [[column[0].upper(), column_type(rows, i)] for i, column in enumerate(cursor.description)]
+    return uniform_dict({'header': header, 'rows': [list(row) for row in rows]})
+
+
+def get_all_tables(conn, limits=None):
+    """
+    Same as oracle_driver.get_all_tables for SQLite connections
+    :param conn: SQLite connection
+    :param limits: ExecutionLimits to use instead of the global limits
+    :return: dictionary {table_name: TABLE}, where TABLE is the dictionary generated by table_from_cursor
+    """
+    limits = limits or default_limits()
+    cursor = conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' "
+                          "ORDER BY name")
+    tables = cursor.fetchmany(limits.max_tables)
+    if cursor.fetchone():
+        logger.debug('Too many tables in user DB')
+        raise ExecutorException(OracleStatusCode.TLE_USER_CODE)
+    return {name.upper(): table_from_cursor(conn.execute(f'SELECT * FROM "{name}"'), limits) for name, in tables}
+
+
+def execute_statements(conn, statements):
+    """
+    Executes a list of statements and commits
+    :param conn: SQLite connection
+    :param statements: [str] statements as returned by clean_sql
+    :return: None. It raises a sqlite3.Error if the execution of any of the statements is not correct
+    """
+    for statement in statements:
+        conn.execute(statement)
+    conn.commit()
+
+
+def execute_select_statement(conn, statement, limits=None):
+    """
+    Same as oracle_driver.execute_select_statement for SQLite connections
+    :return: dictionary with the result of the SELECT statement
+    """
+    statements = clean_sql(statement)
+    if len(statements) != 1:
+        raise ExecutorException(OracleStatusCode.NUMBER_STATEMENTS)
+    return table_from_cursor(conn.execute(statements[0]), limits)
+
+
+class SQLiteSandbox(OracleSandbox):
+    """Fresh in-memory SQLite database where a submission is judged, with the same stages as OracleSandbox. The
+    statement timeout is checked periodically by a progress handler of SQLite"""
+
+    def __init__(self, executor, problem_type, limits=None):
+        super().__init__(executor, problem_type, limits)
+        self.deadline = None
+
+    def interrupted(self):
+        """Progress handler: a non-zero value aborts the running statement with 'interrupted'"""
+        return int(self.deadline is not None and time.time() > self.deadline)
+
+    def stage(self, state):
+        """Stage that also enforces the statement timeout while executing the code of the user"""
+        if state in (OracleStatusCode.EXECUTE_USER_CODE, OracleStatusCode.EXECUTE_DISCRIMINANT_SELECT):
+            self.deadline = time.time() + self.limits.stmt_timeout_ms / 1000
+        else:
+            self.deadline = None
+        return super().stage(state)
+
+    def provision(self):
+        """Creates the database"""
+        with self.stage(OracleStatusCode.GET_USER_CONNECTION):
+            self.conn = sqlite3.connect(':memory:')
+            self.conn.set_progress_handler(self.interrupted, PROGRESS_STEPS)
+
+    def execute(self, statements):
+        execute_statements(self.conn, statements)
+
+    def select(self, statement):
+        return execute_select_statement(self.conn, statement, self.limits)
+
+    def insert(self, insertion):
+        execute_statements(self.conn, clean_sql(insertion))
+
+    def tables(self):
+        return get_all_tables(self.conn, self.limits)
+
+    def teardown(self):
+        with self.stage(OracleStatusCode.CLOSE_USER_CONNECTION):
+            self.conn.close()
+            self.conn = None
+
+    def cleanup(self):
+        if self.conn:
+            self.conn.close()
+
+
+class SQLiteExecutor(Executor):
+    """Executor that judges SELECT, DML and discriminant problems in SQLite. Functions, procedures and triggers
+    are not supported and raise an ExecutorException with status code OracleStatusCode.OTHER"""
+
+    @staticmethod
+    def error(sandbox, excp, code):
+        """
+        :return: ExecutorException for an error of SQLite in the current stage of the sandbox
+        """
+        error_msg = str(excp)
+        logger.info('Error when testing in SQLite: %s - %s - %s', sandbox.state, excp, code)
+        if 'interrupted' in error_msg:
+            return ExecutorException(OracleStatusCode.TLE_USER_CODE, error_msg, code)
+        return ExecutorException(sandbox.state, error_msg, code)
+
+    def execute_select_test(self, creation, insertion, select, output_db=False, limits=None):
+        sandbox = SQLiteSandbox(self, ProblemType.SELECT, limits)
+        try:
+            return sandbox.select_test(creation, insertion, select, output_db)
+        except sqlite3.Error as excp:
+            raise self.error(sandbox, excp, select) from excp
+
+    def execute_dml_test(self, creation, insertion, dml, pre_db=True, min_stmt=0, max_stmt=float("inf"),
+                         limits=None):
+        # pylint: disable=too-many-arguments
+        sandbox = SQLiteSandbox(self, ProblemType.DML, limits)
+        try:
+            return sandbox.dml_test(creation, insertion, dml, pre_db, min_stmt, max_stmt)
+        except sqlite3.Error as excp:
+            raise self.error(sandbox, excp, dml) from excp
+
+    def execute_discriminant_test(self, creation, insertion_base, insertion_user, select_correct, select_incorrect,
+                                  limits=None):
+        # pylint: disable=too-many-arguments
+        sandbox = SQLiteSandbox(self, ProblemType.DISC, limits)
+        try:
+            return sandbox.discriminant_test(creation, insertion_base, insertion_user, select_correct,
+                                             select_incorrect)
+        except sqlite3.Error as excp:
+            raise self.error(sandbox, excp, insertion_user) from excp
+
+    def execute_function_test(self, creation, insertion, func_creation, tests, limits=None):
+        # pylint: disable=too-many-arguments
+        raise ExecutorException(OracleStatusCode.OTHER, 'Functions are not supported by SQLiteExecutor')
+
+    def execute_proc_test(self, creation, insertion, proc_creation, proc_call, pre_db=True, limits=None):
+        # pylint: disable=too-many-arguments
+        raise ExecutorException(OracleStatusCode.OTHER, 'Procedures are not supported by SQLiteExecutor')
+
+    def execute_trigger_test(self, creation, insertion, trigger_definition, tests, pre_db=True, limits=None):
+        # pylint: disable=too-many-arguments
+        raise ExecutorException(OracleStatusCode.OTHER, 'Triggers are not supported by SQLiteExecutor')
@@ -88,7 +88,9 @@ function send_solution() {
     };
     fetch(endpoint, config)
       .then(function(response) {
-          if (response.ok) {
+          if (response.ok || response.status == 503 || response.status == 429) {
+              // 503: the judge is busy, 429: too many submissions of the student. The JSON contains the message
+              // asking to retry later
               return response.json(); // Returns a new Promise, that can be chained
           } else {
               throw response;
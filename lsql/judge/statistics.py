@@ -8,7 +8,7 @@ from collections import Counter
 from statistics import mean, stdev, quantiles
 
 from django.contrib.auth import get_user_model
-from django.db.models import Count
+from django.db.models import Count, Avg, Max, Q
 from django.contrib.auth.models import Group
 
 from .models import Submission
@@ -89,3 +89,27 @@ def participation_per_group():
             'quantiles': ' - '.join(map(str, [min(list_num_subs)] + quantiles(list_num_subs) + [max(list_num_subs)])),
         }
     return participating
+
+
+def execution_time_per_problem(limit=20):
+    """ Returns a list with the 'limit' problems with the highest average time executing the code of students,
+        in decreasing order:
+        [
+            {
+                'id': int,             # pk of the problem
+                'problem': str,        # title of the problem
+                'submissions': int,    # no. of submissions with execution time
+                'avg': float,          # avg. execution time in seconds
+                'max': float,          # max. execution time in seconds
+                'tle': int,            # no. of TLE submissions
+            }
+        ]
+        Only submissions with execution time are considered (those judged after timings were stored). Problems are
+        grouped by pk, as different problems can share the same title
+    """
+    per_problem = (Submission.objects.filter(execution_time__isnull=False).values('problem', 'problem__title_md')
+                   .annotate(submissions=Count('pk'), avg=Avg('execution_time'), max=Max('execution_time'),
+                             tle=Count('pk', filter=Q(veredict_code=VeredictCode.TLE)))
+                   .order_by('-avg')[:limit])
+    return [{'id': entry['problem'], 'problem': entry['problem__title_md'], 'submissions': entry['submissions'],
+             'avg': entry['avg'], 'max': entry['max'], 'tle': entry['tle']} for entry in per_problem]
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright Enrique Martín <emartinm@ucm.es> 2021
+
+Deferred removal of the Oracle users created to judge submissions, so that the verdict does not wait for the
+DROP USER ... CASCADE
+"""
+
+import queue
+import threading
+import cx_Oracle
+from logzero import logger
+
+
+class DeferredTeardown(threading.Thread):
+    """Daemon thread that drops sandbox users taken from a bounded queue. Users are dropped in batches that share
+    one connection of the admin pool. Users that cannot be dropped remain as dangling users (see judge.reaper)"""
+
+    STOP = object()  # Enqueued by stop() to finish the thread
+
+    def __init__(self, executor, maxsize=100, batch_size=10):
+        """
+        :param executor: OracleExecutor used to drop the users
+        :param maxsize: (int) maximum number of users waiting to be dropped
+        :param batch_size: (int) maximum number of users dropped with the same admin connection
+        """
+        super().__init__(name='deferred-teardown', daemon=True)
+        self.executor = executor
+        self.batch_size = batch_size
+        self.pending = queue.Queue(maxsize=maxsize)
+
+    def submit(self, user_name):
+        """
+        Enqueues a user to be dropped in the background
+        :param user_name: Name of the user to remove
+        :return: (bool) False if the queue is full, so the caller must drop the user by itself
+        """
+        try:
+            self.pending.put_nowait(user_name)
+            return True
+        except queue.Full:
+            logger.info('Teardown queue is full, user %s will be dropped synchronously', user_name)
+            return False
+
+    def next_batch(self):
+        """
+        Waits for a user in the queue and returns it along with the users already waiting, up to 'batch_size'
+        :return: list of user names
+        """
+        batch = [self.pending.get()]
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.pending.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def drop_batch(self, batch):
+        """
+        Drops a list of users using one connection of the admin pool
+        :param batch: list of user names
+        :return: list of names of the users that could not be dropped
+        """
+        failed = []
+        gestor = None
+        try:
+            gestor = self.executor.connection_pool.acquire()
+            for user_name in batch:
+                try:
+                    self.executor.drop_user(user_name, gestor)
+                except cx_Oracle.DatabaseError as excp:  # pragma: no cover
+                    logger.error('Unable to drop user %s, it remains as a dangling user (%s)', user_name, excp)
+                    failed.append(user_name)
+        except cx_Oracle.DatabaseError as excp:  # pragma: no cover
+            logger.error('Unable to obtain a connection to drop %s users, they remain as dangling users (%s)',
+                         len(batch), excp)
+            failed = batch
+        finally:
+            if gestor is not None:
+                self.executor.connection_pool.release(gestor)
+        return failed
+
+    def run(self):
+        """Drops the enqueued users until stop() is invoked"""
+        stopped = False
+        while not stopped:
+            batch = self.next_batch()
+            users = [user_name for user_name in batch if user_name is not self.STOP]
+            stopped = len(users) < len(batch)
+            try:
+                if users:
+                    self.drop_batch(users)
+            except Exception as excp:  # pylint: disable=broad-except
+                # The thread must survive any error, the users will be removed later as dangling users
+                logger.error('Error while dropping users %s: %s', batch, excp)
+            finally:
+                for _ in batch:
+                    self.pending.task_done()
+
+    def stop(self, timeout=None):
+        """
+        Finishes the thread after dropping the users already enqueued
+        :param timeout: (float) maximum number of seconds to wait for the thread, None to wait until it finishes
+        :return: None
+        """
+        self.pending.put(self.STOP)  # Blocks if the queue is full, until the thread takes some users
+        self.join(timeout)
+
+    def wait(self):
+        """Blocks until all the enqueued users have been processed"""
+        self.pending.join()
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright Enrique Martín <emartinm@ucm.es> 2021
+
+Unit tests for the admission control and circuit breaker of the judge
+"""
+import threading
+import time
+import psycopg2
+
+from django.test import TestCase, Client, override_settings
+from django.urls import reverse
+
+from judge.admission import AdmissionControl, JudgeBusy, get_admission
+from judge.exceptions import ExecutorException
+from judge.models import Submission
+from judge.tests.test_views import create_collection, create_user, create_select_problem
+from judge.types import OracleStatusCode
+
+
+class AdmissionTest(TestCase):
+    """Tests for judge.admission"""
+
+    def test_in_flight_limit(self):
+        """Submissions beyond the limit are rejected without being judged"""
+        admission = AdmissionControl(max_in_flight=1)
+        inside, leave = threading.Event(), threading.Event()
+
+        def judge():
+            with admission.admit():
+                inside.set()
+                leave.wait()
+
+        thread = threading.Thread(target=judge)
+        thread.start()
+        inside.wait()
+        self.assertEqual(admission.status()['in_flight'], 1)
+        with self.assertRaises(JudgeBusy) as ctx:
+            with admission.admit():
+                self.fail('Must not be judged')
+        self.assertGreaterEqual(ctx.exception.retry_after, 1)
+        leave.set()
+        thread.join()
+        with admission.admit():
+            pass
+        self.assertEqual(admission.status()['rejected_busy'], 1)
+        self.assertIn('lsql_judge_rejected_total{reason="busy"} 1', admission.prometheus())
+
+    def test_circuit_breaker(self):
+        """The breaker opens after consecutive database errors and closes after a successful trial"""
+        admission = AdmissionControl(failure_threshold=2, open_seconds=0.2)
+        for error in (OracleStatusCode.GET_ADMIN_CONNECTION, OracleStatusCode.EXECUTE_USER_CODE,
+                      OracleStatusCode.CREATE_USER, OracleStatusCode.GET_ADMIN_CONNECTION):
+            with self.assertRaises(ExecutorException):
+                with admission.admit():
+                    raise ExecutorException(error)
+        # Errors in the code of the user reset the count, so it opens with the last error
+        self.assertEqual(admission.status()['breaker'], AdmissionControl.OPEN)
+        with self.assertRaises(JudgeBusy):
+            with admission.admit():
+                self.fail('Must not be judged')
+
+        time.sleep(0.25)  # Half-open: the trial fails and the breaker opens again
+        with self.assertRaises(ExecutorException):
+            with admission.admit():
+                self.assertEqual(admission.status()['breaker'], AdmissionControl.HALF_OPEN)
+                raise ExecutorException(OracleStatusCode.GET_USER_CONNECTION)
+        self.assertEqual(admission.status()['breaker'], AdmissionControl.OPEN)
+
+        time.sleep(0.25)  # The trial succeeds
+        with admission.admit():
+            pass
+        self.assertEqual(admission.status()['breaker'], AdmissionControl.CLOSED)
+        self.assertEqual(admission.status()['rejected_open'], 1)
+
+    def test_breaker_errors(self):
+        """Only errors of connection and provisioning or of the drivers open the breaker"""
+        admission = AdmissionControl(failure_threshold=1)
+        for excp in (ExecutorException(OracleStatusCode.OTHER), ValueError('Bug in the judge'),
+                     ExecutorException(OracleStatusCode.EXECUTE_USER_CODE)):
+            with self.assertRaises(type(excp)):
+                with admission.admit():
+                    raise excp
+            self.assertEqual(admission.status()['breaker'], AdmissionControl.CLOSED)
+
+        with self.assertRaises(psycopg2.OperationalError):
+            with admission.admit():
+                raise psycopg2.OperationalError('could not connect to server')
+        self.assertEqual(admission.status()['breaker'], AdmissionControl.OPEN)
+
+    @override_settings(JUDGE_EXECUTOR='judge.sqlite_driver.SQLiteExecutor')
+    def test_submit_busy(self):
+        """Rejected submissions receive a 503 with Retry-After and are not stored"""
+        problem = create_select_problem(create_collection('Admission'))
+        create_user('5555', 'pepe')
+        client = Client()
+        client.login(username='pepe', password='5555')
+        url = reverse('judge:submit', args=[problem.pk])
+
+        admission = get_admission()
+        admission.state, admission.opened_at = AdmissionControl.OPEN, time.time()
+        try:
+            response = client.post(url, {'code': problem.solution}, follow=True)
+        finally:
+            admission.state = AdmissionControl.CLOSED
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json()['veredict'], 'BUSY')
+        self.assertEqual(response['Retry-After'], str(response.json()['retry_after']))
+        self.assertFalse(Submission.objects.filter(problem=problem).exists())
+
+        response = client.post(url, {'code': problem.solution}, follow=True)
+        self.assertEqual(response.json()['veredict'], 'AC')
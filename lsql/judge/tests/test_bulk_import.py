@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright Enrique Martín <emartinm@ucm.es> 2021
+
+Unit tests for the import of collection ZIPs in background, validating the problems with the SQLite executor
+"""
+import os
+from datetime import timedelta
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase, Client, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from judge.bulk_import import validate_problems, recompute_problems
+from judge.models import Hint, ImportJob, Problem, SelectProblem, match_problems
+from judge.tests.test_views import create_collection
+from judge.types import ImportState
+
+
+def select_problem(collection, title, solution, hints=(), position=1):
+    """Unsaved SelectProblem as returned by load_many_problems"""
+    problem = SelectProblem(title_md=title, text_md='Texto', collection=collection, solution=solution,
+                            position=position, create_sql='CREATE TABLE club (nombre VARCHAR2(40), socios NUMBER);',
+                            insert_sql="INSERT INTO club VALUES ('Real Madrid', 10);")
+    problem.hints_info = list(hints)
+    return problem
+
+
+@override_settings(JUDGE_EXECUTOR='judge.sqlite_driver.SQLiteExecutor')
+class BulkImportTest(TestCase):
+    """Tests for judge.bulk_import and ImportJob"""
+
+    def test_validate_problems(self):
+        """Problems are validated concurrently and errors are returned in order"""
+        collection = create_collection('Import')
+        problems = [select_problem(collection, f'Problema {i}', 'SELECT * FROM club') for i in range(6)]
+        problems[1].solution = 'SELECT * FROM equipo'
+        problems[4].solution = 'SELECT * FROM socio'
+        progress = []
+        errors = validate_problems(problems, workers=3, progress=lambda problem, error: progress.append(error))
+        self.assertEqual([problem for problem, _ in errors], [problems[1], problems[4]])
+        self.assertEqual(len(progress), 6)
+        self.assertEqual(len([error for error in progress if error is not None]), 2)
+        self.assertEqual(problems[0].expected_result, [{'header': [['NOMBRE', '<cx_Oracle.DbType DB_TYPE_VARCHAR>'],
+                                                                   ['SOCIOS', '<cx_Oracle.DbType DB_TYPE_NUMBER>']],
+                                                        'rows': [['Real Madrid', 10]]}])
+
+    def test_import_job(self):
+        """Problems and hints are saved only if all the problems are valid"""
+        collection = create_collection('Import')
+        problems = [select_problem(collection, 'Bien', 'SELECT * FROM club', hints=[(1, 'Pista'), (3, 'Otra')]),
+                    select_problem(collection, 'Mal', 'SELECT * FROM equipo')]
+        job = ImportJob.objects.create(collection=collection)
+        job.run(problems, workers=2)
+        job.refresh_from_db()
+        self.assertEqual((job.state, job.processed, job.total), (ImportState.FAILED, 2, 2))
+        self.assertEqual([error['problem'] for error in job.errors], ['Mal'])
+        self.assertEqual(collection.problems().count(), 0)
+
+        problems[1].solution = 'SELECT nombre FROM club'
+        job.run(problems, workers=2)
+        job.refresh_from_db()
+        self.assertEqual((job.state, job.processed, job.errors), (ImportState.DONE, 2, []))
+        self.assertIsNotNone(job.finish_date)
+        self.assertEqual(collection.problems().count(), 2)
+        self.assertEqual(list(Hint.objects.filter(problem__collection=collection).order_by('num_submit')
+                              .values_list('num_submit', 'text_md')), [(1, 'Pista'), (3, 'Otra')])
+
+    def test_admin(self):
+        """The admin only parses the ZIP file and starts a job when the collection is saved"""
+        collection = create_collection('Import')
+        admin = get_user_model().objects.create_superuser('admin', 'admin@ucm.es', '1234')
+        client = Client()
+        client.force_login(admin)
+        url = reverse('admin:judge_collection_change', args=[collection.pk])
+        zip_path = os.path.join(os.path.dirname(__file__), 'zip_files', 'problems.zip')
+        with open(zip_path, 'rb') as zip_file, self.captureOnCommitCallbacks() as callbacks:
+            response = client.post(url, {'name_md': 'Import', 'position': 1, 'description_md': 'Descripción',
+                                         'author': admin.pk, 'zipfile': zip_file}, follow=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(callbacks), 1)  # Starts the thread
+        job = ImportJob.objects.get(collection=collection)
+        self.assertEqual((job.state, job.total, job.author), (ImportState.PENDING, 5, admin))
+        with open(zip_path, 'rb') as zip_file:
+            self.assertEqual(bytes(job.zip_data), zip_file.read())  # Stored to restart the job
+        self.assertEqual(collection.problems().count(), 0)
+
+        with open(os.path.join(os.path.dirname(zip_path), 'no_json.zip'), 'rb') as zip_file:
+            response = client.post(url, {'name_md': 'Import', 'position': 1, 'description_md': 'Descripción',
+                                         'author': admin.pk, 'zipfile': zip_file})
+        self.assertContains(response, 'errornote')
+        self.assertEqual(ImportJob.objects.filter(collection=collection).count(), 1)  # Error in the form
+
+    def test_stale_jobs(self):
+        """Jobs without progress are marked as FAILED when listed in the admin, and can be restarted from their ZIP"""
+        collection = create_collection('Import')
+        zip_path = os.path.join(os.path.dirname(__file__), 'zip_files', 'problems.zip')
+        with open(zip_path, 'rb') as zip_file:
+            stale = ImportJob.objects.create(collection=collection, state=ImportState.RUNNING, zip_data=zip_file.read())
+        stale.update(heartbeat=timezone.now() - timedelta(seconds=120))
+        pending = ImportJob.objects.create(collection=collection)
+        self.assertEqual(ImportJob.fail_stale(timeout=60), 1)
+        stale.refresh_from_db()
+        pending.refresh_from_db()
+        self.assertEqual((stale.state, pending.state), (ImportState.FAILED, ImportState.PENDING))
+        self.assertIn('Interrupted', stale.errors[-1]['error'])
+        self.assertIsNotNone(stale.finish_date)
+
+        admin = get_user_model().objects.create_superuser('admin', 'admin@ucm.es', '1234')
+        client = Client()
+        client.force_login(admin)
+        url = reverse('admin:judge_importjob_changelist')
+        ImportJob.objects.filter(pk=pending.pk).update(creation_date=timezone.now() - timedelta(days=1))
+        self.assertEqual(client.get(url).status_code, 200)
+        self.assertEqual(ImportJob.objects.get(pk=pending.pk).state, ImportState.FAILED)
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            client.post(url, {'action': 'restart', '_selected_action': [stale.pk, pending.pk]})
+        self.assertEqual(len(callbacks), 1)  # Only the job with ZIP file is started
+        stale.refresh_from_db()
+        self.assertEqual((stale.state, stale.total, stale.processed, stale.errors), (ImportState.PENDING, 5, 0, []))
+
+    def test_incremental_import(self):
+        """Re-importing a collection updates its problems, executing only those whose SQL code has changed"""
+        collection = create_collection('Import')
+        job = ImportJob.objects.create(collection=collection)
+        job.run([select_problem(collection, 'Uno', 'SELECT * FROM club', hints=[(1, 'Pista'), (3, 'Otra')], position=1),
+                 select_problem(collection, 'Dos', 'SELECT nombre FROM club', position=2)])
+        first, second = collection.problems().select_subclasses()
+        self.assertEqual(first.content_hash, first.execution_hash())
+        used_hint = Hint.objects.get(problem=first, num_submit=1)
+
+        # Same code with a new statement and hints; new SQL code for the second problem
+        problems = [select_problem(collection, 'Uno', 'SELECT * FROM club', hints=[(1, 'Pista')], position=1),
+                    select_problem(collection, 'Dos', 'SELECT socios FROM club', position=2),
+                    select_problem(collection, 'Tres', 'SELECT * FROM club', position=3)]
+        problems[0].text_md = 'Nuevo *texto*'
+        changed, unchanged = match_problems(collection, problems)
+        self.assertEqual((changed, unchanged), (problems[1:], problems[:1]))
+        self.assertEqual((problems[0].pk, problems[1].pk, problems[2].pk), (first.pk, second.pk, None))
+        self.assertEqual(problems[0].expected_result, first.expected_result)  # Taken without executing
+        self.assertEqual(problems[0].text_html, '<p>Nuevo <em>texto</em></p>')
+
+        job.run(problems)
+        job.refresh_from_db()
+        self.assertEqual((job.state, job.processed, job.unchanged, job.total), (ImportState.DONE, 3, 1, 3))
+        self.assertEqual(collection.problems().count(), 3)
+        second = SelectProblem.objects.get(pk=second.pk)
+        self.assertEqual((second.title_md, second.expected_result[0]['rows']), ('Dos', [[10]]))
+        self.assertEqual(list(Hint.objects.filter(problem=first).values_list('pk', flat=True)), [used_hint.pk])
+
+        # Problems saved before the hash existed are executed again
+        SelectProblem.objects.filter(pk=first.pk).update(content_hash='')
+        changed, _ = match_problems(collection, [select_problem(collection, 'Uno', 'SELECT * FROM club')])
+        self.assertEqual(len(changed), 1)
+
+        # Problems are matched only by title, whatever their position
+        problems = [select_problem(collection, 'Uno (renombrado)', 'SELECT * FROM club', position=1),
+                    select_problem(collection, 'Dos', 'SELECT socios FROM club', position=3),
+                    select_problem(collection, 'Tres', 'SELECT * FROM club', position=4)]
+        third = SelectProblem.objects.get(collection=collection, title_md='Tres')
+        match_problems(collection, problems)
+        self.assertEqual([problem.pk for problem in problems], [None, second.pk, third.pk])
+
+    def test_new_problem_position(self):
+        """A ZIP with only a new problem in the position of a stored problem adds it without changing the other"""
+        collection = create_collection('Import')
+        job = ImportJob.objects.create(collection=collection)
+        job.run([select_problem(collection, 'Uno', 'SELECT * FROM club', position=1)])
+        old = SelectProblem.objects.get(collection=collection)
+
+        job.run([select_problem(collection, 'Nuevo', 'SELECT nombre FROM club', position=1)])
+        job.refresh_from_db()
+        self.assertEqual((job.state, job.processed, job.unchanged), (ImportState.DONE, 1, 0))
+        self.assertEqual(collection.problems().count(), 2)
+        stored = SelectProblem.objects.get(pk=old.pk)
+        self.assertEqual((stored.title_md, stored.solution, stored.expected_result),
+                         (old.title_md, old.solution, old.expected_result))
+        self.assertEqual(SelectProblem.objects.get(collection=collection, title_md='Nuevo').position, 1)
+
+    def test_recompute_problems(self):
+        """Only the problems whose expected results change are saved"""
+        collection = create_collection('Import')
+        problems = [select_problem(collection, f'Problema {i}', 'SELECT * FROM club', position=i) for i in range(3)]
+        for problem in problems:
+            problem.clean()
+            problem.save()
+        SelectProblem.objects.filter(pk=problems[1].pk).update(expected_result=[])
+        SelectProblem.objects.filter(pk=problems[2].pk).update(solution='SELECT * FROM equipo')
+        SelectProblem.objects.filter(pk=problems[0].pk).update(content_hash='')  # Saved before the hash existed
+        stored = list(Problem.objects.filter(collection=collection).select_subclasses())
+
+        changed, errors = recompute_problems(stored, dry=True)
+        self.assertEqual([(problem.pk, fields) for problem, fields in changed], [(problems[1].pk, ['expected_result'])])
+        self.assertEqual([problem.pk for problem, _ in errors], [problems[2].pk])
+        self.assertEqual(SelectProblem.objects.get(pk=problems[1].pk).expected_result, [])
+
+        out = StringIO()
+        call_command('recompute_expected_results', '--collection', collection.pk, '--type', 'SELECT', stdout=out,
+                     stderr=StringIO())
+        self.assertIn(f'Changed problem {problems[1].pk}', out.getvalue())
+        self.assertIn('1 changed (saved), 1 unchanged, 1 errors', out.getvalue())
+        self.assertEqual(SelectProblem.objects.get(pk=problems[1].pk).expected_result, problems[0].expected_result)
+        self.assertEqual(SelectProblem.objects.get(pk=problems[0].pk).content_hash, problems[0].content_hash)
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright Enrique Martín <emartinm@ucm.es> 2021
+
+Unit tests for the export of collections to ZIP files
+"""
+import io
+from zipfile import ZipFile
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, Client
+from django.urls import reverse
+
+from judge.export import stream_collection, stream_collections
+from judge.models import Collection, SelectProblem, DMLProblem, FunctionProblem, ProcProblem, TriggerProblem, \
+    DiscriminantProblem, Hint, load_many_problems
+from judge.tests.test_views import create_collection
+
+CREATE = 'CREATE TABLE club (cif CHAR(9) PRIMARY KEY, nombre VARCHAR2(40));'
+INSERT = "INSERT INTO club VALUES ('11111111X', 'Real Madrid');"
+
+
+def create_problems(collection):
+    """Creates (without executing them) a problem of each type in the collection"""
+    common = {'text_md': 'Enunciado con **negrita** y tildes: ñú', 'create_sql': CREATE, 'insert_sql': INSERT,
+              'collection': collection, 'title_html': 'Título'}
+    problems = [
+        SelectProblem(title_md='Select', position=1, check_order=True, solution='SELECT * FROM club',
+                      max_rows=10, **common),
+        DMLProblem(title_md='DML', position=2, min_stmt=1, max_stmt=2, solution='DELETE FROM club', **common),
+        FunctionProblem(title_md='Function', position=3, solution='CREATE FUNCTION f ...', calls='f(1)\nf(2)',
+                        **common),
+        ProcProblem(title_md='Proc', position=4, solution='CREATE PROCEDURE p ...', proc_call='p(1)', **common),
+        TriggerProblem(title_md='Trigger', position=5, solution='CREATE TRIGGER t ...', tests='DELETE FROM club;',
+                       stmt_timeout_ms=500, **common),
+        DiscriminantProblem(title_md='Discriminant', position=6, incorrect_query='SELECT * FROM club',
+                            correct_query='SELECT cif FROM club', **common),
+    ]
+    for problem in problems:
+        if not isinstance(problem, (SelectProblem, DiscriminantProblem)):
+            problem.expected_result = []
+        problem.save()
+    Hint.objects.create(problem=problems[0], num_submit=3, text_md='Segunda pista\ncon dos líneas')
+    Hint.objects.create(problem=problems[0], num_submit=1, text_md='Primera pista')
+    return problems
+
+
+class ExportTest(TestCase):
+    """Tests for judge.export"""
+
+    FIELDS = ['title_md', 'text_md', 'create_sql', 'insert_sql', 'language', 'position', 'min_stmt', 'max_stmt',
+              'stmt_timeout_ms', 'max_rows', 'max_tables', 'solution', 'check_order', 'calls', 'proc_call', 'tests',
+              'incorrect_query', 'correct_query']
+
+    def assert_same_problems(self, original, loaded):
+        """The problems loaded from the exported ZIP have the same type and fields as the original problems"""
+        self.assertEqual(len(original), len(loaded))
+        for problem, copy in zip(original, loaded):
+            self.assertIs(type(copy), type(problem))
+            for field in self.FIELDS:
+                if hasattr(problem, field) and (field != 'check_order' or not isinstance(problem, DMLProblem)):
+                    self.assertEqual(getattr(copy, field), getattr(problem, field), f'{problem} {field}')
+
+    def test_round_trip(self):
+        """Exported collections are loaded with load_many_problems"""
+        collection = create_collection('Exportar')
+        problems = create_problems(collection)
+        chunks = list(stream_collection(collection))
+        self.assertGreater(len(chunks), len(problems))  # One chunk per problem
+        loaded = load_many_problems(io.BytesIO(b''.join(chunks)), Collection())
+        self.assert_same_problems(problems, loaded)
+        self.assertEqual(loaded[0].hints_info, [(1, 'Primera pista'), (3, 'Segunda pista\ncon dos líneas')])
+        self.assertFalse(hasattr(loaded[1], 'hints_info'))
+
+        other = create_collection('Otra')
+        with ZipFile(io.BytesIO(b''.join(stream_collections([collection, other])))) as zfile:
+            names = zfile.namelist()
+            self.assertEqual(names, [f'{collection.pk}_exportar.zip', f'{other.pk}_otra.zip'])
+            with zfile.open(names[0]) as collection_file:
+                self.assert_same_problems(problems, load_many_problems(io.BytesIO(collection_file.read()),
+                                                                       Collection()))
+            self.assertEqual(load_many_problems(io.BytesIO(zfile.read(names[1])), Collection()), [])
+
+    def test_views(self):
+        """Only staff can export collections, from the view or the admin"""
+        collection = create_collection('Exportar')
+        create_problems(collection)
+        create_collection('Otra')
+        client = Client()
+        user = get_user_model().objects.create_user('pepe', password='5555')
+        client.force_login(user)
+        response = client.get(reverse('judge:export_collection', args=[collection.pk]))
+        self.assertEqual(response.status_code, 302)  # Redirected to the login of the admin
+
+        user.is_staff, user.is_superuser = True, True
+        user.save()
+        response = client.get(reverse('judge:export_collection', args=[collection.pk]))
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Disposition'], f'attachment; filename={collection.pk}_exportar.zip')
+        self.assertEqual(len(load_many_problems(io.BytesIO(b''.join(response.streaming_content)), Collection())), 6)
+        self.assertEqual(client.get(reverse('judge:export_collection', args=[999999])).status_code, 404)
+
+        response = client.get(reverse('judge:export_collections'))
+        with ZipFile(io.BytesIO(b''.join(response.streaming_content))) as zfile:
+            self.assertEqual(len(zfile.namelist()), 2)
+
+        response = client.post(reverse('admin:judge_collection_changelist'),
+                               {'action': 'export', '_selected_action': [collection.pk]})
+        self.assertEqual(len(load_many_problems(io.BytesIO(b''.join(response.streaming_content)), Collection())), 6)
@@ -272,3 +272,36 @@ class HintTest(TestCase):
 
         for problem in [select_description, select_sub, select_sub2, select_description2]:
             self.assertRaises(ValidationError, problem.clean)
+
+    def test_hint_queries(self):
+        """Hints store their HTML when saved, and the hints available are computed in a single query"""
+        client = Client()
+        user = create_user('2222', 'tamara')
+        problem = SelectProblem.objects.create(title_md='Uno', title_html='Uno', text_html='Texto', solution='SELECT 1',
+                                               collection=create_collection('Colección'))
+        create_hint(problem, 1, 0)
+        hint2 = Hint.objects.create(text_md='Usa **GROUP BY**', problem=problem, num_submit=2)
+        self.assertEqual(hint2.get_text_html(), 'Usa <strong>GROUP BY</strong>')
+        hint_url = reverse('judge:hint', args=[problem.pk])
+        client.login(username='tamara', password='2222')
+        client.get(reverse('judge:collections'))  # Loads the session and the user
+
+        response = client.post(hint_url)
+        self.assertIn('descripcion de la pista 1', response.json()['hint'])
+        self.assertTrue(response.json()['more_hints'])
+        with self.assertNumQueries(3):  # Session, user and hints
+            response = client.post(hint_url)
+        self.assertEqual(response.json()['hint'], '')
+        self.assertIn('2', response.json()['msg'])
+
+        create_submission(problem, user, VeredictCode.WA, 'select *** from')
+        create_submission(problem, user, VeredictCode.WA, 'select *** from')
+        response = client.post(hint_url)
+        self.assertIn('Usa <strong>GROUP BY</strong>', response.json()['hint'])
+        self.assertFalse(response.json()['more_hints'])
+        response = client.post(hint_url)
+        self.assertEqual((response.json()['hint'], response.json()['more_hints']), ('', False))
+        self.assertEqual(UsedHint.objects.filter(user=user).count(), 2)
+
+        self.assertContains(client.get(reverse('judge:hints')), 'Usa <strong>GROUP BY</strong>')
+        self.assertEqual(client.post(reverse('judge:hint', args=[problem.pk + 1])).status_code, 404)
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright Enrique Martín <emartinm@ucm.es> 2021
+
+Unit tests for the load test of the judge, using the stub executor (no Oracle needed)
+"""
+from io import StringIO
+
+import django.contrib.auth
+from django.core.management import call_command
+from django.test import TransactionTestCase
+
+from judge.loadtest import LoadTest, StubExecutor, USER_PREFIX
+from judge.models import SelectProblem, FunctionProblem, DiscriminantProblem, Submission
+from judge.oracle_driver import OracleExecutor
+from judge.tests.test_views import create_collection, create_user, create_submission
+from judge.types import ProblemType, VeredictCode
+
+
+class LoadTestTest(TransactionTestCase):
+    """Tests for judge.loadtest. Students run in threads with their own DB connections, so the data must be
+    committed (TransactionTestCase)"""
+
+    def setUp(self):
+        """Problems with their expected results stored directly, without executing them in Oracle"""
+        self.collection = create_collection('Carga')
+        self.select = SelectProblem(title_md='Select', title_html='Select', text_md='texto',
+                                    create_sql='CREATE TABLE t (n NUMBER);', insert_sql='INSERT INTO t VALUES (1);',
+                                    collection=self.collection,
+                                    solution='SELECT * FROM t', initial_db=[None],
+                                    expected_result=[{'header': [['N', 'NUMBER']], 'rows': [[1]]}])
+        self.select.save()
+        self.function = FunctionProblem(title_md='Function', title_html='Function', text_md='texto',
+                                        create_sql='CREATE TABLE f (n NUMBER);', insert_sql='',
+                                        collection=self.collection,
+                                        solution='CREATE OR REPLACE FUNCTION uno RETURN NUMBER IS BEGIN RETURN 1; END;',
+                                        calls='uno()', expected_result=[{'uno()': 1}])
+        self.function.save()
+        self.disc = DiscriminantProblem(title_md='Disc', title_html='Disc', text_md='texto',
+                                        create_sql='CREATE TABLE d (n NUMBER);', insert_sql='',
+                                        collection=self.collection, correct_query='SELECT * FROM d',
+                                        incorrect_query='SELECT * FROM d WHERE n > 0')
+        self.disc.save()
+        create_submission(self.disc, create_user('1234', 'alumno'), VeredictCode.AC, 'INSERT INTO d VALUES (0)')
+        create_submission(self.disc, create_user('1234', 'alumno2'), VeredictCode.WA, 'INSERT INTO d VALUES (1)')
+
+    def test_stub_executor(self):
+        """The stub accepts solutions and previously accepted codes of the same problem"""
+        stub = StubExecutor([self.select, self.function, self.disc], delay=0)
+        self.assertEqual(self.select.judge('SELECT * FROM t  ', stub)[0], VeredictCode.AC)
+        self.assertEqual(self.select.judge('SELECT 1 FROM dual', stub)[0], VeredictCode.WA)
+        self.assertEqual(self.function.judge(self.function.solution, stub)[0], VeredictCode.AC)
+        self.assertEqual(self.function.judge('CREATE FUNCTION otra', stub)[0], VeredictCode.WA)
+        self.assertEqual(self.disc.judge('INSERT INTO d VALUES (0)', stub)[0], VeredictCode.AC)
+        self.assertEqual(self.disc.judge('INSERT INTO d VALUES (1)', stub)[0], VeredictCode.WA)
+        self.assertEqual(stub.connection_pool.busy, 0)
+
+    def test_load_test(self):
+        """Synthetic students submit concurrently and the report aggregates their verdicts"""
+        problems = [self.select, self.function, self.disc]
+        stub = StubExecutor(problems, delay=0.01, pool_size=2)
+        previous = OracleExecutor.override(stub)
+        try:
+            test = LoadTest(problems, stub, students=4, submissions=3, seed=7,
+                            mix={ProblemType.SELECT: 1, ProblemType.FUNCTION: 1, ProblemType.DISC: 1,
+                                 ProblemType.DML: 1})
+            report = test.run()
+        finally:
+            OracleExecutor.override(previous)
+        self.assertEqual(report['submissions'], 12)
+        self.assertEqual(sum(report['verdicts'].values()), 12)
+        self.assertEqual(set(report['verdicts']) - {VeredictCode.AC, VeredictCode.WA}, set())
+        self.assertEqual(report['ie_rate'], 0)
+        self.assertLessEqual(report['pool_max_busy'], 2)
+        self.assertGreater(report['throughput'], 0)
+        self.assertLessEqual(report['p50'], report['p99'])
+        self.assertEqual(Submission.objects.filter(user__username__startswith=USER_PREFIX).count(), 12)
+
+        LoadTest.remove_users()
+        self.assertFalse(django.contrib.auth.get_user_model().objects.filter(
+            username__startswith=USER_PREFIX).exists())
+
+        # No DML problems in the mix
+        with self.assertRaises(ValueError):
+            LoadTest(problems, stub, mix={ProblemType.DML: 1})
+
+    def test_command(self):
+        """The command prints the report and removes the synthetic students"""
+        out = StringIO()
+        call_command('loadtest', '--stub', '--stub-delay', '0', '--students', '2', '--submissions', '2',
+                     '--collection', str(self.collection.pk), '--mix', 'select=1,function=1', '--seed', '1',
+                     stdout=out)
+        self.assertIn('Submissions: 4', out.getvalue())
+        self.assertIn('Pool: size 10', out.getvalue())
+        self.assertFalse(django.contrib.auth.get_user_model().objects.filter(
+            username__startswith=USER_PREFIX).exists())
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright Enrique Martín <emartinm@ucm.es> 2021
+
+Unit tests for the metrics of the judge
+"""
+import os
+
+from django.test import TestCase, Client
+from django.urls import reverse
+
+from judge.metrics import StageMetrics, STAGE_METRICS, percentiles, collect_timings, current_timings, \
+    record_current, record_current_rows
+from judge.tests.test_views import create_user, create_superuser
+from judge.types import OracleStatusCode, ProblemType
+
+
+class MetricsTest(TestCase):
+    """Tests for judge.metrics"""
+
+    def test_percentiles(self):
+        """Quantiles of the durations"""
+        self.assertEqual(percentiles([3.0], (0.5, 0.99)), [3.0, 3.0])
+        values = list(range(1, 102))  # 1..101
+        self.assertEqual(percentiles(values, (0.5, 0.95, 0.99)), [51, 96, 100])
+
+    def test_stage_metrics(self):
+        """Durations are aggregated by stage and problem type, keeping only the last 'window' for quantiles"""
+        metrics = StageMetrics(window=10)
+        for i in range(20):
+            metrics.record(OracleStatusCode.EXECUTE_USER_CODE, ProblemType.SELECT, i)
+        metrics.record(OracleStatusCode.DROP_USER, ProblemType.SELECT, 0.5)
+        metrics.record(OracleStatusCode.EXECUTE_USER_CODE, ProblemType.DML, 2)
+
+        summary = metrics.summary()
+        self.assertEqual([(entry['problem_type'], entry['stage']) for entry in summary],
+                         [('SELECT', 'EXECUTE_USER_CODE'), ('SELECT', 'DROP_USER'), ('DML', 'EXECUTE_USER_CODE')])
+        self.assertEqual(summary[0]['count'], 20)
+        self.assertEqual(summary[0]['sum'], sum(range(20)))
+        self.assertGreaterEqual(summary[0]['p50'], 10)  # Only the last 10 durations
+        self.assertEqual(summary[1]['p99'], 0.5)
+
+        text = metrics.prometheus()
+        self.assertIn('# TYPE lsql_judge_stage_seconds summary', text)
+        self.assertIn('lsql_judge_stage_seconds{stage="DROP_USER",problem_type="SELECT",quantile="0.95"} 0.5', text)
+        self.assertIn('lsql_judge_stage_seconds_count{stage="EXECUTE_USER_CODE",problem_type="DML"} 1', text)
+
+        metrics.reset()
+        self.assertEqual(metrics.summary(), [])
+
+    def test_collect_timings(self):
+        """Stages executed in the current thread are added to the timings of the submission"""
+        record_current(OracleStatusCode.EXECUTE_USER_CODE, ProblemType.SELECT, 1.0)  # Ignored, nothing collected
+        with collect_timings() as timings:
+            self.assertIs(current_timings(), timings)
+            for _ in range(2):  # Two sandboxes, as in SELECT problems with several databases
+                record_current(OracleStatusCode.GET_ADMIN_CONNECTION, ProblemType.SELECT, 0.25)
+                record_current(OracleStatusCode.EXECUTE_USER_CODE, ProblemType.SELECT, 0.5)
+                record_current(OracleStatusCode.DROP_USER, ProblemType.SELECT, 2.0)
+            record_current_rows(3)
+            record_current_rows(7)
+        self.assertIsNone(current_timings())
+        self.assertEqual(timings.queue_time, 0.5)
+        self.assertEqual(timings.execution_time, 1.0)
+        self.assertEqual(timings.num_rows, 7)
+        self.assertIsNotNone(timings.judge_time)
+
+    def test_metrics_views(self):
+        """Metrics are only available for staff users or with the token"""
+        client = Client()
+        json_url = reverse('judge:judge_metrics')
+        prometheus_url = reverse('judge:judge_metrics_prometheus')
+        STAGE_METRICS.record(OracleStatusCode.CREATE_USER, ProblemType.TRIGGER, 0.25)
+
+        create_user('5555', 'pepe')
+        client.login(username='pepe', password='5555')
+        self.assertEqual(client.get(json_url).status_code, 302)  # Redirects to admin login
+        self.assertEqual(client.get(prometheus_url).status_code, 403)
+        client.logout()
+
+        os.environ['METRICS_TOKEN'] = 'secret'
+        try:
+            response = client.get(prometheus_url, HTTP_AUTHORIZATION='Bearer secret')
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('stage="CREATE_USER",problem_type="TRIGGER"', response.content.decode('utf-8'))
+            self.assertEqual(client.get(prometheus_url, HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+        finally:
+            del os.environ['METRICS_TOKEN']
+
+        create_superuser('0000', username='staff')
+        client.login(username='staff', password='0000')
+        stages = client.get(json_url).json()['stages']
+        self.assertIn({'stage': 'CREATE_USER', 'problem_type': 'TRIGGER'},
+                      [{'stage': entry['stage'], 'problem_type': entry['problem_type']} for entry in stages])
+        self.assertEqual(client.get(prometheus_url).status_code, 200)
@@ -368,3 +368,19 @@ class ModelsTest(TestCase):
     def test_default_json_lang(self):
         """" Test that the default value for JSON texts in different languages """
         self.assertDictEqual(default_json_lang(), {settings.LANGUAGE_CODE: ""})
+
+    def test_listing(self):
+        """Listing problems defers the large fields, also in the subclasses, that are loaded when accessed"""
+        collection = Collection.objects.create(name_md='ABC', description_md='blablabla')
+        SelectProblem.objects.create(title_md='Uno', title_html='Uno', text_html='Texto', collection=collection,
+                                     create_sql='CREATE TABLE t (n NUMBER);', solution='SELECT * FROM t',
+                                     initial_db=[{'T': {}}], expected_result=[{'rows': []}])
+        problem = collection.problems()[0]
+        self.assertTrue({'text_html', 'create_sql', 'initial_db'} <= problem.get_deferred_fields())
+        self.assertEqual(problem.title_html, 'Uno')
+
+        problem = Problem.objects.select_subclasses().listing().get(collection=collection)
+        self.assertIsInstance(problem, SelectProblem)
+        self.assertTrue({'text_html', 'solution', 'expected_result'} <= problem.get_deferred_fields())
+        self.assertEqual(problem.expected_result, [{'rows': []}])
+        self.assertNotIn('expected_result', problem.get_deferred_fields())
@@ -6,14 +6,23 @@ Unit tests for the connection and execution of statements using the Oracle DB
 """
 import os
 import time
+from io import StringIO
+from unittest import mock
 
+import cx_Oracle
+
+from django.core.management import call_command
 from django.test import TestCase
 
-from judge.oracle_driver import OracleExecutor, clean_sql, line_col_from_offset
+from judge.oracle_driver import OracleExecutor, clean_sql, line_col_from_offset, group_insert_statements, \
+    insert_block, build_dsn_tns, execution_limits, OracleSandbox
 from judge.models import SelectProblem, Collection, DMLProblem, FunctionProblem, ProcProblem, TriggerProblem, \
     DiscriminantProblem
-from judge.types import VeredictCode, OracleStatusCode
+from judge.types import VeredictCode, OracleStatusCode, ProblemType
 from judge.exceptions import ExecutorException
+from judge.reaper import DanglingUserReaper
+from judge.resource_plan import drop_resource_plan
+from judge.teardown import DeferredTeardown
 
 SELECT_TLE = '''
         SELECT a, AVG(b), MAX(b), AVG(c), AVG(d)
@@ -64,6 +73,48 @@ class OracleTest(TestCase):
                 # Every extended statement must have the same length as the original complete code
                 self.assertEqual(len(code), len(stmt))
 
+    def test_group_insert_statements(self):
+        """Consecutive INSERT ... VALUES statements are grouped in batches, keeping the rest of statements alone"""
+        code = """INSERT INTO t VALUES (1);
+                  insert into "Other T" values('a;b');
+                  UPDATE t SET a = 2;
+                  INSERT INTO t SELECT * FROM t;
+                  INSERT INTO t VALUES (3);
+                  INSERT INTO t(a) VALUES (4);
+                  INSERT INTO t VALUES (5);
+                  DELETE FROM t;
+                  INSERT INTO t VALUES (6);"""
+        statements = clean_sql(code)
+        groups = group_insert_statements(statements, block_size=2)
+        self.assertEqual([(is_batch, len(stmts)) for is_batch, stmts in groups],
+                         [(True, 2), (False, 1), (False, 1), (True, 2), (False, 1), (False, 1), (False, 1)])
+        # Statements are not lost or reordered
+        self.assertEqual([stmt for _, stmts in groups for stmt in stmts], statements)
+
+        block = insert_block(groups[0][1])
+        self.assertTrue(block.startswith('BEGIN\nINSERT INTO t VALUES (1);\n'))
+        self.assertTrue(block.endswith("""insert into "Other T" values('a;b');\nEND;"""))
+        self.assertEqual(group_insert_statements([]), [])
+
+    def test_insert_blocks(self):
+        """Data is loaded in blocks and errors inside a block are reported for the right statement"""
+        collection = Collection()
+        collection.save()
+        create = 'CREATE TABLE test (n NUMBER PRIMARY KEY, txt VARCHAR2(10));'
+        insert = '\n'.join(f"INSERT INTO test VALUES ({i}, 'row {i}');" for i in range(500))
+        solution = 'SELECT COUNT(*) AS num, MAX(n) AS max_n FROM test'
+        problem = SelectProblem(title_md='Blocks', text_md='Loads many rows', create_sql=create, insert_sql=insert,
+                                collection=collection, solution=solution)
+        problem.clean()
+        self.assertEqual(problem.expected_result[0]['rows'], [[500, 499]])
+
+        oracle = OracleExecutor.get()
+        duplicated = insert + "\nINSERT INTO test VALUES (7, 'duplicated');"
+        with self.assertRaises(ExecutorException) as ctx:
+            oracle.execute_select_test(create, duplicated, solution)
+        self.assertEqual(ctx.exception.error_code, OracleStatusCode.EXECUTE_INSERT)
+        self.assertIn('ORA-00001', ctx.exception.message)
+
     def test_select(self):
         """Tests for SelectProblem.judge()"""
         collection = Collection()
@@ -622,6 +673,231 @@ class OracleTest(TestCase):
         after = oracle.get_number_dangling_users(age_seconds=1)
         self.assertGreater(before, after)  # There are less dangling users (we cannot assure all have dissapear )
 
+    def test_reaper(self):
+        """The reaper removes dangling users in parallel and reports the backlog"""
+        oracle = OracleExecutor.get()
+        gestor = oracle.connection_pool.acquire()
+        users = [oracle.create_user(gestor) for _ in range(3)]
+        oracle.create_connection(*users[0])  # Connection never closed
+        oracle.connection_pool.release(gestor)
+        time.sleep(2)
+
+        reaper = DanglingUserReaper(oracle, age_seconds=1, workers=3)
+        reaper.failures['LSQL_GONE'] = (1, time.time() + 3600)  # User that does not exist anymore
+        dropped, failed = reaper.reap()
+        names = [name.upper() for name, _ in users]
+        self.assertTrue(all(name in dropped + failed for name in names))
+        self.assertIn(names[1], dropped)  # Users without connections are always dropped
+        self.assertIn(names[2], dropped)
+        self.assertEqual(set(reaper.failures), set(failed))  # The failure of LSQL_GONE is forgotten
+        self.assertGreaterEqual(reaper.backlog, len(failed))
+
+        # Management command running only one round
+        out = StringIO()
+        call_command('reap_dangling_users', age=1, stdout=out)
+        self.assertIn('dangling users remaining', out.getvalue())
+
+    def test_pooled_dsn(self):
+        """The DSN for DRCP asks for a pooled server"""
+        self.assertNotIn('(SERVER=POOLED)', build_dsn_tns())
+        self.assertIn('(CONNECT_DATA=(SERVER=POOLED)', build_dsn_tns(pooled=True))
+
+    def test_sandbox_connection_modes(self):
+        """Sandbox users can be connected directly, using DRCP or through proxy sessions"""
+        create = 'CREATE TABLE test (n NUMBER);'
+        insert = 'INSERT INTO test VALUES (1); INSERT INTO test VALUES (2);'
+        old_mode = os.environ.get('ORACLE_SANDBOX_CONNECTION')
+        try:
+            for mode in [OracleExecutor.SANDBOX_DIRECT, OracleExecutor.SANDBOX_PROXY, 'unknown']:
+                os.environ['ORACLE_SANDBOX_CONNECTION'] = mode
+                oracle = OracleExecutor()
+                self.addCleanup(oracle.close)
+                res = oracle.execute_select_test(create, insert, 'SELECT SUM(n) AS total FROM test', output_db=True)
+                self.assertEqual(res['result']['rows'], [[3]])
+                self.assertEqual(res['db']['TEST']['rows'], [[1], [2]])
+            self.assertEqual(oracle.sandbox_mode, OracleExecutor.SANDBOX_DIRECT)  # Unknown mode falls back to direct
+        finally:
+            if old_mode is None:
+                del os.environ['ORACLE_SANDBOX_CONNECTION']
+            else:
+                os.environ['ORACLE_SANDBOX_CONNECTION'] = old_mode
+
+    def test_deferred_teardown(self):
+        """Sandbox users are dropped in the background when ORACLE_ASYNC_DROP_QUEUE is defined"""
+        create = 'CREATE TABLE test (n NUMBER);'
+        insert = 'INSERT INTO test VALUES (1); INSERT INTO test VALUES (2);'
+        os.environ['ORACLE_ASYNC_DROP_QUEUE'] = '10'
+        try:
+            oracle = OracleExecutor()
+        finally:
+            del os.environ['ORACLE_ASYNC_DROP_QUEUE']
+        self.addCleanup(oracle.close)  # Stops the thread of oracle.teardown
+        users_before = oracle.get_number_dangling_users(age_seconds=0)
+        for _ in range(3):
+            res = oracle.execute_select_test(create, insert, 'SELECT SUM(n) AS total FROM test')
+            self.assertEqual(res['result']['rows'], [[3]])
+        oracle.teardown.wait()
+        self.assertEqual(oracle.get_number_dangling_users(age_seconds=0), users_before)
+
+        # When the queue is full users must be dropped synchronously (the thread is not started)
+        teardown = DeferredTeardown(oracle, maxsize=2)
+        self.assertTrue(teardown.submit('LSQL_A'))
+        self.assertTrue(teardown.submit('LSQL_B'))
+        self.assertFalse(teardown.submit('LSQL_C'))
+        self.assertEqual(teardown.next_batch(), ['LSQL_A', 'LSQL_B'])
+
+    def test_teardown_stop(self):
+        """The thread of DeferredTeardown drops the enqueued users before finishing"""
+        executor = mock.MagicMock()
+        teardown = DeferredTeardown(executor)
+        teardown.start()
+        self.assertTrue(teardown.submit('LSQL_A'))
+        teardown.stop(timeout=5)
+        self.assertFalse(teardown.is_alive())
+        executor.drop_user.assert_called_once_with('LSQL_A', executor.connection_pool.acquire.return_value)
+
+    def test_sandbox_stages(self):
+        """Stage hooks receive the duration of every stage, and errors are reported with the stage that failed"""
+        oracle = OracleExecutor()
+        self.addCleanup(oracle.close)
+        stages = []
+        oracle.add_stage_hook(lambda state, problem_type, seconds: stages.append((state, problem_type, seconds)))
+        create = 'CREATE TABLE test (n NUMBER);'
+        insert = 'INSERT INTO test VALUES (1);'
+        oracle.execute_dml_test(create, insert, 'INSERT INTO test VALUES (2);', pre_db=True)
+        executed = [state for state, _, _ in stages]
+        self.assertEqual(executed, [OracleStatusCode.GET_ADMIN_CONNECTION, OracleStatusCode.CREATE_USER,
+                                    OracleStatusCode.GET_USER_CONNECTION, OracleStatusCode.EXECUTE_CREATE,
+                                    OracleStatusCode.EXECUTE_INSERT, OracleStatusCode.GET_ALL_TABLES,
+                                    OracleStatusCode.EXECUTE_USER_CODE, OracleStatusCode.GET_ALL_TABLES,
+                                    OracleStatusCode.CLOSE_USER_CONNECTION, OracleStatusCode.DROP_USER,
+                                    OracleStatusCode.RELEASE_ADMIN_CONNECTION])
+        self.assertTrue(all(problem_type == ProblemType.DML and seconds >= 0 for _, problem_type, seconds in stages))
+
+        # The sandbox is released even if some stage fails
+        users_before = oracle.get_number_dangling_users(age_seconds=0)
+        with self.assertRaises(cx_Oracle.DatabaseError):
+            with oracle.sandbox(ProblemType.SELECT) as sandbox:
+                sandbox.load(create, 'INSERT INTO test VALUES (1, 2);')
+        self.assertEqual(sandbox.state, OracleStatusCode.EXECUTE_INSERT)
+        self.assertIn(OracleStatusCode.EXECUTE_CREATE, sandbox.timings)
+        self.assertEqual(oracle.get_number_dangling_users(age_seconds=0), users_before)
+
+    def test_sandbox_provision_error(self):
+        """If the user cannot be created or connected, the admin connection is released and the user dropped"""
+        executor = mock.Mock(stage_hooks=[])
+        executor.create_user.side_effect = cx_Oracle.DatabaseError('ORA-01920')
+        with self.assertRaises(cx_Oracle.DatabaseError):
+            with OracleSandbox(executor, ProblemType.SELECT):
+                pass  # pragma: no cover
+        gestor = executor.connection_pool.acquire.return_value
+        executor.connection_pool.release.assert_called_once_with(gestor)
+        executor.release_user.assert_not_called()
+
+        executor = mock.Mock(stage_hooks=[])
+        executor.create_user.return_value = ('LSQL_A', 'passwd')
+        executor.create_connection.side_effect = cx_Oracle.DatabaseError('ORA-01017')
+        sandbox = OracleSandbox(executor, ProblemType.SELECT)
+        with self.assertRaises(cx_Oracle.DatabaseError):
+            with sandbox:
+                pass  # pragma: no cover
+        gestor = executor.connection_pool.acquire.return_value
+        executor.release_user.assert_called_once_with('LSQL_A', gestor)
+        executor.connection_pool.release.assert_called_once_with(gestor)
+        self.assertEqual(sandbox.state, OracleStatusCode.GET_USER_CONNECTION)
+
+    def test_remove_dangling_user_backoff(self):
+        """The connection is released before waiting for the next attempt to drop the user"""
+        oracle = OracleExecutor.__new__(OracleExecutor)  # Without pool to the Oracle DB
+        oracle.connection_pool = mock.MagicMock()
+        with mock.patch.object(oracle, 'drop_user', side_effect=[cx_Oracle.DatabaseError('ORA-01940'), None]), \
+                mock.patch('judge.oracle_driver.time.sleep') as sleep:
+            sleep.side_effect = lambda _: self.assertEqual(oracle.connection_pool.release.call_count,
+                                                           oracle.connection_pool.acquire.call_count)
+            self.assertTrue(oracle.remove_dangling_user('LSQL_A', backoff=0.1))
+        sleep.assert_called_once_with(0.1)
+        self.assertEqual(oracle.connection_pool.acquire.call_count, 2)
+        self.assertEqual(oracle.connection_pool.release.call_count, 2)
+
+    def test_ping(self):
+        """Health checks use their own connection, so a busy admin pool is not taken as a failure"""
+        oracle = OracleExecutor.__new__(OracleExecutor)  # Without pool to the Oracle DB
+        oracle.connection_pool = mock.MagicMock()
+        oracle.connection_pool.acquire.side_effect = cx_Oracle.DatabaseError('ORA-24457')
+        oracle.dsn_tns = 'localhost/xe'
+        with mock.patch.dict('os.environ', {'ORACLE_USER': 'admin', 'ORACLE_PASS': 'admin'}), \
+                mock.patch('judge.oracle_driver.cx_Oracle.connect') as connect:
+            oracle.ping()
+        connect.return_value.__enter__.return_value.cursor.assert_called_once_with()
+        oracle.connection_pool.acquire.assert_not_called()
+
+    def test_reaper_failures(self):
+        """The reaper backs off failed users and forgets those that do not exist anymore"""
+        executor = mock.Mock()
+        executor.remove_dangling_users.return_value = (['LSQL_A'], ['LSQL_B'])
+        executor.get_dangling_users.return_value = ['LSQL_B', 'LSQL_C']
+        reaper = DanglingUserReaper(executor, interval=10)
+        reaper.failures['LSQL_C'] = (1, time.time() + 3600)
+        reaper.failures['LSQL_GONE'] = (1, time.time() + 3600)
+        reaper.reap()
+        self.assertEqual(executor.remove_dangling_users.call_args.kwargs['exclude'], {'LSQL_C', 'LSQL_GONE'})
+        self.assertEqual(set(reaper.failures), {'LSQL_B', 'LSQL_C'})
+        self.assertEqual(reaper.failures['LSQL_B'][0], 1)
+        self.assertEqual(reaper.backlog, 2)
+
+    def test_problem_limits(self):
+        """Limits of a problem replace the global limits"""
+        oracle = OracleExecutor.get()
+        create = 'CREATE TABLE test (n NUMBER);'
+        insert = 'INSERT INTO test VALUES (1); INSERT INTO test VALUES (2); INSERT INTO test VALUES (3);'
+        select = 'SELECT * FROM test'
+        self.assertEqual(len(oracle.execute_select_test(create, insert, select)['result']['rows']), 3)
+        with self.assertRaises(ExecutorException) as ctxt:
+            oracle.execute_select_test(create, insert, select, limits=execution_limits(max_rows=2))
+        self.assertEqual(ctxt.exception.error_code, OracleStatusCode.TLE_USER_CODE)
+        with self.assertRaises(ExecutorException) as ctxt:
+            oracle.execute_dml_test(create, insert, 'CREATE TABLE other (n NUMBER);', pre_db=False,
+                                    limits=execution_limits(max_tables=1))
+        self.assertEqual(ctxt.exception.error_code, OracleStatusCode.TLE_USER_CODE)
+        with self.assertRaises(ExecutorException) as ctxt:
+            oracle.execute_select_test(create, insert, SELECT_TLE, limits=execution_limits(stmt_timeout_ms=10))
+        self.assertEqual(ctxt.exception.error_code, OracleStatusCode.TLE_USER_CODE)
+
+    def test_resource_plan(self):
+        """Sandbox users are assigned to the consumer group of the resource plan"""
+        out = StringIO()
+        call_command('setup_resource_plan', group='LSQL_TEST_GROUP', cpu_limit=40, cancel_after=30, stdout=out)
+        self.assertIn('LSQL_TEST_GROUP', out.getvalue())
+        oracle = OracleExecutor.get()
+        gestor = oracle.connection_pool.acquire()
+        os.environ['ORACLE_CONSUMER_GROUP'] = 'lsql_test_group'
+        try:
+            user, _ = oracle.create_user(gestor)
+            with gestor.cursor() as cursor:
+                cursor.execute('SELECT initial_rsrc_consumer_group FROM dba_users WHERE username = :username',
+                               username=user.upper())
+                self.assertEqual(cursor.fetchone()[0], 'LSQL_TEST_GROUP')
+            oracle.drop_user(user, gestor)
+        finally:
+            del os.environ['ORACLE_CONSUMER_GROUP']
+            oracle.connection_pool.release(gestor)
+            call_command('setup_resource_plan', drop=True, stdout=out)
+        self.assertIn('Removed resource plan', out.getvalue())
+
+    def test_drop_resource_plan(self):
+        """The active plan is cleared only if it is the plan removed"""
+        conn = mock.MagicMock()
+        cursor = conn.cursor.return_value.__enter__.return_value
+        cursor.fetchone.return_value = ('FORCE:DEFAULT_PLAN',)
+        drop_resource_plan(conn, 'lsql_plan')
+        self.assertNotIn(mock.call("ALTER SYSTEM SET RESOURCE_MANAGER_PLAN = ''"), cursor.execute.call_args_list)
+        self.assertEqual(cursor.execute.call_args.kwargs, {'plan': 'LSQL_PLAN'})
+
+        cursor.reset_mock()
+        cursor.fetchone.return_value = ('FORCE:LSQL_PLAN',)
+        drop_resource_plan(conn, 'lsql_plan')
+        self.assertIn(mock.call("ALTER SYSTEM SET RESOURCE_MANAGER_PLAN = ''"), cursor.execute.call_args_list)
+
     def test_pos_from_offset(self):
         """Test the extraction of line-col from offset"""
         code = """SELECT cif, sede
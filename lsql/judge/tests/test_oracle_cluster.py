@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright Enrique Martín <emartinm@ucm.es> 2021
+
+Unit tests for the routing of submissions among several Oracle instances, using stub executors as instances
+"""
+from unittest import mock
+
+from django.test import TestCase
+
+from judge.exceptions import ExecutorException
+from judge.loadtest import StubExecutor
+from judge.oracle_cluster import DEFAULT_HEALTH_INTERVAL_S, OracleClusterExecutor, OracleNode, parse_instances
+from judge.types import OracleStatusCode
+
+
+class InstanceStub(StubExecutor):
+    """Stub executor of an instance that can be down or fail in the code of the user"""
+
+    def __init__(self):
+        super().__init__([], delay=0, pool_size=4)
+        self.stage_hooks = []
+        self.error = None  # OracleStatusCode raised by the executions and the health checks
+        self.calls = 0
+
+    def add_stage_hook(self, hook):
+        """Same interface as OracleExecutor.add_stage_hook"""
+        self.stage_hooks.append(hook)
+
+    def ping(self):
+        """Same interface as OracleExecutor.ping"""
+        if self.error is not None:
+            raise ExecutorException(self.error, 'down')
+
+    def execute_select_test(self, creation, insertion, select, output_db=False, limits=None):
+        self.calls += 1
+        self.ping()
+        return super().execute_select_test(creation, insertion, select, output_db, limits)
+
+
+class OracleClusterTest(TestCase):
+    """Tests for judge.oracle_cluster"""
+
+    def test_parse_instances(self):
+        """Instances are SERVER:PORT/SID separated by commas"""
+        self.assertEqual(parse_instances('localhost:1521/xe, 10.0.0.2:1522/XEPDB1,'),
+                         [('localhost', 1521, 'xe'), ('10.0.0.2', 1522, 'XEPDB1')])
+        with self.assertRaises(ValueError):
+            parse_instances('localhost/xe')
+
+    def test_routing(self):
+        """Submissions go to the instance with less work, failing instances are drained and recover"""
+        first, second = InstanceStub(), InstanceStub()
+        cluster = OracleClusterExecutor([OracleNode('first', lambda: first), OracleNode('second', lambda: second)],
+                                        max_failures=1)
+        cluster.add_stage_hook(print)
+        self.assertEqual(first.stage_hooks, [print])
+        self.assertEqual(cluster.connection_pool, (0, 8))
+        node_first, node_second = cluster.nodes
+
+        # Least outstanding work
+        node_first.outstanding = 1
+        self.assertIs(cluster.choose(), node_second)
+        node_first.outstanding, node_second.outstanding = 0, 0
+
+        # The first instance is down: the submission is retried in the second one and the first one is drained
+        first.error = OracleStatusCode.GET_ADMIN_CONNECTION
+        node_second.outstanding = 1
+        cluster.execute_select_test('', '', 'SELECT 1 FROM dual')
+        self.assertEqual((first.calls, second.calls), (1, 1))
+        self.assertFalse(node_first.healthy)
+        node_second.outstanding = 0
+        for _ in range(3):
+            cluster.execute_select_test('', '', 'SELECT 1 FROM dual')
+        self.assertEqual((first.calls, second.calls), (1, 4))
+        self.assertEqual((node_first.outstanding, node_second.outstanding), (0, 0))
+
+        # Errors in the code of the user are not retried
+        second.error = OracleStatusCode.EXECUTE_USER_CODE
+        with self.assertRaises(ExecutorException) as ctx:
+            cluster.execute_select_test('', '', 'SELECT 1 FROM dual')
+        self.assertEqual(ctx.exception.error_code, OracleStatusCode.EXECUTE_USER_CODE)
+        self.assertTrue(node_second.healthy)
+
+        # No instance available: the drained first instance is tried anyway, and its error is raised
+        second.error = OracleStatusCode.CREATE_USER
+        with self.assertRaises(ExecutorException) as ctx:
+            cluster.execute_select_test('', '', 'SELECT 1 FROM dual')
+        self.assertEqual(ctx.exception.error_code, OracleStatusCode.GET_ADMIN_CONNECTION)
+        self.assertEqual((first.calls, second.calls), (2, 6))
+        self.assertEqual(cluster.check_health(), [])
+
+        # Recovery and manual draining
+        first.error, second.error = None, None
+        self.assertEqual(cluster.check_health(), ['first', 'second'])
+        cluster.drain('first')
+        self.assertEqual(cluster.check_health(), ['second'])
+        self.assertIs(cluster.choose(), node_second)
+
+    def test_late_instance(self):
+        """An instance that is down when the process starts joins after a health check"""
+        instance, attempts = InstanceStub(), []
+
+        def factory():
+            attempts.append(1)
+            if len(attempts) == 1:
+                raise ExecutorException(OracleStatusCode.GET_ADMIN_CONNECTION, 'down')
+            return instance
+
+        cluster = OracleClusterExecutor([OracleNode('late', factory)])
+        with self.assertRaises(ExecutorException):
+            cluster.choose()
+        self.assertEqual(cluster.connection_pool, (0, 0))
+        self.assertEqual(cluster.check_health(), ['late'])
+        self.assertEqual(cluster.execute_select_test('', '', 'SELECT 1 FROM dual')['db'], None)
+
+    def test_no_healthy_instance(self):
+        """Without healthy instances, submissions go to the least loaded instance not drained by hand"""
+        first, second = InstanceStub(), InstanceStub()
+        cluster = OracleClusterExecutor([OracleNode('first', lambda: first), OracleNode('second', lambda: second)])
+        node_first, node_second = cluster.nodes
+        node_first.healthy, node_second.healthy = False, False
+        node_first.outstanding = 1
+        self.assertIs(cluster.choose(), node_second)
+        self.assertEqual(cluster.execute_select_test('', '', 'SELECT 1 FROM dual')['db'], None)
+        self.assertEqual((first.calls, second.calls), (0, 1))
+        cluster.drain('second')
+        self.assertIs(cluster.choose(), node_first)
+        cluster.drain('first')
+        with self.assertRaises(ExecutorException):
+            cluster.choose()
+
+    def test_health_checker(self):
+        """The health checker is always started, every DEFAULT_HEALTH_INTERVAL_S seconds by default"""
+        with mock.patch.dict('os.environ', {'ORACLE_INSTANCES': 'localhost:1521/xe'}), \
+                mock.patch('judge.oracle_cluster.OracleExecutor', return_value=InstanceStub()), \
+                mock.patch('judge.oracle_cluster.HealthChecker') as checker:
+            cluster = OracleClusterExecutor.create()
+        checker.assert_called_once_with(cluster, interval=DEFAULT_HEALTH_INTERVAL_S)
+        checker.return_value.start.assert_called_once_with()
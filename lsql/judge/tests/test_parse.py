@@ -12,8 +12,9 @@ from django.test import TestCase
 from django.core.exceptions import ValidationError
 
 from judge.models import Collection, Problem, SelectProblem, DMLProblem, FunctionProblem, \
-    ProcProblem, TriggerProblem, DiscriminantProblem
-from judge.parse import get_language_from_json
+    ProcProblem, TriggerProblem, DiscriminantProblem, load_problem_from_file, load_many_problems
+from judge.parse import get_language_from_json, get_limits_from_json, open_problem_zip, load_dml_problem, \
+    load_select_problem
 from judge.exceptions import ZipFileParsingException
 
 
@@ -153,6 +154,33 @@ class ParseTest(TestCase):
             files_in_zip = len(zfile.namelist())
         self.assertEqual(Problem.objects.filter(collection=collection).count(), files_in_zip)
 
+    def test_load_problem_type(self):
+        """The class of the problem is selected from the field "type" of the JSON file, without judging"""
+        curr_path = os.path.dirname(__file__)
+        expected = [(self.SELECT_OK, SelectProblem), (self.DML_OK, DMLProblem), (self.FUNCTION_OK, FunctionProblem),
+                    (self.PROC_OK, ProcProblem), (self.TRIGGER_OK, TriggerProblem),
+                    (self.DISCRIMINANT_OK, DiscriminantProblem)]
+        for filename, pclass in expected:
+            problem = load_problem_from_file(os.path.join(curr_path, self.ZIP_FOLDER, filename))
+            self.assertIs(type(problem), pclass)
+            self.assertTrue(problem.title_md and problem.text_md)
+
+        for filename in [self.NO_JSON, self.NO_TYPE]:
+            with self.assertRaises(ZipFileParsingException):
+                load_problem_from_file(os.path.join(curr_path, self.ZIP_FOLDER, filename))
+
+        # A ProblemZip already opened is reused and checked against the type of the problem
+        with open_problem_zip(os.path.join(curr_path, self.ZIP_FOLDER, self.DML_OK)) as pzip:
+            problem = DMLProblem()
+            load_dml_problem(problem, pzip)
+            self.assertEqual((problem.min_stmt, problem.max_stmt), (2, 2))
+            with self.assertRaises(ZipFileParsingException):
+                load_select_problem(SelectProblem(), pzip)
+
+        problems = load_many_problems(os.path.join(curr_path, self.ZIP_FOLDER, self.MANY_PROBLEMS_ZIP_NAME),
+                                      Collection(name_md='Colección'))
+        self.assertEqual(len(problems), 5)
+
     def test_zip_errors(self):
         """ValidationError when loading ZIP in all problem types"""
         curr_path = os.path.dirname(__file__)
@@ -203,3 +231,17 @@ class ParseTest(TestCase):
         self.assertEqual(get_language_from_json({'language': 'en'}), 'en')
         with self.assertRaises(ZipFileParsingException):
             get_language_from_json({'language': 'ru'})
+
+    def test_limits_json(self):
+        """ Tests that execution limits are optional in the problem JSON and must be positive integers """
+        problem = SelectProblem()
+        get_limits_from_json(problem, {'stmt_timeout_ms': 10000, 'max_rows': '5000'})
+        self.assertEqual((problem.stmt_timeout_ms, problem.max_rows, problem.max_tables), (10000, 5000, None))
+        self.assertEqual(problem.limits().stmt_timeout_ms, 10000)
+        self.assertEqual(problem.limits().max_rows, 5000)
+        self.assertEqual(problem.limits().max_tables, int(os.environ['ORACLE_MAX_TABLES']))
+        get_limits_from_json(problem, {})
+        self.assertEqual(problem.limits().stmt_timeout_ms, int(os.environ['ORACLE_STMT_TIMEOUT_MS']))
+        for value in [0, -5, 'many']:
+            with self.assertRaises(ZipFileParsingException):
+                get_limits_from_json(problem, {'max_tables': value})
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright Enrique Martín <emartinm@ucm.es> 2021
+
+Unit tests for the PostgreSQL executor. The sandboxes are created in the test database of Django
+"""
+import os
+from unittest import mock
+
+import psycopg2
+from django.db import connection
+from django.test import TestCase, Client
+from django.urls import reverse
+
+from judge.exceptions import ExecutorException
+from judge.models import SelectProblem, DMLProblem
+from judge.oracle_driver import execution_limits
+from judge.postgresql_driver import PostgreSQLExecutor
+from judge.tests.test_views import create_collection, create_user
+from judge.types import OracleStatusCode, VeredictCode
+
+
+class PostgreSQLTest(TestCase):
+    """Tests for judge.postgresql_driver"""
+
+    CREATE = 'CREATE TABLE club (cif CHAR(9) PRIMARY KEY, nombre VARCHAR(40), socios INTEGER);'
+    INSERT = "INSERT INTO club VALUES ('11111111X', 'Real Madrid', 10);\nINSERT INTO club VALUES ('2', NULL, 5);"
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        os.environ['JUDGE_PG_DB'] = connection.settings_dict['NAME']
+        cls.executor = PostgreSQLExecutor()
+
+    @classmethod
+    def tearDownClass(cls):
+        del os.environ['JUDGE_PG_DB']
+        cls.executor.connection_pool.pool.closeall()
+        super().tearDownClass()
+
+    def roles(self):
+        """Number of sandbox roles in the server"""
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT COUNT(*) FROM pg_roles WHERE rolname LIKE 'lsql\\_%'")
+            return cursor.fetchone()[0]
+
+    def test_executor(self):
+        """Results have the same format as in OracleExecutor and the roles are dropped"""
+        roles = self.roles()
+        result = self.executor.execute_select_test(self.CREATE, self.INSERT,
+                                                   'SELECT nombre, socios FROM club ORDER BY socios', output_db=True)
+        self.assertEqual(result['result'], {'header': [['NOMBRE', 'VARCHAR'], ['SOCIOS', 'INT4']],
+                                            'rows': [[None, 5], ['Real Madrid', 10]]})
+        self.assertEqual(list(result['db']), ['CLUB'])
+
+        result = self.executor.execute_dml_test(self.CREATE, self.INSERT, 'DELETE FROM club WHERE socios > 7; '
+                                                                          'CREATE TABLE nueva (n INTEGER);')
+        self.assertEqual(len(result['pre']['CLUB']['rows']), 2)
+        self.assertEqual(len(result['post']['CLUB']['rows']), 1)
+        self.assertIn('NUEVA', result['post'])
+
+        with self.assertRaises(ExecutorException) as ctx:
+            self.executor.execute_select_test(self.CREATE, self.INSERT, 'SELECT *\nFROM equipo')
+        self.assertEqual(ctx.exception.error_code, OracleStatusCode.EXECUTE_USER_CODE)
+        self.assertEqual(ctx.exception.position, (1, 5))
+        with self.assertRaises(ExecutorException) as ctx:
+            self.executor.execute_select_test(self.CREATE, self.INSERT, 'SELECT pg_sleep(5)',
+                                              limits=execution_limits(stmt_timeout_ms=200))
+        self.assertEqual(ctx.exception.error_code, OracleStatusCode.TLE_USER_CODE)
+        with self.assertRaises(ExecutorException) as ctx:  # Cancelled by the client
+            self.executor.execute_dml_test(self.CREATE, self.INSERT, 'SET statement_timeout = 0; SELECT pg_sleep(5)',
+                                           limits=execution_limits(stmt_timeout_ms=200))
+        self.assertEqual(ctx.exception.error_code, OracleStatusCode.TLE_USER_CODE)
+        with self.assertRaises(ExecutorException) as ctx:
+            self.executor.execute_select_test(self.CREATE, self.INSERT, 'SET statement_timeout = 0; SELECT 1')
+        self.assertEqual(ctx.exception.error_code, OracleStatusCode.NUMBER_STATEMENTS)
+        with self.assertRaises(ExecutorException) as ctx:
+            self.executor.execute_trigger_test(self.CREATE, self.INSERT, 'CREATE TRIGGER ...', '')
+        self.assertEqual(ctx.exception.error_code, OracleStatusCode.OTHER)
+
+        self.assertEqual(self.roles(), roles)
+        self.assertEqual(self.executor.connection_pool.busy, 0)
+
+    def test_provision_error(self):
+        """A failed connection of the sandbox role releases the admin connection and drops the role"""
+        roles = self.roles()
+        with mock.patch.object(self.executor, 'create_connection', side_effect=psycopg2.OperationalError('password')):
+            for _ in range(self.executor.connection_pool.max + 1):  # More failures than admin connections
+                with self.assertRaises(ExecutorException) as ctx:
+                    self.executor.execute_select_test(self.CREATE, self.INSERT, 'SELECT * FROM club')
+                self.assertEqual(ctx.exception.error_code, OracleStatusCode.GET_USER_CONNECTION)
+        self.assertEqual(self.executor.connection_pool.busy, 0)
+        self.assertEqual(self.roles(), roles)
+        result = self.executor.execute_select_test(self.CREATE, self.INSERT, 'SELECT socios FROM club ORDER BY 1')
+        self.assertEqual(result['result']['rows'], [[5], [10]])
+
+    def test_submit(self):
+        """The whole judge works with PostgreSQL for SELECT and DML problems"""
+        collection = create_collection('PostgreSQL')
+        previous = PostgreSQLExecutor.override(self.executor)
+        try:
+            select_problem = SelectProblem(title_md='Select', text_md='texto', create_sql=self.CREATE,
+                                           insert_sql=self.INSERT, collection=collection,
+                                           solution='SELECT cif FROM club WHERE socios > 6')
+            dml_problem = DMLProblem(title_md='DML', text_md='texto', create_sql=self.CREATE, insert_sql=self.INSERT,
+                                     collection=collection, solution='UPDATE club SET socios = socios + 1')
+            with self.settings(JUDGE_EXECUTOR='judge.postgresql_driver.PostgreSQLExecutor'):
+                for problem in (select_problem, dml_problem):
+                    problem.clean()
+                    problem.save()
+                create_user('5555', 'pepe')
+                client = Client()
+                client.login(username='pepe', password='5555')
+                submissions = [(select_problem, 'SELECT cif FROM club WHERE nombre IS NOT NULL', VeredictCode.AC),
+                               (select_problem, 'SELECT cif FROM club', VeredictCode.WA),
+                               (select_problem, 'SELECT cif FROM equipo', VeredictCode.RE),
+                               (dml_problem, 'UPDATE club SET socios = socios + 1;', VeredictCode.AC),
+                               (dml_problem, 'DELETE FROM club', VeredictCode.WA)]
+                for problem, code, verdict in submissions:
+                    response = client.post(reverse('judge:submit', args=[problem.pk]), {'code': code}, follow=True)
+                    self.assertEqual(response.json()['veredict'], verdict, code)
+        finally:
+            PostgreSQLExecutor.override(previous)
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright Enrique Martín <emartinm@ucm.es> 2021
+
+Unit tests for the rejudge of submissions, judging with the SQLite executor
+"""
+import csv
+import json
+import os
+from io import StringIO
+from tempfile import mkstemp
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+from judge import rejudge
+from judge.models import Submission
+from judge.rejudge import rejudge_to_report, rejudge_submissions
+from judge.tests.test_bulk_import import select_problem
+from judge.tests.test_views import create_collection, create_user
+from judge.types import VeredictCode
+
+
+@override_settings(JUDGE_EXECUTOR='judge.sqlite_driver.SQLiteExecutor')
+class RejudgeTest(TestCase):
+    """Tests for judge.rejudge and the command rejudge"""
+
+    def setUp(self):
+        problem = select_problem(create_collection('Rejudge'), 'Socios', 'SELECT * FROM club')
+        problem.clean()
+        problem.save()
+        self.user = create_user(passwd='1111', username='rejudge')
+        self.subs = [Submission.objects.create(code=code, veredict_code=VeredictCode.IE, user=self.user,
+                                               problem=problem)
+                     for code in ['SELECT * FROM club', 'SELECT nombre FROM club', 'SELECT * FROM equipo',
+                                  'SELECT * FROM club']]
+        file_desc, self.filename = mkstemp('_rejudge.jsonl')
+        os.close(file_desc)
+
+    def tearDown(self):
+        os.remove(self.filename)
+
+    def test_rejudge_submissions(self):
+        """Identical codes are judged once, and verdicts are only stored with update=True"""
+        with mock.patch('judge.rejudge.judge_code', wraps=rejudge.judge_code) as judge_code:
+            results = dict(rejudge_submissions(Submission.objects.all(), workers=2))
+            self.assertEqual(judge_code.call_count, 3)
+        self.assertEqual({sub.pk: data['veredict'] for sub, data in results.items()},
+                         {self.subs[0].pk: VeredictCode.AC, self.subs[1].pk: VeredictCode.WA,
+                          self.subs[2].pk: VeredictCode.RE, self.subs[3].pk: VeredictCode.AC})
+        self.assertEqual(Submission.objects.filter(veredict_code=VeredictCode.IE).count(), 4)
+
+        results = dict(rejudge_submissions(Submission.objects.all(), update=True, skip={self.subs[1].pk}))
+        self.assertEqual(len(results), 3)
+        self.assertEqual(list(Submission.objects.order_by('pk').values_list('veredict_code', flat=True)),
+                         [VeredictCode.AC, VeredictCode.IE, VeredictCode.RE, VeredictCode.AC])
+
+    def test_resume(self):
+        """A report can be resumed, judging only the submissions not in it"""
+        changes = rejudge_to_report(Submission.objects.filter(pk__in=[self.subs[0].pk, self.subs[1].pk]),
+                                    self.filename)
+        self.assertEqual(changes, {'IE --> AC': 1, 'IE --> WA': 1})
+        with open(self.filename, 'a', encoding='utf-8') as report:
+            report.write('{"submission": ')  # Interrupted while writing
+        changes = rejudge_to_report(Submission.objects.all(), self.filename, resume=True)
+        self.assertEqual(changes, {'IE --> AC': 1, 'IE --> RE': 1})
+        with open(self.filename, encoding='utf-8') as report:
+            lines = report.read().splitlines()
+        rows = [json.loads(line) for line in lines if line != '{"submission": ']
+        self.assertEqual(sorted(row['submission'] for row in rows), [sub.pk for sub in self.subs])
+        self.assertEqual(rows[0]['user'], 'rejudge')
+
+    def test_command(self):
+        """The command writes CSV reports and stores the verdicts with --update"""
+        csv_filename = self.filename.replace('.jsonl', '.csv')
+        out = StringIO()
+        call_command('rejudge', '--verdict', 'IE', '--report', csv_filename, '--update', stdout=out)
+        self.assertIn('IE --> AC: 2', out.getvalue())
+        with open(csv_filename, encoding='utf-8', newline='') as report:
+            rows = list(csv.DictReader(report))
+        self.assertEqual(len(rows), 4)
+        self.assertEqual({row['new'] for row in rows}, {'AC', 'WA', 'RE'})
+        self.assertFalse(Submission.objects.filter(veredict_code=VeredictCode.IE).exists())
+
+        call_command('rejudge', '--verdict', 'AC', '--report', csv_filename, '--resume', stdout=out)
+        self.assertIn('Rejudged 0 submissions', out.getvalue())
+        os.remove(csv_filename)
@@ -15,7 +15,7 @@ from django.contrib.auth.models import Group
 from judge.types import VeredictCode
 from judge.models import SelectProblem, DMLProblem, FunctionProblem, ProcProblem, TriggerProblem, Collection, Problem, \
     Submission
-from judge.shell import create_users_from_csv, adapt_db_result_to_list, rejudge
+from judge.shell import create_users_from_csv, create_users_from_list, adapt_db_result_to_list, rejudge
 from judge.tests.test_views import create_select_problem, create_collection, create_user
 
 
@@ -76,6 +76,23 @@ class ShellTest(TestCase):
         self.assertEqual(len(froilan.groups.all()), 1)
         self.assertEqual(froilan.groups.all()[0], new_group)
 
+    def test_duplicated_users(self):
+        """Users repeated in the list or already in the DB are reported and not created"""
+        group = Group.objects.create(name='Grupo')
+        create_user(passwd='1111', username='juan')
+        rows = [{'NOMBRE COMPLETO': name, 'DOCUMENTO': document, 'CORREO': email} for name, document, email in
+                [('Juan', '11111111X', 'juan@ucm.es'), ('PÉREZ, ANA', '22222222X', 'ana@ucm.es'),
+                 ('Ana', '33333333X', 'ana@ucm.es'), ('Luis', '44444444X', 'luis@ucm.es')]]
+        self.assertEqual(create_users_from_list(rows, group, dry=True), ['ana', 'juan'])
+        self.assertEqual(group.user_set.count(), 0)
+
+        self.assertEqual(create_users_from_list(rows, group, dry=False), ['ana', 'juan'])
+        self.assertEqual(sorted(group.user_set.values_list('username', flat=True)), ['ana', 'luis'])
+        ana = get_user_model().objects.get(username='ana')
+        self.assertTrue(ana.check_password('22222222X'))
+        self.assertEqual((ana.first_name, ana.last_name, ana.email), ('ANA', 'PÉREZ', 'ana@ucm.es'))
+        self.assertTrue(get_user_model().objects.get(username='juan').check_password('1111'))
+
     def test_empty_fields(self):
         """CSV files where some fields are empty"""
         curr_path = os.path.dirname(__file__)
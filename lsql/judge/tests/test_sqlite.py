@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright Enrique Martín <emartinm@ucm.es> 2021
+
+Unit tests for the SQLite executor, which does not need Oracle
+"""
+from django.test import TestCase, Client, override_settings
+from django.urls import reverse
+
+from judge.exceptions import ExecutorException
+from judge.executor import get_executor
+from judge.metrics import STAGE_METRICS, record_current
+from judge.oracle_driver import execution_limits
+from judge.sqlite_driver import SQLiteExecutor
+from judge.tests.test_submit import create_discriminant_problem
+from judge.tests.test_views import create_collection, create_user, create_select_problem, create_dml_problem
+from judge.types import OracleStatusCode, VeredictCode
+
+
+@override_settings(JUDGE_EXECUTOR='judge.sqlite_driver.SQLiteExecutor')
+class SQLiteTest(TestCase):
+    """Tests for judge.sqlite_driver"""
+
+    def test_executor(self):
+        """Results have the same format as in OracleExecutor"""
+        executor = get_executor()
+        self.assertIsInstance(executor, SQLiteExecutor)
+        self.assertIs(executor, get_executor())
+        self.assertEqual(executor.stage_hooks, [STAGE_METRICS.record, record_current])
+
+        create = 'CREATE TABLE club (cif CHAR(9) PRIMARY KEY, nombre VARCHAR2(40), socios NUMBER);'
+        insert = "INSERT INTO club VALUES ('11111111X', 'Real Madrid', 10);\nINSERT INTO club VALUES ('2', NULL, 5);"
+        result = executor.execute_select_test(create, insert, 'SELECT nombre, socios FROM club ORDER BY socios',
+                                              output_db=True)
+        self.assertEqual(result['result'], {'header': [['NOMBRE', '<cx_Oracle.DbType DB_TYPE_VARCHAR>'],
+                                                       ['SOCIOS', '<cx_Oracle.DbType DB_TYPE_NUMBER>']],
+                                            'rows': [[None, 5], ['Real Madrid', 10]]})
+        self.assertEqual(list(result['db']), ['CLUB'])
+
+        result = executor.execute_dml_test(create, insert, 'DELETE FROM club WHERE socios > 7; '
+                                                           'CREATE TABLE nueva (n NUMBER);')
+        self.assertEqual(len(result['pre']['CLUB']['rows']), 2)
+        self.assertEqual(len(result['post']['CLUB']['rows']), 1)
+        self.assertIn('NUEVA', result['post'])
+
+        with self.assertRaises(ExecutorException) as ctx:
+            executor.execute_select_test(create, insert, 'SELECT * FROM club; SELECT * FROM club')
+        self.assertEqual(ctx.exception.error_code, OracleStatusCode.NUMBER_STATEMENTS)
+        with self.assertRaises(ExecutorException) as ctx:
+            executor.execute_select_test(create, insert, 'SELECT * FROM equipo')
+        self.assertEqual(ctx.exception.error_code, OracleStatusCode.EXECUTE_USER_CODE)
+        with self.assertRaises(ExecutorException) as ctx:
+            executor.execute_function_test(create, insert, 'CREATE FUNCTION f ...', 'f()')
+        self.assertEqual(ctx.exception.error_code, OracleStatusCode.OTHER)
+
+    def test_limits(self):
+        """Too many rows and long statements are TLE"""
+        executor = get_executor()
+        create = 'CREATE TABLE t (n NUMBER);'
+        insert = 'INSERT INTO t VALUES (1); INSERT INTO t VALUES (2); INSERT INTO t VALUES (3);'
+        with self.assertRaises(ExecutorException) as ctx:
+            executor.execute_select_test(create, insert, 'SELECT * FROM t', limits=execution_limits(max_rows=2))
+        self.assertEqual(ctx.exception.error_code, OracleStatusCode.TLE_USER_CODE)
+
+        endless = ('WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c) '
+                   'SELECT COUNT(*) FROM c')
+        with self.assertRaises(ExecutorException) as ctx:
+            executor.execute_select_test(create, insert, endless, limits=execution_limits(stmt_timeout_ms=100))
+        self.assertEqual(ctx.exception.error_code, OracleStatusCode.TLE_USER_CODE)
+
+    def test_submit(self):
+        """The whole judge works with SQLite for SELECT, DML and discriminant problems"""
+        collection = create_collection('SQLite')
+        select_problem = create_select_problem(collection)
+        dml_problem = create_dml_problem(collection)
+        disc_problem = create_discriminant_problem(False, collection)
+        create_user('5555', 'pepe')
+        client = Client()
+        client.login(username='pepe', password='5555')
+
+        submissions = [(select_problem, 'SELECT * FROM test', VeredictCode.AC),
+                       (select_problem, 'SELECT n + 1 AS n FROM test', VeredictCode.WA),
+                       (select_problem, 'SELECT * FROM tabla', VeredictCode.RE),
+                       (dml_problem, dml_problem.solution, VeredictCode.AC),
+                       (dml_problem, 'INSERT INTO test VALUES (1)', VeredictCode.VE),
+                       (disc_problem, 'INSERT INTO test_table_1 VALUES (5)', VeredictCode.AC),
+                       (disc_problem, 'INSERT INTO test_table_1 VALUES (1500)', VeredictCode.WA)]
+        for problem, code, verdict in submissions:
+            response = client.post(reverse('judge:submit', args=[problem.pk]), {'code': code}, follow=True)
+            self.assertEqual(response.json()['veredict'], verdict, code)
@@ -10,7 +10,8 @@ from django.test import TestCase
 from judge.tests.test_views import create_select_problem, create_collection, create_user, create_group
 from judge.types import VeredictCode
 from judge.models import Submission
-from judge.statistics import submissions_by_day, submission_count, participation_per_group
+from judge.statistics import submissions_by_day, submission_count, participation_per_group, \
+    execution_time_per_problem
 
 
 class StatisticsTest(TestCase):
@@ -123,3 +124,43 @@ class StatisticsTest(TestCase):
             }
         }
         self.assertDictEqual(data, expected)
+
+    def test_execution_time(self):
+        """ Test the problems with highest average execution time """
+        user = create_user(username='u1', passwd='1111')
+        collection = create_collection('Test for statistics')
+        fast = create_select_problem(collection, 'Fast problem')
+        slow = create_select_problem(collection, 'Slow problem')
+        subs = [
+            Submission(veredict_code=VeredictCode.AC, user=user, problem=fast, execution_time=0.1),
+            Submission(veredict_code=VeredictCode.AC, user=user, problem=fast, execution_time=0.3),
+            Submission(veredict_code=VeredictCode.AC, user=user, problem=slow, execution_time=1.0),
+            Submission(veredict_code=VeredictCode.TLE, user=user, problem=slow, execution_time=5.0),
+            Submission(veredict_code=VeredictCode.VE, user=user, problem=slow),  # Not judged
+        ]
+        for sub in subs:
+            sub.save()
+
+        data = execution_time_per_problem()
+        self.assertEqual([entry['problem'] for entry in data], ['Slow problem', 'Fast problem'])
+        self.assertEqual(data[0]['submissions'], 2)
+        self.assertAlmostEqual(data[0]['avg'], 3.0)
+        self.assertAlmostEqual(data[0]['max'], 5.0)
+        self.assertEqual(data[0]['tle'], 1)
+        self.assertEqual(data[1]['tle'], 0)
+        self.assertEqual(len(execution_time_per_problem(limit=1)), 1)
+
+    def test_execution_time_same_title(self):
+        """ Problems with the same title are not merged """
+        user = create_user(username='u1', passwd='1111')
+        problem1 = create_select_problem(create_collection('Collection 1'), 'Same title')
+        problem2 = create_select_problem(create_collection('Collection 2'), 'Same title')
+        Submission(veredict_code=VeredictCode.AC, user=user, problem=problem1, execution_time=1.0).save()
+        Submission(veredict_code=VeredictCode.AC, user=user, problem=problem2, execution_time=2.0).save()
+        Submission(veredict_code=VeredictCode.AC, user=user, problem=problem2, execution_time=4.0).save()
+
+        data = execution_time_per_problem()
+        self.assertEqual([entry['id'] for entry in data], [problem2.pk, problem1.pk])
+        self.assertEqual([entry['problem'] for entry in data], ['Same title', 'Same title'])
+        self.assertEqual([entry['submissions'] for entry in data], [2, 1])
+        self.assertAlmostEqual(data[0]['avg'], 3.0)
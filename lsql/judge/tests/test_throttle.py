@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright Enrique Martín <emartinm@ucm.es> 2021
+
+Unit tests for the rate limits and coalescing of submissions
+"""
+import threading
+import time
+
+from django.test import TestCase, Client, override_settings
+from django.urls import reverse
+
+from judge.models import Submission
+from judge.tests.test_views import create_collection, create_user, create_select_problem
+from judge.throttle import RateLimited, SubmissionThrottle, TokenBucket, get_throttle, parse_rate
+
+
+class ThrottleTest(TestCase):
+    """Tests for judge.throttle"""
+
+    def test_parse_rate(self):
+        """Rates are SUBMISSIONS/SECONDS"""
+        self.assertEqual(parse_rate('3/60'), (3, 0.05))
+        self.assertEqual(parse_rate(' 10 / 2.5 '), (10, 4.0))
+        self.assertIsNone(parse_rate(''))
+        for text in ['3', '0/60', '3/0', 'a/b']:
+            with self.assertRaises(ValueError):
+                parse_rate(text)
+
+    def test_token_bucket(self):
+        """Buckets refill with time up to their capacity"""
+        bucket = TokenBucket(2, 0.5)
+        bucket.tokens = 0
+        self.assertAlmostEqual(bucket.wait(), 2.0)
+        bucket.refill(bucket.updated + 1)
+        self.assertAlmostEqual(bucket.tokens, 0.5)
+        self.assertFalse(bucket.full(bucket.updated + 2))
+        self.assertTrue(bucket.full(bucket.updated + 3))
+        bucket.refill(bucket.updated + 100)
+        self.assertEqual(bucket.tokens, 2)
+        self.assertEqual(bucket.wait(), 0)
+
+    def test_allow(self):
+        """Bursts are limited per user and per user and problem"""
+        throttle = SubmissionThrottle(user_rate=(3, 0.01), problem_rate=(2, 0.01))
+        self.assertIsNone(throttle.allow(1, 10))
+        self.assertIsNone(throttle.allow(1, 10))
+        self.assertEqual(throttle.allow(1, 10), 100)  # Limit of the problem
+        self.assertIsNone(throttle.allow(1, 11))
+        self.assertIsNotNone(throttle.allow(1, 12))  # Limit of the user
+        self.assertIsNone(throttle.allow(2, 10))  # Other users are not affected
+        self.assertEqual(throttle.status()['rate_limited'], 2)
+        self.assertIsNone(SubmissionThrottle().allow(1, 10))
+
+    def test_coalesce(self):
+        """Concurrent invocations with the same key share the result of the first one"""
+        throttle = SubmissionThrottle()
+        started, finish, calls, results = threading.Event(), threading.Event(), [], []
+
+        def judge(code):
+            calls.append(code)
+            started.set()
+            finish.wait()
+            if code == 'error':
+                raise ValueError(code)
+            return code.upper()
+
+        def submit(code):
+            try:
+                results.append(throttle.coalesce(('user', code), judge, code))
+            except ValueError as excp:
+                results.append(excp)
+
+        for code in ['select', 'error']:
+            started.clear()
+            finish.clear()
+            threads = [threading.Thread(target=submit, args=[code]) for _ in range(3)]
+            threads[0].start()
+            started.wait()
+            for thread in threads[1:]:
+                thread.start()
+            while throttle.status()['coalesced'] < (2 if code == 'select' else 4):
+                time.sleep(0.01)
+            finish.set()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(calls, ['select', 'error'])
+        self.assertEqual(results[:3], ['SELECT'] * 3)
+        self.assertEqual(len({id(excp) for excp in results[3:]}), 1)
+        self.assertEqual(throttle.status()['in_progress'], 0)
+        self.assertEqual(throttle.coalesce(('user', 'select'), str.upper, 'again'), 'AGAIN')
+
+    def test_coalesce_limit(self):
+        """Only the submission that invokes the judge takes tokens, so identical submissions are not rate limited"""
+        throttle = SubmissionThrottle(problem_rate=(1, 0.01))
+        started, finish, results = threading.Event(), threading.Event(), []
+
+        def judge(code):
+            started.set()
+            finish.wait()
+            return code.upper()
+
+        def submit():
+            results.append(throttle.coalesce(('user', 'select'), judge, 'select', limit=(1, 10)))
+
+        threads = [threading.Thread(target=submit) for _ in range(2)]
+        threads[0].start()
+        started.wait()
+        threads[1].start()
+        while throttle.status()['coalesced'] < 1:
+            time.sleep(0.01)
+        finish.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, ['SELECT'] * 2)
+        self.assertEqual(throttle.status()['rate_limited'], 0)
+
+        with self.assertRaises(RateLimited) as ctx:
+            throttle.coalesce(('user', 'select'), judge, 'select', limit=(1, 10))
+        self.assertEqual(ctx.exception.retry_after, 100)
+        self.assertEqual(throttle.status(), {'rate_limited': 1, 'coalesced': 1, 'in_progress': 0})
+
+    @override_settings(JUDGE_EXECUTOR='judge.sqlite_driver.SQLiteExecutor')
+    def test_submit_rate_limited(self):
+        """Submissions over the limit receive a 429 with Retry-After and are not stored"""
+        problem = create_select_problem(create_collection('Throttle'))
+        create_user('5555', 'pepe')
+        client = Client()
+        client.login(username='pepe', password='5555')
+        url = reverse('judge:submit', args=[problem.pk])
+
+        throttle = get_throttle()
+        throttle.problem_rate = (1, 0.01)
+        try:
+            response = client.post(url, {'code': problem.solution}, follow=True)
+            self.assertEqual(response.json()['veredict'], 'AC')
+            response = client.post(url, {'code': problem.solution}, follow=True)
+        finally:
+            throttle.problem_rate = None
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.json()['veredict'], 'BUSY')
+        self.assertEqual(response['Retry-After'], '100')
+        self.assertEqual(Submission.objects.filter(problem=problem).count(), 1)
@@ -7,7 +7,8 @@ Unit tests for the feedback module by simulation connections
 from datetime import datetime
 import os
 
-from django.test import TestCase, Client
+from django.http import Http404
+from django.test import TestCase, Client, RequestFactory
 import django.contrib.auth
 from django.urls import reverse
 from django.contrib.auth.models import Group
@@ -17,7 +18,7 @@ from judge.models import Collection, SelectProblem, Submission, FunctionProblem,
 from judge.types import VeredictCode
 import judge.tests.test_oracle
 from judge.tests.test_parse import ParseTest
-from judge.views import first_day_of_course
+from judge.views import first_day_of_course, get_problem_or_404
 from judge.feedback import filter_expected_db
 
 
@@ -835,6 +836,27 @@ class ViewsTest(TestCase):
         self.assertIn('TEST_TABLE_3 (Tabla modificada)', content)
         self.assertIn('NEW (Tabla añadida)', content)
 
+    def test_get_problem_or_404(self):
+        """Problems are loaded as their subclass with a single query, only once per request"""
+        collection = create_collection('Colección')
+        problem = SelectProblem.objects.create(title_md='Uno', title_html='Uno', text_html='Texto', solution='SELECT 1',
+                                               collection=collection, create_sql='CREATE TABLE t (n NUMBER);',
+                                               insert_sql='INSERT INTO t VALUES (1);')
+        request = RequestFactory().get('/')
+        with self.assertNumQueries(1):
+            self.assertIsInstance(get_problem_or_404(request, problem.pk), SelectProblem)
+        with self.assertNumQueries(0):
+            self.assertIs(get_problem_or_404(request, problem.pk), get_problem_or_404(request, problem.pk))
+        with self.assertRaises(Http404):
+            get_problem_or_404(request, problem.pk + 1)
+
+        create_user('5555', 'pepe')
+        client = Client()
+        client.login(username='pepe', password='5555')
+        response = client.get(reverse('judge:create_insert', args=[problem.pk]))
+        self.assertEqual(response.content.decode('utf-8'), 'CREATE TABLE t (n NUMBER);\n\nINSERT INTO t VALUES (1);')
+        self.assertEqual(client.get(reverse('judge:create_insert', args=[problem.pk + 1])).status_code, 404)
+
     def test_help(self):
         """ Help returns a help page in Spanish """
         client = Client()
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright Enrique Martín <emartinm@ucm.es> 2021
+
+Limits the submissions of every student with token buckets (one per user and one per user and problem) and
+coalesces concurrent identical submissions of the same student, so that repeated clicks on the submit button do not
+launch several runs of the judge. The limits are configured with the environment variables JUDGE_RATE_USER and
+JUDGE_RATE_PROBLEM in the format 'SUBMISSIONS/SECONDS', e.g. '3/60'. Without them there are no limits
+"""
+
+import math
+import os
+import re
+import threading
+import time
+from functools import lru_cache
+from logzero import logger
+
+
+class TokenBucket:
+    """Bucket with 'capacity' tokens that refills at 'rate' tokens per second"""
+
+    def __init__(self, capacity, rate, now=None):
+        """
+        :param capacity: (int) maximum number of tokens, i.e., submissions allowed in a burst
+        :param rate: (float) tokens added per second
+        :param now: (float) time of creation, by default the current time
+        """
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = capacity
+        self.updated = time.time() if now is None else now
+
+    def refill(self, now):
+        """Adds the tokens generated since the last update"""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def full(self, now):
+        """:return: (bool) whether the bucket would be full at time 'now', so it can be forgotten"""
+        return self.tokens + (now - self.updated) * self.rate >= self.capacity
+
+    def wait(self):
+        """:return: (float) seconds until a token is available"""
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+
+def parse_rate(text):
+    """
+    :param text: (str) rate 'SUBMISSIONS/SECONDS', e.g. '3/60', or None
+    :return: tuple (capacity, tokens per second) or None if 'text' is empty
+    """
+    if not text:
+        return None
+    match = re.fullmatch(r'\s*(\d+)\s*/\s*(\d+(\.\d+)?)\s*', text)
+    if match is None or int(match.group(1)) == 0 or float(match.group(2)) == 0:
+        raise ValueError(f'Invalid rate "{text}", use SUBMISSIONS/SECONDS')
+    return int(match.group(1)), int(match.group(1)) / float(match.group(2))
+
+
+class RateLimited(Exception):
+    """The submission exceeds the rate limits and should be sent again after 'retry_after' seconds"""
+
+    def __init__(self, retry_after):
+        super().__init__(f'Rate limited, retry in {retry_after} seconds')
+        self.retry_after = retry_after
+
+
+class Flight:  # pylint: disable=too-few-public-methods
+    """Judge run shared by several identical submissions"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SubmissionThrottle:
+    """Rate limits and coalescing of the submissions. Safe to use from several threads"""
+
+    MAX_BUCKETS = 10000  # Full buckets are forgotten when there are more than this number
+
+    def __init__(self, user_rate=None, problem_rate=None):
+        """
+        :param user_rate: tuple (capacity, tokens per second) of the bucket of every user, None for no limit
+        :param problem_rate: tuple (capacity, tokens per second) of the bucket of every user and problem, None for
+                             no limit
+        """
+        self.user_rate = user_rate
+        self.problem_rate = problem_rate
+        self.lock = threading.Lock()
+        self.buckets = {}
+        self.flights = {}
+        self.limited = 0
+        self.coalesced = 0
+
+    def bucket(self, key, rate, now):
+        """:return: the TokenBucket of 'key', refilled at time 'now'"""
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = TokenBucket(*rate, now=now)
+        bucket.refill(now)
+        return bucket
+
+    def take(self, user_id, problem_id):
+        """
+        Same as allow(), but it must be invoked holding self.lock
+        :return: None if the submission is allowed, otherwise (int) seconds to wait before submitting again
+        """
+        limits = [(key, rate) for key, rate in [(('user', user_id), self.user_rate),
+                                                 (('problem', user_id, problem_id), self.problem_rate)]
+                  if rate is not None]
+        if not limits:
+            return None
+        now = time.time()
+        if len(self.buckets) > self.MAX_BUCKETS:
+            self.buckets = {key: bucket for key, bucket in self.buckets.items() if not bucket.full(now)}
+        buckets = [self.bucket(key, rate, now) for key, rate in limits]
+        wait = max(bucket.wait() for bucket in buckets)
+        if wait > 0:
+            self.limited += 1
+            logger.info('Submission of user %s to problem %s rate limited, retry in %.1f seconds', user_id,
+                        problem_id, wait)
+            return max(1, math.ceil(wait))
+        for bucket in buckets:
+            bucket.tokens -= 1
+        return None
+
+    def allow(self, user_id, problem_id):
+        """
+        Takes a token from the buckets of the user and of the user and problem
+        :return: None if the submission is allowed, otherwise (int) seconds to wait before submitting again
+        """
+        with self.lock:
+            return self.take(user_id, problem_id)
+
+    def coalesce(self, key, function, *args, limit=None):
+        """
+        Invokes 'function(*args)' unless there is an invocation with the same 'key' in progress. In that case,
+        waits for it and returns its result (or raises its exception)
+        :param key: hashable identifying the submission, e.g. (user, problem, code)
+        :param limit: tuple (user_id, problem_id) whose rate limits are checked (see allow) only if the function is
+                      invoked, so that coalesced submissions do not take tokens. None for no limits
+        :return: the result of the function. Raises RateLimited if the invocation exceeds the limits
+        """
+        with self.lock:
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                retry_after = self.take(*limit) if limit is not None else None
+                if retry_after is not None:
+                    raise RateLimited(retry_after)
+                flight = self.flights[key] = Flight()
+            else:
+                self.coalesced += 1
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+        try:
+            flight.result = function(*args)
+            return flight.result
+        except Exception as excp:
+            flight.error = excp
+            raise
+        finally:
+            with self.lock:
+                del self.flights[key]
+            flight.done.set()
+
+    def status(self):
+        """:return: dictionary with the number of submissions rate limited and coalesced"""
+        with self.lock:
+            return {'rate_limited': self.limited, 'coalesced': self.coalesced, 'in_progress': len(self.flights)}
+
+    def prometheus(self):
+        """:return: (str) submissions rate limited and coalesced in the Prometheus text exposition format"""
+        status = self.status()
+        return '\n'.join([
+            '# HELP lsql_judge_rate_limited_total Submissions rejected by the rate limits of the students',
+            '# TYPE lsql_judge_rate_limited_total counter',
+            f'lsql_judge_rate_limited_total {status["rate_limited"]}',
+            '# HELP lsql_judge_coalesced_total Submissions that shared the judge run of an identical submission',
+            '# TYPE lsql_judge_coalesced_total counter',
+            f'lsql_judge_coalesced_total {status["coalesced"]}',
+        ]) + '\n'
+
+
+@lru_cache(maxsize=None)
+def get_throttle():
+    """
+    :return: SubmissionThrottle of this process, configured from the environment
+    """
+    return SubmissionThrottle(user_rate=parse_rate(os.environ.get('JUDGE_RATE_USER')),
+                              problem_rate=parse_rate(os.environ.get('JUDGE_RATE_PROBLEM')))
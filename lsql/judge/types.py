@@ -56,6 +56,14 @@ class VeredictCode(models.TextChoices):
         return msg
 
 
+class ImportState(models.TextChoices):
+    """States of the background import of a collection ZIP"""
+    PENDING = 'PENDING', 'Pending'
+    RUNNING = 'RUNNING', 'Running'
+    DONE = 'DONE', 'Done'
+    FAILED = 'FAILED', 'Failed'
+
+
 @unique
 class ProblemType(IntEnum):
     """Types of problems"""
@@ -16,6 +16,8 @@ urlpatterns = [
     path('help/', views.help_page, name='help'),
     path('collection/', views.show_collections, name='collections'),
     path('collection/<int:collection_id>', views.show_collection, name='collection'),
+    path('collection/<int:collection_id>/export', views.export_collection, name='export_collection'),
+    path('collection/export', views.export_collections, name='export_collections'),
     path('problem/<int:problem_id>', views.show_problem, name='problem'),
     path('submit/<int:problem_id>', views.submit, name='submit'),
     path('hint/<int:problem_id>', views.get_hint, name='hint'),
@@ -29,6 +31,8 @@ urlpatterns = [
     path('achievements/<int:user_id>', views.show_achievements, name='achievements'),
     path('hints/', views.show_hints, name='hints'),
     path('statistics/submissions', views.statistics_submissions, name='statistics_submissions'),
+    path('statistics/judge', views.judge_metrics, name='judge_metrics'),
+    path('metrics', views.judge_metrics_prometheus, name='judge_metrics_prometheus'),
     path('login/', auth_views.LoginView.as_view(template_name='login.html'), name='login'),
     path('logout/', auth_views.LogoutView.as_view(template_name='logout.html'), name='logout'),
     path('password_change/',
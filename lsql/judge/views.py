@@ -22,18 +22,24 @@ from django.contrib.auth.decorators import login_required
 from django.utils.translation import gettext_lazy as _
 from django.contrib.admin.views.decorators import staff_member_required
 from django.conf import settings
+from django.db.models import Count, Exists, OuterRef, Subquery
+from django.db.models.functions import Coalesce
 from django.template.exceptions import TemplateDoesNotExist
 from django.template.loader import render_to_string
 from django.views.decorators.http import require_POST
 
+from .admission import JudgeBusy, get_admission
 from .exceptions import ExecutorException
-from .feedback import compile_error_to_html_table, filter_expected_db
+from .export import export_response
+from .feedback import exception_verdict, filter_expected_db
 from .forms import SubmitForm, ResultForm
 from .models import Collection, Problem, Submission, ObtainedAchievement, AchievementDefinition, \
-    NumSubmissionsProblemsAchievementDefinition, Hint, UsedHint
-from .oracle_driver import OracleExecutor
-from .types import VeredictCode, OracleStatusCode, ProblemType
-from .statistics import submissions_by_day, submission_count, participation_per_group
+    NumSubmissionsProblemsAchievementDefinition, Hint, UsedHint, listing_deferred_fields
+from .executor import get_executor
+from .types import VeredictCode
+from .throttle import RateLimited, get_throttle
+from .statistics import submissions_by_day, submission_count, participation_per_group, execution_time_per_problem
+from .metrics import STAGE_METRICS, collect_timings
 
 # TRANSLATIONS #
 # To translate the code to another language you need to create the translation file:
@@ -51,10 +57,36 @@ from .statistics import submissions_by_day, submission_count, participation_per_
 # Helper functions #
 ####################
 
-def get_subclass_problem(problem_id):
-    """Look for problem 'pk' in the different child classes of Problem"""
-    queryset = Problem.objects.filter(pk=problem_id).select_subclasses()
-    return None if len(queryset) == 0 else queryset[0]
+def get_memoized_or_404(request, queryset, pk):
+    """
+    Object 'pk' of the queryset, loaded only once per request even if several views are invoked with the same request
+    (e.g., download_ranking invokes show_result)
+    :raise Http404: if there is no such object
+    """
+    memo = getattr(request, 'judge_memo', None)
+    if memo is None:
+        memo = request.judge_memo = {}
+    key = (queryset.model, pk)
+    if key not in memo:
+        memo[key] = get_object_or_404(queryset, pk=pk)
+    return memo[key]
+
+
+def get_problem_or_404(request, problem_id):
+    """
+    Looks for problem 'problem_id' in the different child classes of Problem with a single query
+    :return: object of the subclass of Problem (SelectProblem, DMLProblem...)
+    :raise Http404: if there is no such problem
+    """
+    return get_memoized_or_404(request, Problem.objects.select_subclasses(), problem_id)
+
+
+def get_collection_or_404(request, collection_id):
+    """
+    :return: Collection 'collection_id', loaded once per request
+    :raise Http404: if there is no such collection
+    """
+    return get_memoized_or_404(request, Collection.objects.all(), collection_id)
 
 
 def pos(user_1, user_2):
@@ -164,7 +196,7 @@ def show_result(request, collection_id):
     up_to_classification_date = None
     from_classification_date = None
     up_to_classification = datetime.today().strftime('%Y-%m-%d')
-    collection = get_object_or_404(Collection, pk=collection_id)
+    collection = get_collection_or_404(request, collection_id)
     if request.user.is_staff and result_form.is_valid():
         group_id = result_form.cleaned_data['group']
         start = result_form.cleaned_data['start']
@@ -271,7 +303,7 @@ def show_collections(request):
 @login_required
 def show_collection(request, collection_id):
     """Shows a collection"""
-    collection = get_object_or_404(Collection, pk=collection_id)
+    collection = get_collection_or_404(request, collection_id)
     # New attribute to store the list of problems and include the number of submission in each problem
     collection.problem_list = collection.problems()
     for problem in collection.problem_list:
@@ -284,16 +316,15 @@ def show_collection(request, collection_id):
 def show_problem(request, problem_id):
     """Shows a concrete problem"""
     # Error 404 if there is no a Problem pk
-    get_object_or_404(Problem, pk=problem_id)
-    # Look for problem pk in all the Problem classes
-    problem = get_subclass_problem(problem_id)
+    problem = get_problem_or_404(request, problem_id)
     # Stores the flag in an attribute so that the template can use it
     problem.solved = problem.solved_by_user(request.user)
     # Filter the expected result to display it
     problem.show_added, problem.show_modified, problem.show_removed = filter_expected_db(problem.expected_result[0],
                                                                                          problem.initial_db[0])
-    problem.available_hints = Hint.objects.filter(problem=problem).order_by('num_submit').count()
-    used_hints = UsedHint.objects.filter(user=request.user).filter(hint_definition__problem=problem)
+    problem.available_hints = Hint.objects.filter(problem=problem).count()
+    used_hints = UsedHint.objects.filter(user=request.user).filter(hint_definition__problem=problem) \
+        .select_related('hint_definition').order_by('request_date', 'pk')
     hints = []
     cont = 0
     for used in used_hints:
@@ -335,6 +366,7 @@ def show_submissions(request):
 
         else:
             subs = Submission.objects.filter(user=request.user).order_by('-pk')
+        subs = subs.select_related('problem').defer(*listing_deferred_fields(Problem, 'problem__'))
         for submission in subs:
             submission.veredict_pretty = VeredictCode(submission.veredict_code).html_short_name()
         return render(request, 'submissions.html', {'submissions': subs})
@@ -365,7 +397,9 @@ def show_hints(request):
     """View for show the used hints"""
     context = {'user': request.user, 'elements': {}}
     dic = {}
-    hints = UsedHint.objects.filter(user=request.user.pk).order_by('request_date')
+    hints = UsedHint.objects.filter(user=request.user.pk).order_by('request_date') \
+        .select_related('hint_definition__problem') \
+        .defer(*listing_deferred_fields(Problem, 'hint_definition__problem__'))
     for hint in hints:
         if hint.hint_definition.problem.pk in dic:
             dic[hint.hint_definition.problem.pk].append(hint)
@@ -399,11 +433,9 @@ def download_submission(request, submission_id):
 
 
 @login_required
-def download(_, problem_id):
+def download(request, problem_id):
     """Returns a script with the creation and insertion of the problem"""
-    get_object_or_404(Problem, pk=problem_id)
-    # Look for problem pk in all the Problem classes
-    problem = get_subclass_problem(problem_id)
+    problem = get_problem_or_404(request, problem_id)
     response = HttpResponse()
     response['Content-Type'] = 'application/sql'
     response['Content-Disposition'] = "attachment; filename=create_insert.sql"
@@ -411,6 +443,47 @@ def download(_, problem_id):
     return response
 
 
+def retry_response(title, message, retry_after, status):
+    """
+    :return: JsonResponse with the status code and the Retry-After header asking to submit again after some seconds
+    """
+    data = {'veredict': 'BUSY', 'title': title, 'message': message.format(seconds=retry_after), 'feedback': '',
+            'retry_after': retry_after}
+    response = JsonResponse(data, status=status)
+    response['Retry-After'] = str(retry_after)
+    return response
+
+
+def judge_busy_response(busy):
+    """
+    :param busy: JudgeBusy exception
+    :return: JsonResponse with status 503 asking to submit again after some seconds
+    """
+    return retry_response(_('Juez ocupado'),
+                          _('El juez está recibiendo demasiados envíos en este momento. Vuelve a enviar tu solución '
+                            'dentro de {seconds} segundos.'), busy.retry_after, 503)
+
+
+def rate_limited_response(retry_after):
+    """
+    :param retry_after: (int) seconds until the student can submit again
+    :return: JsonResponse with status 429 asking to submit again after some seconds
+    """
+    return retry_response(_('Demasiados envíos'),
+                          _('Has realizado demasiados envíos seguidos. Revisa tu solución y vuelve a enviarla '
+                            'dentro de {seconds} segundos.'), retry_after, 429)
+
+
+def judge_submission(problem, code):
+    """
+    Judges a submission with the admission control of the judge
+    :return: tuple (verdict, feedback, JudgeTimings)
+    """
+    with collect_timings() as timings, get_admission().admit():
+        veredict, feedback = problem.judge(code, get_executor())
+    return veredict, feedback, timings
+
+
 @login_required
 # pylint does not understand the dynamic attributes in VeredictCode (TextChoices), so we need to disable
 # no-member warning in this specific function
@@ -418,47 +491,39 @@ def download(_, problem_id):
 def submit(request, problem_id):
     """Process a user submission"""
     # Error 404 if there is no Problem 'pk'
-    general_problem = get_object_or_404(Problem, pk=problem_id)
-    problem = get_subclass_problem(problem_id)
+    problem = get_problem_or_404(request, problem_id)
     submit_form = SubmitForm(request.POST)
     data = {'veredict': VeredictCode.IE, 'title': VeredictCode.IE.label,
             'message': VeredictCode.IE.message(), 'feedback': ''}
-    code = ''
+    code, timings = '', None
     if submit_form.is_valid():
         try:
             # AC or WA
             code = submit_form.cleaned_data['code']
-            data['veredict'], data['feedback'] = problem.judge(code, OracleExecutor.get())
+            # Identical submissions sent while the first one is being judged share its result, and only the
+            # first one is rate limited
+            data['veredict'], data['feedback'], timings = get_throttle().coalesce(
+                (request.user.pk, problem.pk, code), judge_submission, problem, code,
+                limit=(request.user.pk, problem.pk))
             data['title'] = data['veredict'].label
             data['message'] = data['veredict'].message()
+        except RateLimited as limited:
+            return rate_limited_response(limited.retry_after)
+        except JudgeBusy as busy:
+            # The submission is not judged nor stored, the student must send it again
+            return judge_busy_response(busy)
         except ExecutorException as excp:
             # Exceptions when judging: RE, TLE, VE or IE
-            if excp.error_code == OracleStatusCode.EXECUTE_USER_CODE:
-                data = {
-                    'veredict': VeredictCode.RE,
-                    'title': VeredictCode.RE.label,
-                    'message': VeredictCode.RE.message(),
-                    'feedback': (f'{excp.statement} --> {excp.message}'
-                                 if problem.problem_type() == ProblemType.FUNCTION else excp.message),
-                    'position': excp.position,
-                    'position_msg': _('Posición: línea {row}, columna {col}').format(row=excp.position[0]+1,
-                                                                                     col=excp.position[1]+1)
-                }
-            elif excp.error_code == OracleStatusCode.TLE_USER_CODE:
-                data = {'veredict': VeredictCode.TLE, 'title': VeredictCode.TLE.label,
-                        'message': VeredictCode.TLE.message(), 'feedback': ''}
-            elif excp.error_code == OracleStatusCode.NUMBER_STATEMENTS:
-                data = {'veredict': VeredictCode.VE, 'title': VeredictCode.VE.label,
-                        'message': VeredictCode.VE.message(problem), 'feedback': excp.message}
-            elif excp.error_code == OracleStatusCode.COMPILATION_ERROR:
-                data = {'veredict': VeredictCode.WA, 'title': VeredictCode.WA.label,
-                        'message': VeredictCode.WA.message(), 'feedback': compile_error_to_html_table(excp.message)}
+            data = exception_verdict(problem, excp)
     else:
         data = {'veredict': VeredictCode.VE, 'title': VeredictCode.VE.label,
                 'message': VeredictCode.VE.message(), 'feedback': ''}
 
     submission = Submission(code=code, veredict_code=data['veredict'], veredict_message=data['message'],
-                            user=request.user, problem=general_problem)
+                            user=request.user, problem=problem)
+    if timings is not None:
+        submission.execution_time, submission.judge_time = timings.execution_time, timings.judge_time
+        submission.queue_time, submission.num_rows = timings.queue_time, timings.num_rows
     submission.save()
     # If verdict is correct look for an achievement to complete if it's possible
     achieve_list = check_if_get_achievement(request.user, data['veredict'])
@@ -562,6 +627,19 @@ def download_ranking(request, collection_id):
     return HttpResponseForbidden("Forbidden")
 
 
+@staff_member_required
+def export_collection(_, collection_id):
+    """Downloads a collection as a ZIP file that can be loaded in another instance"""
+    collection = get_object_or_404(Collection, pk=collection_id)
+    return export_response([collection])
+
+
+@staff_member_required
+def export_collections(_):
+    """Downloads all the collections as a ZIP file containing a ZIP file for each collection"""
+    return export_response(list(Collection.objects.order_by('position', 'pk')))
+
+
 @staff_member_required
 def statistics_submissions(request):
     """ Shows statistics page containing charts and other summarized information """
@@ -579,43 +657,62 @@ def statistics_submissions(request):
                    'wa_submissions_count': wa_submissions,
                    're_submissions_count': re_submissions,
                    'submission_count': sub_count,
-                   'participating_users': involved_users})
+                   'participating_users': involved_users,
+                   'execution_times': execution_time_per_problem()})
+
+
+@staff_member_required
+def judge_metrics(_):
+    """Returns a JSON with the count and percentiles of the duration of the stages of the judge in this process"""
+    return JsonResponse({'stages': STAGE_METRICS.summary(), 'admission': get_admission().status(),
+                         'throttle': get_throttle().status()})
+
+
+def judge_metrics_prometheus(request):
+    """Metrics of the judge in Prometheus text format, available for staff users or requests including the header
+    'Authorization: Bearer <token>' with the token in the environment variable METRICS_TOKEN"""
+    token = os.environ.get('METRICS_TOKEN')
+    authorized = token and request.headers.get('Authorization') == f'Bearer {token}'
+    if not authorized and not request.user.is_staff:
+        return HttpResponseForbidden()
+    return HttpResponse(STAGE_METRICS.prometheus() + get_admission().prometheus() + get_throttle().prometheus(),
+                        content_type='text/plain; version=0.0.4; charset=utf-8')
 
 
 @login_required
 @require_POST
 def get_hint(request, problem_id):
     """Returns a JSON with the information of available Hints"""
-    problem = get_object_or_404(Problem, pk=problem_id)
-    num_subs = Submission.objects.filter(problem=problem, user=request.user).count()
-    list_hints = Hint.objects.filter(problem=problem).order_by('num_submit')
-    list_used_hints = UsedHint.objects.filter(user=request.user.pk).filter(hint_definition__problem=problem)
+    # Hints of the problem with the number of submissions of the user and whether each hint has been used, in one query
+    num_subs = Submission.objects.filter(problem=problem_id, user=request.user).order_by() \
+        .values('problem').annotate(count=Count('pk')).values('count')
+    hints = list(Hint.objects.filter(problem=problem_id).order_by('num_submit', 'pk').annotate(
+        used=Exists(UsedHint.objects.filter(user=request.user, hint_definition=OuterRef('pk'))),
+        num_subs=Coalesce(Subquery(num_subs), 0)))
+    if not hints:
+        get_object_or_404(Problem, pk=problem_id)  # Error 404 if the problem does not exist
     data = {'hint': '', 'msg': '', 'more_hints': False}
-    num_hint = list_used_hints.count()
+    num_used = len([hint for hint in hints if hint.used])
+    hint = next((hint for hint in hints if not hint.used), None)
 
     # if there are not more hints available
-    if list_hints.count() == list_used_hints.count():
+    if hint is None:
         data['more_hints'] = False
         data['msg'] = _('No hay más pistas disponibles para este ejercicio.')
-    else:
-        hint = list_hints[num_hint]
-
-        # if the number of wrong submission is less than the number of submissions
-        if num_subs >= hint.num_submit:
-            name = _('Pista {number}').format(number=list_used_hints.count()+1)
-            context = {'name': name, 'text': hint.get_text_html()}
-            html = render_to_string('hint.html', context)
-            data['hint'] = html
-            used_hint = UsedHint(user=request.user, hint_definition=hint)
-            used_hint.save()
-            if list_hints.count() == list_used_hints.count():
-                data['more_hints'] = False
-                data['msg'] = _('No hay más pistas disponibles para este ejercicio.')
-            else:
-                data['more_hints'] = True
+    # if the number of wrong submission is less than the number of submissions
+    elif hint.num_subs >= hint.num_submit:
+        name = _('Pista {number}').format(number=num_used + 1)
+        context = {'name': name, 'text': hint.get_text_html()}
+        data['hint'] = render_to_string('hint.html', context)
+        UsedHint.objects.create(user=request.user, hint_definition=hint)
+        if num_used + 1 == len(hints):
+            data['more_hints'] = False
+            data['msg'] = _('No hay más pistas disponibles para este ejercicio.')
         else:
-            num = hint.num_submit - num_subs
             data['more_hints'] = True
-            data['msg'] = _('Número de envíos que faltan para obtener la siguiente pista: {number}.').format(number=num)
+    else:
+        num = hint.num_submit - hint.num_subs
+        data['more_hints'] = True
+        data['msg'] = _('Número de envíos que faltan para obtener la siguiente pista: {number}.').format(number=num)
 
     return JsonResponse(data)
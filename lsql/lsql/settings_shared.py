@@ -95,6 +95,10 @@ DATABASES = {
 }
 
 
+# Executor of the judge, dotted path of its class (see judge.executor)
+JUDGE_EXECUTOR = os.environ.get('JUDGE_EXECUTOR', 'judge.oracle_driver.OracleExecutor')
+
+
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
 